@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Micro-benchmark of the decoding of core dump notes.
+
+Measures the cost per note of decoding NT_PRPSINFO, NT_PRSTATUS and
+NT_SIGINFO descriptors for every supported architecture, and compares it
+with the construct-based decoding of NT_PRPSINFO used previously.
+
+Usage::
+
+  $ PYTHONPATH=. ./benchmarks/bench_notes.py [-n NUMBER]
+"""
+
+import argparse
+import timeit
+from collections import namedtuple
+from elftools.construct import CString, StaticField
+from elftools.elf.structs import Struct, ULInt64, ULInt32, UBInt8
+from vestricius import elf
+
+
+_Core = namedtuple('_Core', ['machine', 'elfclass', 'little_endian'])
+
+_PRPSINFO_CONSTRUCT = Struct('elf_psinfo',
+                             UBInt8('pr_state'),
+                             UBInt8('pr_sname'),
+                             UBInt8('pr_zomb'),
+                             UBInt8('pr_nice'),
+                             ULInt64('pr_flag'),
+                             ULInt32('gap'),
+                             ULInt32('pr_uid'),
+                             ULInt32('pr_gid'),
+                             ULInt32('pr_pid'),
+                             ULInt32('pr_ppid'),
+                             ULInt32('pr_pgrp'),
+                             ULInt32('pr_sid'),
+                             StaticField('pr_fname', 16),
+                             StaticField('pr_psargs', 80))
+
+
+def parse_construct(note):
+    psinfo = _PRPSINFO_CONSTRUCT.parse(note.desc)
+    fname = CString('').parse(psinfo['pr_fname']).decode('latin-1')
+    psargs = CString('').parse(psinfo['pr_psargs']).decode('latin-1')
+    return elf.ProcessInfo(fname, psargs)
+
+
+def measure(func, note, core, number):
+    seconds = timeit.timeit(lambda: func(note, core), number=number)
+    return seconds / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number',
+                        type=int,
+                        default=100000,
+                        help='number of decodings per measure')
+    args = parser.parse_args()
+
+    parsers = [('NT_PRPSINFO', 'prpsinfo', elf.parse_note),
+               ('NT_PRSTATUS', 'prstatus', elf.parse_prstatus_note),
+               ('NT_SIGINFO', 'siginfo', elf.parse_siginfo_note)]
+
+    print("{:<10} {:>5} {:<6} {:<12} {:>10}".format('arch', 'class',
+                                                   'endian', 'note',
+                                                   'ns/note'))
+    for key, decoders in sorted(elf._DECODERS.items()):
+        core = _Core(*key)
+        arch = elf._MACHINE_ARCHS[core.machine]
+        endian = 'little' if core.little_endian else 'big'
+        for name, field, func in parsers:
+            desc = bytes(getattr(decoders, field).size)
+            note = elf.Note('CORE', 0, memoryview(desc), 0)
+            cost = measure(func, note, core, args.number)
+            print("{:<10} {:>5} {:<6} {:<12} {:>10.0f}".format(arch,
+                                                              core.elfclass,
+                                                              endian,
+                                                              name,
+                                                              cost))
+
+    note = elf.Note('CORE', 0, memoryview(bytes(136)), 0)
+    cost = measure(lambda n, c: parse_construct(n), note, None, args.number)
+    print("{:<10} {:>5} {:<6} {:<12} {:>10.0f}".format('construct', 64,
+                                                      'little',
+                                                      'NT_PRPSINFO', cost))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -39,14 +39,18 @@ setup(name='vestricius',
       keywords=[],
       install_requires=[
           'colorama>=0.3',
-          'pyelftools>=0.23',
+          'pyelftools>=0.33',
           'pystache>=0.5.4',
       ],
+      extras_require={
+          'zstd': ['zstandard>=0.11'],
+          'gzip-index': ['indexed_gzip>=1.0'],
+      },
       classifiers=[
           'Development Status :: 3 - Alpha',
           'Programming Language :: Python :: 3',
       ],
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests']),
       data_files=[
           ('share/zsh/site-functions', glob('shell-completion/zsh/_*')),
       ],
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Helpers generating test data
+"""
+
+import struct
+from vestricius import elf
+
+# Address of the stack and of the program counter in generated core dumps.
+STACK_ADDRESS = 0x7ffd0000
+PC_ADDRESS = 0x401000
+
+_X64 = 62
+
+
+def _pad(data):
+    return data + bytes(-len(data) % 4)
+
+
+def make_note(name, n_type, desc):
+    name = name.encode('ascii') + b'\0'
+    header = struct.pack('<III', len(name), len(desc), n_type)
+    return header + _pad(name) + _pad(desc)
+
+
+def make_core(stack=b'', pid=42, signal=11, name=b'crasher',
+              pc=PC_ADDRESS, files=None):
+    """Generates a x64 core dump of a single-threaded process.
+
+    @param stack: contents of the stack, dumped in a PT_LOAD segment
+    @type stack: bytes
+
+    @param pc: program counter of the thread
+    @type pc: int
+
+    @param files: start, end, offset and path of the file-backed mappings,
+    the executable being mapped at 0x400000 by default
+    @type files: list of (int, int, int, bytes)
+
+    @return: the core dump
+    @rtype: bytes
+    """
+    decoders = elf._DECODERS[(_X64, 64, True)]
+    prpsinfo = decoders.prpsinfo.pack(0, 0, 0, 0, 0, 0, 0, pid, 1, pid, pid,
+                                      name, name + b' --crash')
+    registers = [0] * 27
+    registers[decoders.registers.pc] = pc
+    registers[decoders.registers.sp] = STACK_ADDRESS
+    prstatus = decoders.prstatus.pack(signal, 0, 0, signal, 0, 0,
+                                      pid, 1, pid, pid,
+                                      *([0] * 8 + registers))
+    if files is None:
+        files = [(0x400000, 0x402000, 0, b'/usr/bin/' + name)]
+    nt_file = struct.pack('<QQ', len(files), 4096)
+    for start, end, offset, path in files:
+        nt_file += struct.pack('<QQQ', start, end, offset // 4096)
+    nt_file += b''.join(f[3] + b'\0' for f in files)
+    auxv = struct.pack('<QQQQ', elf.AT_ENTRY, PC_ADDRESS, 0, 0)
+    notes = (make_note('CORE', elf.NT_PRSTATUS, prstatus) +
+             make_note('CORE', elf.NT_PRPSINFO, prpsinfo) +
+             make_note('CORE', elf.NT_AUXV, auxv) +
+             make_note('CORE', elf.NT_FILE, nt_file))
+    phoff = 64
+    notes_offset = phoff + 2 * 56
+    stack_offset = notes_offset + len(notes)
+    ehdr = elf._ELFMAG + bytes([2, 1, 1]) + bytes(9)
+    ehdr += struct.pack('<HHIQQQIHHHHHH', 4, _X64, 1, 0, phoff, 0, 0, 64,
+                        56, 2, 0, 0, 0)
+    phdrs = struct.pack('<IIQQQQQQ', elf.PT_NOTE, 0, notes_offset, 0, 0,
+                        len(notes), 0, 1)
+    phdrs += struct.pack('<IIQQQQQQ', elf.PT_LOAD, 6, stack_offset,
+                         STACK_ADDRESS, 0, len(stack), len(stack), 4096)
+    return ehdr + phdrs + notes + stack
+
+
+def _make_newc_entry(name, mode, data):
+    name = name.encode('utf-8') + b'\0'
+    fields = [0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+    header = b'070701' + b''.join(b'%08x' % f for f in fields)
+    return _pad(header + name) + _pad(data)
+
+
+def _make_odc_entry(name, mode, data):
+    name = name.encode('utf-8') + b'\0'
+    header = b'070707' + b'%06o%06o%06o%06o%06o%06o%06o%011o%06o%011o' % (
+        0, 0, mode, 0, 0, 1, 0, 0, len(name), len(data))
+    return header + name + data
+
+
+def make_cpio(members, odc=False):
+    """Generates a cpio archive.
+
+    @param members: name, mode and data of the members
+    @type members: list of (str, int, bytes)
+
+    @param odc: True for the odc format, False for the newc one
+    @type odc: bool
+
+    @return: the archive
+    @rtype: bytes
+    """
+    make_entry = _make_odc_entry if odc else _make_newc_entry
+    entries = [make_entry(n, m, d) for n, m, d in members]
+    entries.append(make_entry('TRAILER!!!', 0, b''))
+    return b''.join(entries)
+
+# vim: ts=4 sw=4 sts=4 et ai
+
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from vestricius.backtraces import BacktraceStore
+
+
+class TestBacktraceStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = BacktraceStore(os.path.join(self.folder, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lookup(self):
+        fingerprint = 'ab' * 20
+        self.assertIsNone(self.store.lookup(fingerprint))
+        self.store.add(fingerprint, '/usr/bin/gdb', ['#0  main ()'])
+        self.assertEqual(self.store.lookup(fingerprint),
+                         ('/usr/bin/gdb', ['#0  main ()']))
+        self.assertEqual(os.listdir(os.path.join(self.store.root, 'ab')),
+                         ['ab' * 19])
+
+    def test_invalid(self):
+        fingerprint = 'cd' * 20
+        self.store.add(fingerprint, '/usr/bin/gdb', ['#0  main ()'])
+        with open(os.path.join(self.store.root, 'cd', 'cd' * 19), 'w') as f:
+            f.write('{"debugger": ')
+        self.assertIsNone(self.store.lookup(fingerprint))
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from vestricius.buildid import BuildIdStore
+from vestricius.elf import read_build_id
+
+
+class TestBuildIdStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.tree = os.path.join(self.folder, 'tree')
+        os.makedirs(self.tree)
+        shutil.copy(sys.executable, self.tree)
+        self.executable = os.path.join(self.tree,
+                                       os.listdir(self.tree)[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lookup(self):
+        build_id = read_build_id(self.executable)
+        if build_id is None:
+            self.skipTest('executable without build-id')
+        root = os.path.join(self.folder, 'store')
+        store = BuildIdStore(root)
+        self.assertEqual(store.lookup(build_id, [self.tree]),
+                         self.executable)
+        # Known build-ids are found without indexing.
+        store = BuildIdStore(root)
+        self.assertEqual(store.lookup(build_id, [self.tree]),
+                         self.executable)
+        self.assertEqual(store._validated, set())
+        self.assertIsNone(store.lookup('00' * 20, [self.tree]))
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import os
+import time
+import shutil
+import tarfile
+import tempfile
+import unittest
+from vestricius import tarindex
+from vestricius.cache import ExtractionCache
+from vestricius.common import ArchiveAdapter
+from vestricius.downloads import DownloadCache
+from vestricius.tarindex import TarIndexStore
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _age(path, seconds):
+    st = os.stat(path)
+    os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = ExtractionCache(os.path.join(self.folder, 'cache'),
+                                     64 * 1024)
+        os.makedirs(self.cache.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _add(self, name, size):
+        path = _write(os.path.join(self.folder, name), name.encode())
+        key = self.cache.get_key(path, 'test')
+        staging = self.cache.create()
+        _write(os.path.join(staging, 'file'), os.urandom(size))
+        self.cache.commit(key, staging, {'name': name})
+        return key
+
+    def test_lookup(self):
+        key = self._add('a', 1000)
+        folder, metadata = self.cache.lookup(key)
+        self.assertEqual(metadata, {'name': 'a'})
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'file')))
+        self.assertIsNone(self.cache.lookup('0' * 40))
+
+    def test_evict(self):
+        a = self._add('a', 30000)
+        b = self._add('b', 30000)
+        _age(os.path.join(self.cache.root, a, 'size'), 20)
+        _age(os.path.join(self.cache.root, b, 'size'), 10)
+        # The least recently used entry goes first.
+        self.cache.lookup(a)
+        c = self._add('c', 30000)
+        self.assertIsNotNone(self.cache.lookup(a))
+        self.assertIsNone(self.cache.lookup(b))
+        self.assertIsNotNone(self.cache.lookup(c))
+
+    def test_archive(self):
+        path = os.path.join(self.folder, 'archive.tar')
+        with tarfile.open(path, 'w') as tar:
+            info = tarfile.TarInfo('core')
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b'core'))
+        for i in range(2):
+            with ArchiveAdapter(path, {'core': 'core'},
+                                cache=self.cache) as adapter:
+                core = adapter.get_path('core')
+                self.assertTrue(core.startswith(self.cache.root))
+        # Cached members are not removed after use.
+        self.assertTrue(os.path.exists(core))
+
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = DownloadCache(self.folder, 64 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _add(self, name, size):
+        path = self.cache.get_path('ftp://server/', name, size, 'date')
+        _write(path, os.urandom(size))
+        self.cache.commit(path)
+        return path
+
+    def test_evict(self):
+        a = self._add('a', 30000)
+        b = self._add('b', 30000)
+        _age(os.path.dirname(a), 20)
+        _age(os.path.dirname(b), 10)
+        self.assertTrue(self.cache.lookup(a))
+        c = self._add('c', 30000)
+        self.assertTrue(self.cache.lookup(a))
+        self.assertFalse(self.cache.lookup(b))
+        self.assertTrue(self.cache.lookup(c))
+
+    def test_partial(self):
+        # Entries with a download in progress are kept.
+        a = self.cache.get_path('ftp://server/', 'a', 100000, 'date')
+        _write(a + '.part', os.urandom(100000))
+        self._add('b', 1000)
+        self.assertTrue(os.path.exists(a + '.part'))
+
+
+@unittest.skipIf(tarindex.indexed_gzip is None, 'indexed_gzip not available')
+class TestTarIndexStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, 'index')
+        os.makedirs(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _make_tarball(self, name):
+        path = os.path.join(self.folder, name)
+        with tarfile.open(path, 'w:gz') as tar:
+            data = os.urandom(100000)
+            info = tarfile.TarInfo('core')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def _count(self):
+        return sum(len(files) for _, _, files in os.walk(self.root))
+
+    def test_read(self):
+        store = TarIndexStore(self.root, min_size=0)
+        path = self._make_tarball('a.tar.gz')
+        for i in range(2):
+            tarball = store.open(path)
+            name, size, offset = tarball.members[0][:3]
+            self.assertEqual((name, size), ('core', 100000))
+            self.assertEqual(len(tarball.read_at(offset, size)), size)
+            tarball.close()
+        self.assertEqual(self._count(), 2)
+
+    def test_evict_stale(self):
+        store = TarIndexStore(self.root, min_size=0)
+        path = self._make_tarball('a.tar.gz')
+        store.open(path).close()
+        # The tarball is downloaded again.
+        time.sleep(0.01)
+        path = self._make_tarball('a.tar.gz')
+        store.open(path).close()
+        self.assertEqual(self._count(), 2)
+
+    def test_evict_quota(self):
+        store = TarIndexStore(self.root, min_size=0)
+        store.open(self._make_tarball('a.tar.gz')).close()
+        store = TarIndexStore(self.root, min_size=0, quota=1)
+        store.open(self._make_tarball('b.tar.gz')).close()
+        self.assertEqual(self._count(), 2)
+
+# vim: ts=4 sw=4 sts=4 et ai
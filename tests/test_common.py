@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import stat
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from unittest import mock
+from vestricius import common
+from vestricius.common import copy_sparse, make_temp_dir, open_archive
+from vestricius.common import ArchiveAdapter
+from vestricius.common import DecompressedFileAdapter, InvalidFileError
+from vestricius.fileindex import FileIndex
+from .helpers import make_cpio
+
+
+_BLOCK = 4096
+
+_VERSION = b'''
+  FOO_VERSION=1.2.3
+BAR_VERSION = 4.5
+FOO_BUILD=nightly
+'''
+
+
+class TestFindFiles(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for path in ('a/bin/gdb', 'a/lib/sub/libc.so.6', 'a/lib/libc.so.6',
+                     'b/vmlinux', 'b/bin/gdb'):
+            path = os.path.join(self.folder, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+        self.paths = [os.path.join(self.folder, p) for p in ('a', 'b')]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_find_files(self):
+        patterns = {'debugger': r'^gdb$',
+                    'libc': r'^libc\.so',
+                    'kernel': r'^vmlinux$',
+                    'missing': r'^missing$'}
+        found = common.find_files(patterns, self.paths)
+        # The first file found in the order of the paths is kept, and the
+        # files of a directory come before those of its subdirectories.
+        self.assertEqual(found, {
+            'debugger': os.path.join(self.folder, 'a/bin/gdb'),
+            'libc': os.path.join(self.folder, 'a/lib/libc.so.6'),
+            'kernel': os.path.join(self.folder, 'b/vmlinux')})
+
+    def test_find_file(self):
+        self.assertEqual(common.find_file(r'^vmlinux$', self.paths),
+                         os.path.join(self.folder, 'b/vmlinux'))
+        with self.assertRaises(common.FileNotFoundError):
+            common.find_file(r'^missing$', self.paths)
+
+    def test_find_file_in_index(self):
+        index = FileIndex(os.path.join(self.folder, 'files.db'))
+        self.assertEqual(common.find_file(r'^gdb$', self.paths, index),
+                         os.path.join(self.folder, 'a/bin/gdb'))
+        with self.assertRaises(common.FileNotFoundError):
+            common.find_file(r'^missing$', self.paths, index)
+        # The first file is found in the order of the paths.
+        self.assertEqual(common.find_file(r'^(vmlinux|libc\..*)$',
+                                          self.paths, index),
+                         os.path.join(self.folder, 'a/lib/libc.so.6'))
+        index.close()
+
+    def test_invalid_combination(self):
+        # Patterns which can not be combined are checked one by one.
+        patterns = {'debugger': r'^(?P<name>gdb)$',
+                    'other': r'^(?P<name>vmlinux)$'}
+        found = common.find_files(patterns, self.paths)
+        self.assertEqual(sorted(found), ['debugger', 'other'])
+
+
+class TestCopySparse(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'copy')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _copy(self, data):
+        with open(self.path, 'wb') as dst:
+            result = copy_sparse(io.BytesIO(data), dst, _BLOCK)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        return result
+
+    def test_holes(self):
+        data = (os.urandom(_BLOCK) + bytes(64 * _BLOCK) +
+                os.urandom(_BLOCK // 2) + bytes(_BLOCK // 2) +
+                os.urandom(10))
+        written, size = self._copy(data)
+        self.assertEqual(size, len(data))
+        self.assertEqual(written, 3 * _BLOCK // 2 + 10 + _BLOCK // 2)
+        self.assertLess(os.stat(self.path).st_blocks * 512, len(data))
+
+    def test_trailing_zeros(self):
+        data = os.urandom(100) + bytes(10 * _BLOCK)
+        written, size = self._copy(data)
+        self.assertEqual(size, len(data))
+        self.assertEqual(written, _BLOCK)
+
+    def test_chunks(self):
+        # Larger than a chunk, which is not a multiple of the block size.
+        data = os.urandom(common._CHUNK_SIZE + 1000)
+        written, size = self._copy(data)
+        self.assertEqual((written, size), (len(data), len(data)))
+
+    def test_empty(self):
+        self.assertEqual(self._copy(b''), (0, 0))
+
+
+
+class TestExtractHints(unittest.TestCase):
+    patterns = {'foo': r'^FOO_VERSION=(.*)$',
+                'bar': r'^BAR_VERSION\s*=\s*\S+$',
+                'missing': r'^BAZ_VERSION=(.*)$'}
+    expected = {'foo': '1.2.3', 'bar': 'BAR_VERSION = 4.5'}
+
+    def test_sources(self):
+        # The value is the first group, or the whole match without group.
+        for source in (_VERSION, _VERSION.decode(), io.BytesIO(_VERSION)):
+            self.assertEqual(common.extract_hints(source, self.patterns),
+                             self.expected)
+
+    def test_stop(self):
+        # The text is no longer read once all hints are found.
+        lines = iter(_VERSION.splitlines(True) + [b'\xff' * 10] * 1000)
+        patterns = dict(self.patterns)
+        del patterns['missing']
+        self.assertEqual(common.extract_hints(lines, patterns), self.expected)
+        self.assertEqual(len(list(lines)), 1000)
+
+    def test_search_text(self):
+        self.assertEqual(common.search_text(_VERSION, r'^FOO_BUILD=(.*)$'),
+                         'nightly')
+        with self.assertRaises(common.NoMatchError):
+            common.search_text(_VERSION, r'^BAZ_VERSION=(.*)$')
+
+
+class _ArchiveTestCase(unittest.TestCase):
+    members = [('data/core', 0o600, os.urandom(200000) + bytes(100000)),
+               ('data/version', 0o644, b'FOO_VERSION=1.2.3\n'),
+               ('data/empty', 0o755, b'')]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # RAM-backed storage is faked by a directory.
+        self.memory = os.path.join(self.folder, 'shm')
+        os.makedirs(self.memory)
+        patcher = mock.patch.object(common, '_MEMORY_DIR', self.memory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _make_tar(self, mode='w', name='archive.tar', symlink=True):
+        path = os.path.join(self.folder, name)
+        with tarfile.open(path, mode) as tar:
+            for member, perms, data in self.members:
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                info.mode = perms
+                tar.addfile(info, io.BytesIO(data))
+            if symlink:
+                info = tarfile.TarInfo('data/latest')
+                info.type = tarfile.SYMTYPE
+                info.linkname = 'core'
+                tar.addfile(info)
+        return path
+
+    def _make_zip(self):
+        path = os.path.join(self.folder, 'archive.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            for member, perms, data in self.members:
+                info = zipfile.ZipInfo(member)
+                info.external_attr = (stat.S_IFREG | perms) << 16
+                z.writestr(info, data)
+            info = zipfile.ZipInfo('data/latest')
+            info.external_attr = (stat.S_IFLNK | 0o777) << 16
+            z.writestr(info, b'core')
+        return path
+
+    def _make_cpio(self, odc=False, compress=False):
+        members = [(n, stat.S_IFREG | m, d) for n, m, d in self.members]
+        members.append(('data/latest', stat.S_IFLNK | 0o777, b'core'))
+        data = make_cpio(members, odc)
+        if compress:
+            return self._write('archive.cpio.gz', gzip.compress(data))
+        return self._write('archive.cpio', data)
+
+
+class TestArchiveReaders(_ArchiveTestCase):
+    def _check(self, path):
+        expected = dict((n, (m, d)) for n, m, d in self.members)
+        with open_archive(path) as archive:
+            found = {}
+            for member in archive:
+                if member.symlink is not None:
+                    self.assertEqual(member.name, 'data/latest')
+                    self.assertEqual(member.symlink, 'core')
+                    continue
+                with archive.open(member) as f:
+                    found[member.name] = (member.mode, f.read())
+                self.assertEqual(member.size, len(found[member.name][1]))
+        self.assertEqual(found, expected)
+
+    def test_tar(self):
+        self._check(self._make_tar())
+
+    def test_compressed_tar(self):
+        self._check(self._make_tar('w:gz', 'archive.tar.gz'))
+        self._check(self._make_tar('w:xz', 'archive.tar.xz'))
+
+    def test_zip(self):
+        self._check(self._make_zip())
+
+    def test_cpio(self):
+        self._check(self._make_cpio())
+        self._check(self._make_cpio(odc=True))
+
+    def test_compressed_cpio(self):
+        self._check(self._make_cpio(compress=True))
+
+    def test_cpio_skip_members(self):
+        # Members of a compressed archive which are not opened are skipped.
+        with open_archive(self._make_cpio(compress=True)) as archive:
+            members = [m for m in archive if m.name == 'data/version']
+        self.assertEqual(len(members), 1)
+
+    def test_invalid(self):
+        data = make_cpio([('core', stat.S_IFREG | 0o600, b'core')])
+        # The trailer is replaced by garbage.
+        path = self._write('archive.cpio', data[:-124] + b'x' * 124)
+        with self.assertRaises(InvalidFileError):
+            with open_archive(path) as archive:
+                list(archive)
+
+
+class TestArchiveAdapter(_ArchiveTestCase):
+    def test_extract_all(self):
+        for path in (self._make_tar(), self._make_zip(), self._make_cpio()):
+            with ArchiveAdapter(path) as adapter:
+                folder = adapter.folder
+                core = os.path.join(folder, 'data', 'core')
+                with open(core, 'rb') as f:
+                    self.assertEqual(f.read(), self.members[0][2])
+                self.assertEqual(stat.S_IMODE(os.stat(core).st_mode), 0o600)
+                latest = os.path.join(folder, 'data', 'latest')
+                self.assertEqual(os.readlink(latest), 'core')
+            self.assertFalse(os.path.exists(folder))
+
+    def test_extract_members(self):
+        patterns = {'core': r'^core$', 'version': r'^version$'}
+        with ArchiveAdapter(self._make_tar(), patterns) as adapter:
+            self.assertEqual(adapter.read('version'), self.members[1][2])
+            with open(adapter.get_path('core'), 'rb') as f:
+                self.assertEqual(f.read(), self.members[0][2])
+            with self.assertRaises(common.FileNotFoundError):
+                adapter.read('missing')
+            # Members matching no hint are not extracted.
+            self.assertFalse(os.path.exists(os.path.join(adapter.folder,
+                                                         'data', 'empty')))
+
+    def test_decompress_member(self):
+        data = os.urandom(100000) + bytes(1000000)
+        self.members = [('core.gz', 0o600, gzip.compress(data))]
+        path = self._make_tar('w:gz', 'archive.tar.gz', symlink=False)
+        # The member is moved to disk if it does not fit in memory.
+        for threshold in (None, 200000):
+            with ArchiveAdapter(path, {'core': r'^core'},
+                                memory_threshold=threshold,
+                                decompress=['core']) as adapter:
+                core = adapter.get_path('core')
+                self.assertEqual(os.path.basename(core), 'core')
+                with open(core, 'rb') as f:
+                    self.assertEqual(f.read(), data)
+                self.assertEqual(os.listdir(os.path.dirname(core)), ['core'])
+                self.assertEqual(core.startswith(self.memory),
+                                 threshold is None)
+
+
+class TestOpenDecompressed(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = os.urandom(100000) + bytes(common._CHUNK_SIZE)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_formats(self):
+        for name, compress in (('gzip', gzip.compress),
+                               ('xz', lzma.compress),
+                               ('bzip2', bz2.compress)):
+            path = self._write('core', compress(self.data))
+            self.assertEqual(common.get_compression(path), name)
+            # External tools are used if available.
+            for external in (False, True):
+                with common.open_decompressed(path, external) as f:
+                    self.assertEqual(f.read(1000), self.data[:1000])
+                    self.assertEqual(f.read(), self.data[1000:])
+
+    def test_corrupted(self):
+        data = bytearray(gzip.compress(self.data))
+        data[len(data) // 2:] = bytes(len(data) - len(data) // 2)
+        path = self._write('core.gz', data)
+        for external in (False, True):
+            with common.open_decompressed(path, external) as f:
+                with self.assertRaises(OSError):
+                    f.read()
+
+    def test_not_compressed(self):
+        path = self._write('core', self.data)
+        self.assertIsNone(common.get_compression(path))
+        with self.assertRaises(InvalidFileError):
+            common.open_decompressed(path)
+
+
+class TestMemoryStorage(_ArchiveTestCase):
+    def test_make_temp_dir(self):
+        for size, threshold, in_memory in ((1000, None, True),
+                                           (None, None, False),
+                                           (1000, 100, False)):
+            folder = make_temp_dir(size, threshold)
+            self.assertEqual(os.path.dirname(folder) == self.memory,
+                             in_memory)
+            os.rmdir(folder)
+
+    def test_extract(self):
+        # Only the members fitting below the threshold go to memory.
+        patterns = {'core': r'^core$', 'version': r'^version$'}
+        with ArchiveAdapter(self._make_tar(), patterns,
+                            memory_threshold=1000) as adapter:
+            version = adapter.get_path('version')
+            core = adapter.get_path('core')
+            self.assertTrue(version.startswith(self.memory))
+            self.assertFalse(core.startswith(self.memory))
+            self.assertEqual(adapter.read('version'), self.members[1][2])
+        self.assertEqual(os.listdir(self.memory), [])
+
+
+class TestDecompressedFileAdapter(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_decompress(self):
+        data = os.urandom(1000) + bytes(100000)
+        path = os.path.join(self.folder, 'core.gz')
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(data))
+        with DecompressedFileAdapter(path) as adapter:
+            decompressed = adapter.path
+            self.assertEqual(os.path.basename(decompressed), 'core')
+            with open(decompressed, 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.exists(decompressed))
+
+    def test_not_compressed(self):
+        path = os.path.join(self.folder, 'core')
+        with open(path, 'wb') as f:
+            f.write(b'core')
+        with DecompressedFileAdapter(path) as adapter:
+            self.assertEqual(adapter.path, path)
+        self.assertTrue(os.path.exists(path))
+
+# vim: ts=4 sw=4 sts=4 et ai
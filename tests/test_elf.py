@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import gzip
+import lzma
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+from array import array
+from collections import namedtuple
+from vestricius import elf
+from vestricius.common import InvalidFileError
+from .helpers import make_core, STACK_ADDRESS, PC_ADDRESS
+
+_Core = namedtuple('_Core', ['machine', 'elfclass', 'little_endian'])
+
+
+def _note(desc):
+    return elf.Note('CORE', 0, memoryview(desc), 0)
+
+
+class TestDecoders(unittest.TestCase):
+    def test_prpsinfo(self):
+        for key, decoders in elf._DECODERS.items():
+            core = _Core(*key)
+            desc = bytearray(decoders.prpsinfo.size)
+            # pr_fname and pr_psargs are the last fields.
+            offset = decoders.prpsinfo.size - 96
+            desc[offset:offset + 7] = b'crasher'
+            desc[offset + 16:offset + 25] = b'crasher x'
+            info = elf.parse_note(_note(bytes(desc)), core)
+            self.assertEqual(info, elf.ProcessInfo('crasher', 'crasher x'),
+                             key)
+
+    def test_prstatus(self):
+        for key, decoders in elf._DECODERS.items():
+            core = _Core(*key)
+            count = len(decoders.prstatus.unpack(
+                bytes(decoders.prstatus.size)))
+            registers = list(range(1, count - elf._PRSTATUS_REG + 1))
+            desc = decoders.prstatus.pack(11, 0, 0, 11, 0, 0, 1234, 1, 0, 0,
+                                          *([0] * 8 + registers))
+            status = elf.parse_prstatus_note(_note(desc), core)
+            self.assertEqual(status.pid, 1234, key)
+            self.assertEqual(status.signal, 11, key)
+            self.assertEqual(list(status.registers), registers, key)
+
+    def test_prstatus_unknown_machine(self):
+        core = _Core(0xffff, 64, True)
+        self.assertIsNone(elf.parse_prstatus_note(_note(bytes(512)), core))
+        self.assertIsNone(elf.get_key_registers(core))
+
+    def test_siginfo(self):
+        for key, decoders in elf._DECODERS.items():
+            core = _Core(*key)
+            values = [0, 0, 0]
+            signo, code, errno = decoders.machine.siginfo
+            values[signo], values[code], values[errno] = 11, 1, 0
+            desc = decoders.siginfo.pack(*values, 0xdead)
+            info = elf.parse_siginfo_note(_note(desc), core)
+            self.assertEqual(info, elf.SignalInfo(11, 1, 0, 0xdead), key)
+
+    def test_file_note(self):
+        for little_endian in (True, False):
+            prefix = '<' if little_endian else '>'
+            core = _Core(40, 32, little_endian)
+            desc = struct.pack(prefix + 'II', 3, 4096)
+            desc += struct.pack(prefix + '9I',
+                                0x1000, 0x2000, 0,
+                                0x2000, 0x3000, 1,
+                                0x8000, 0x9000, 0)
+            desc += b'/bin/a\0/bin/a\0/lib/b\0'
+            mappings = elf.parse_file_note(_note(desc), core)
+            self.assertEqual(len(mappings), 3)
+            self.assertEqual(mappings.paths, ['/bin/a', '/lib/b'])
+            self.assertEqual(mappings[1],
+                             elf.FileMapping(0x2000, 0x3000, 4096, '/bin/a'))
+            self.assertEqual(mappings.find(0x8800).path, '/lib/b')
+            self.assertIsNone(mappings.find(0x3000))
+
+    def test_file_note_invalid_count(self):
+        core = _Core(40, 32, True)
+        entries = struct.pack('<6I', 0x1000, 0x2000, 0, 0x8000, 0x9000, 0)
+        # The count is capped to the entries and names of the descriptor.
+        for count, names in ((0xffffffff, b'/a\0/b\0'),
+                             (3, b'/a\0/b\0'),
+                             (2, b'/a\0/b'),
+                             (2, b'')):
+            desc = struct.pack('<II', count, 4096) + entries + names
+            mappings = elf.parse_file_note(_note(desc), core)
+            paths = [m.path for m in mappings]
+            self.assertEqual(paths, ['/a', '/b'][:names.count(0)])
+        self.assertEqual(len(elf.parse_file_note(_note(b'\0' * 4), core)), 0)
+
+    def test_auxv_note(self):
+        core = _Core(62, 64, False)
+        desc = struct.pack('>4Q', elf.AT_ENTRY, 0x401000, 0, 0)
+        auxv = elf.parse_auxv_note(_note(desc), core)
+        self.assertEqual(auxv[elf.AT_ENTRY], 0x401000)
+
+
+class TestCoreFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'core')
+        with open(self.path, 'wb') as f:
+            f.write(make_core(b'stack'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_notes(self):
+        with elf.CoreFile(self.path) as core:
+            self.assertEqual(core.arch, 'x64')
+            notes = [(n.name, n.type) for n in core.iter_notes()]
+            self.assertEqual(notes, [('CORE', elf.NT_PRSTATUS),
+                                     ('CORE', elf.NT_PRPSINFO),
+                                     ('CORE', elf.NT_AUXV),
+                                     ('CORE', elf.NT_FILE)])
+
+    def test_read_memory(self):
+        with elf.CoreFile(self.path) as core:
+            self.assertEqual(bytes(core.read_memory(STACK_ADDRESS, 5)),
+                             b'stack')
+            self.assertIsNone(core.read_memory(STACK_ADDRESS + 4, 2))
+            self.assertIsNone(core.find_segment(0))
+
+
+class TestThreadTable(unittest.TestCase):
+    def test_append(self):
+        for key in elf._DECODERS:
+            registers = elf.get_key_registers(_Core(*key))
+            threads = elf.ThreadTable(registers)
+            for tid in (100, 101):
+                values = list(range(tid, tid + 64))
+                threads.append(elf.ThreadStatus(tid, 0, values))
+            self.assertEqual(len(threads), 2)
+            thread = threads[1]
+            self.assertEqual(thread.tid, 101, key)
+            self.assertEqual(thread.pc, 101 + registers.pc, key)
+            self.assertEqual(thread.sp, 101 + registers.sp, key)
+            if registers.lr is None:
+                self.assertIsNone(thread.lr, key)
+            else:
+                self.assertEqual(thread.lr, 101 + registers.lr, key)
+
+
+class _Memory:
+    """Address space of a x64 process, with a code and a stack segment."""
+    machine = 62
+    elfclass = 64
+    little_endian = True
+
+    def __init__(self, code, stack):
+        self._segments = [
+            (elf.Segment(elf.PT_LOAD, elf.PF_X, 0, code, 0, 0x2000), None),
+            (elf.Segment(elf.PT_LOAD, 0, 0, STACK_ADDRESS, len(stack),
+                         len(stack)), stack)]
+
+    def find_segment(self, address):
+        for segment, data in self._segments:
+            if segment.vaddr <= address < segment.vaddr + segment.memsz:
+                return segment
+        return None
+
+    def read_memory(self, address, size):
+        for segment, data in self._segments:
+            offset = address - segment.vaddr
+            if data is not None and 0 <= offset <= len(data) - size:
+                return memoryview(data)[offset:offset + size]
+        return None
+
+
+class TestFingerprint(unittest.TestCase):
+    def _compute(self, code, signal=11, stack=None):
+        if stack is None:
+            # Return addresses in the executable, mixed with other values.
+            stack = struct.pack('<6Q', 1, code + 0x123, 0xdead, 0,
+                                code + 0x456, STACK_ADDRESS)
+        memory = _Memory(code, stack)
+        mappings = elf.FileMappings(array('Q', [code]),
+                                    array('Q', [code + 0x2000]),
+                                    array('Q', [0]),
+                                    array('L', [0]),
+                                    ['/usr/bin/crasher'])
+        registers = elf.get_key_registers(memory)
+        values = [0] * 27
+        values[registers.pc] = code + 0x10
+        values[registers.sp] = STACK_ADDRESS
+        status = elf.ThreadStatus(42, signal, values)
+        return elf.compute_fingerprint(memory, status, mappings, 'crasher')
+
+    def test_relocated(self):
+        # The fingerprint does not depend on where the executable is loaded.
+        fingerprint = self._compute(0x400000)
+        self.assertEqual(len(fingerprint), 40)
+        self.assertEqual(fingerprint, self._compute(0x7f0000000000))
+
+    def test_different(self):
+        fingerprint = self._compute(0x400000)
+        self.assertNotEqual(fingerprint, self._compute(0x400000, signal=6))
+        stack = struct.pack('<2Q', 0x400000 + 0x123, 0x400000 + 0x789)
+        self.assertNotEqual(fingerprint, self._compute(0x400000, stack=stack))
+
+    def test_missing_stack(self):
+        self.assertIsNone(self._compute(0x400000, stack=b''))
+
+
+class TestCoreDumpFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = make_core(os.urandom(256 * 1024))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_plain(self):
+        info = elf.parse_core_dump_file(self._write('core', self.data))
+        self.assertEqual(info.process_info,
+                         elf.ProcessInfo('crasher', 'crasher --crash'))
+        self.assertEqual(info.executable, '/usr/bin/crasher')
+        self.assertEqual(info.mappings.paths, ['/usr/bin/crasher'])
+        self.assertIsNotNone(info.fingerprint)
+        threads = list(info.threads)
+        self.assertEqual(len(threads), 1)
+        self.assertEqual(threads[0].tid, 42)
+        self.assertEqual(threads[0].signal, 11)
+        self.assertEqual(threads[0].pc, PC_ADDRESS)
+        self.assertEqual(threads[0].sp, STACK_ADDRESS)
+
+    def test_compressed(self):
+        expected = elf.parse_core_dump_file(self._write('core', self.data))
+        for name, compress in (('core.gz', gzip.compress),
+                               ('core.xz', lzma.compress)):
+            path = self._write(name, compress(self.data))
+            info = elf.parse_core_dump_file(path)
+            self.assertEqual(info.process_info, expected.process_info)
+            self.assertEqual(info.fingerprint, expected.fingerprint)
+
+    def test_truncated(self):
+        expected = elf.parse_core_dump_file(self._write('core', self.data))
+        size = len(self.data) // 2
+        for name, data in (('core', self.data[:size]),
+                           ('core.gz', gzip.compress(self.data)[:size])):
+            info = elf.parse_core_dump_file(self._write(name, data))
+            self.assertEqual(info.process_info, expected.process_info)
+            # The part of the stack used for the fingerprint is available.
+            self.assertEqual(info.fingerprint, expected.fingerprint)
+
+    def test_truncated_notes(self):
+        with elf.CoreFile(self._write('core', self.data)) as core:
+            offsets = dict((n.type, n.offset) for n in core.iter_notes())
+        # The core dump is cut in the middle of the NT_AUXV note.
+        size = offsets[elf.NT_AUXV] + 20
+        for name, data in (('core', self.data[:size]),
+                           ('core.gz', gzip.compress(self.data[:size]))):
+            path = self._write(name, data)
+            with elf.CoreFile(path) as core:
+                types = [n.type for n in core.iter_notes()]
+            self.assertEqual(types, [elf.NT_PRSTATUS, elf.NT_PRPSINFO])
+            info = elf.parse_core_dump_file(path)
+            self.assertEqual(info.process_info.name, 'crasher')
+            self.assertIsNone(info.executable)
+        # Without the NT_PRPSINFO note, the file is not a core dump.
+        size = offsets[elf.NT_PRPSINFO] + 20
+        with self.assertRaises(InvalidFileError):
+            elf.parse_core_dump_file(self._write('core', self.data[:size]))
+
+    def test_stack_beyond_limit(self):
+        # Only the headers and the notes are decompressed.
+        limit = len(self.data) - 256 * 1024 + 100
+        path = self._write('core.gz', gzip.compress(self.data))
+        with mock.patch.object(elf, '_STREAM_LIMIT', limit):
+            info = elf.parse_core_dump_file(path)
+        self.assertEqual(info.process_info.name, 'crasher')
+        self.assertIsNone(info.fingerprint)
+
+    def test_truncated_headers(self):
+        for name, data in (('core', self.data[:100]),
+                           ('core.gz', gzip.compress(self.data)[:100])):
+            with self.assertRaises(InvalidFileError):
+                elf.parse_core_dump_file(self._write(name, data))
+
+    def test_not_core(self):
+        with self.assertRaises(InvalidFileError):
+            elf.parse_core_dump_file(self._write('core', b'\0' * 4096))
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import threading
+import unittest
+from vestricius import fetcher
+from vestricius.fetcher import Fetcher
+
+
+class _FakeFetcher(Fetcher):
+    """Fetcher counting the files retrieved at the same time."""
+    url = 'fake://server/'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = 0
+        self.max_running = 0
+
+    def lookup(self, pattern=None, count=1):
+        return []
+
+    def fetch(self, pattern=None, dest=None, callback=None):
+        return None
+
+    def retrieve(self, filename, dest=None, callback=None):
+        with self._lock:
+            self._running += 1
+            self.max_running = max(self.max_running, self._running)
+        try:
+            time.sleep(0.01)
+            if filename == 'missing':
+                raise FileNotFoundError(filename)
+            callback(0, 1024, 4096)
+            callback(4, 1024, 4096)
+            return os.path.join(dest, filename)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+class TestRetrieveMany(unittest.TestCase):
+    def test_retrieve_many(self):
+        filenames = ['crash-{}'.format(i) for i in range(8)]
+        source = _FakeFetcher()
+        paths, failures = source.retrieve_many(filenames + ['missing'],
+                                               '/tmp', jobs=2)
+        # The paths are given in the order of the files.
+        self.assertEqual(paths, [os.path.join('/tmp', fn)
+                                 for fn in filenames])
+        self.assertEqual([fn for fn, e in failures], ['missing'])
+        self.assertIsInstance(failures[0][1], FileNotFoundError)
+        self.assertEqual(source.max_running, 2)
+
+    def test_counter(self):
+        # Only the bytes transferred after resuming are counted.
+        counter = fetcher._TransferCounter()
+        self.assertEqual(counter.transferred, 0)
+        counter(5, 8192, 100000)
+        counter(13, 8192, 100000)
+        self.assertEqual(counter.transferred, 100000 - 5 * 8192)
+        # The size of files being retrieved may be unknown.
+        counter = fetcher._TransferCounter()
+        counter(0, 8192, -1)
+        counter(2, 8192, -1)
+        self.assertEqual(counter.transferred, 2 * 8192)
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from vestricius import fileindex
+from vestricius.fileindex import FileIndex
+
+
+
+class TestFileIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.tree = os.path.join(self.folder, 'tree')
+        for path in ('bin/ls', 'lib/libc.so.6', 'lib/sub/libm.so.6'):
+            self._touch(path)
+        self.index = FileIndex(os.path.join(self.folder, 'files.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.folder)
+
+    def _touch(self, path):
+        path = os.path.join(self.tree, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+        return path
+
+    def test_find(self):
+        self.assertEqual(self.index.find_name('libm.so.6', [self.tree]),
+                         os.path.join(self.tree, 'lib/sub/libm.so.6'))
+        self.assertEqual(self.index.find(r'^libc\.', [self.tree]),
+                         os.path.join(self.tree, 'lib/libc.so.6'))
+        self.assertIsNone(self.index.find_name('gdb', [self.tree]))
+
+    def test_refresh(self):
+        self.index.update([self.tree])
+        serial = self.index.serial
+        added = self._touch('lib/sub/new/libz.so.1')
+        index = FileIndex(self.index.filename)
+        self.assertEqual(index.find_name('libz.so.1', [self.tree]), added)
+        # Only the files of the modified directories are listed.
+        files = list(index.iter_files([self.tree], serial))
+        self.assertIn(added, files)
+        self.assertNotIn(os.path.join(self.tree, 'bin/ls'), files)
+        index.close()
+
+    def test_root(self):
+        # The tree under / is selected without doubling the separator.
+        root = os.sep
+        params = fileindex._tree(root)
+        db = self.index._connect()
+        db.execute("INSERT INTO dirs VALUES ('/usr/bin', 0, 1)")
+        db.execute("INSERT INTO files VALUES ('/usr/bin', 'gdb')")
+        rows = db.execute("SELECT name FROM files WHERE " + fileindex._FILES,
+                          params).fetchall()
+        self.assertEqual(rows, [('gdb',)])
+
+# vim: ts=4 sw=4 sts=4 et ai
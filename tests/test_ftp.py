@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+from datetime import datetime
+from ftplib import error_perm, error_temp
+from unittest import mock
+from vestricius.downloads import DownloadCache
+from vestricius.fetchers import ftp
+from vestricius.fetchers.ftp import FTPConnectionPool, FTPFetcher
+
+_DATE = '20200102030405'
+
+
+class _Connection:
+    """Data connection of :class:`_FakeFTP`."""
+    def __init__(self, data):
+        self._data = data
+
+    def makefile(self, mode):
+        return io.BytesIO(self._data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+class _FakeFTP:
+    """Control connection to a server holding some files."""
+    encoding = 'utf-8'
+
+    def __init__(self, files):
+        self.files = files
+        self.dates = dict((fn, _DATE) for fn in files)
+        self.offsets = []
+        # Number of bytes sent before the next transfer is interrupted.
+        self.drop_after = None
+        self.use_mlsd = True
+        self.has_mlsd = True
+        # Number of commands sent at once by each call to sendall().
+        self.batches = []
+        self.sock = self
+        self._responses = []
+
+    def mlsd(self):
+        if not self.has_mlsd:
+            raise error_perm('500 Unknown command')
+        yield '.', {'type': 'cdir', 'modify': _DATE}
+        for fn, data in self.files.items():
+            yield fn, {'type': 'file',
+                       'size': str(len(data)),
+                       'modify': self.dates[fn]}
+
+    def retrlines(self, cmd, callback):
+        for fn in sorted(self.files, key=self.dates.get, reverse=True):
+            callback('-rw-r--r-- 1 ftp ftp {} Jan 02 03:04 {}'
+                     .format(len(self.files[fn]), fn))
+
+    def sendall(self, data):
+        lines = data.decode(self.encoding).splitlines()
+        self.batches.append(len(lines))
+        for line in lines:
+            self._responses.append('213 ' + self.dates[line.split()[1]])
+
+    def getresp(self):
+        return self._responses.pop(0)
+
+    def voidcmd(self, cmd):
+        return '200 OK'
+
+    def size(self, filename):
+        return len(self.files[filename])
+
+    def transfercmd(self, cmd, rest=None):
+        self.offsets.append(rest)
+        data = self.files[cmd.split()[1]][rest or 0:]
+        if self.drop_after is not None:
+            data = data[:self.drop_after]
+            self.drop_after = None
+        return _Connection(data)
+
+    def voidresp(self):
+        return '226 Transfer complete'
+
+
+class _PooledConnection:
+    """Control connection created by the pool, without any server."""
+    created = []
+
+    def __init__(self, host, port, username, password):
+        self.host = host
+        self.closed = False
+        self.alive = True
+        self.last_used = 0
+        self.created.append(self)
+
+    def voidcmd(self, cmd):
+        if not self.alive:
+            raise EOFError
+        return '200 OK'
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestFTPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        _PooledConnection.created = []
+        patcher = mock.patch.object(ftp, '_PooledFTP', _PooledConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = FTPConnectionPool(max_idle=1)
+
+    def test_reuse(self):
+        for i in range(2):
+            with self.pool.connection('server') as connection:
+                self.assertEqual(connection.host, 'server')
+        with self.pool.connection('other'):
+            pass
+        self.assertEqual([c.host for c in _PooledConnection.created],
+                         ['server', 'other'])
+
+    def test_max_idle(self):
+        with self.pool.connection('server') as first:
+            with self.pool.connection('server') as second:
+                self.assertIsNot(first, second)
+        # Only one idle connection is kept.
+        self.assertFalse(second.closed)
+        self.assertTrue(first.closed)
+        self.pool.close()
+        self.assertTrue(second.closed)
+
+    def test_error(self):
+        # The connection is kept if the server only refused a command.
+        with self.assertRaises(error_perm):
+            with self.pool.connection('server') as first:
+                raise error_perm('550 No such file')
+        self.assertFalse(first.closed)
+        with self.assertRaises(error_temp):
+            with self.pool.connection('server') as second:
+                raise error_temp('421 Timeout')
+        self.assertIs(first, second)
+        self.assertTrue(second.closed)
+        with self.pool.connection('server') as third:
+            self.assertIsNot(third, second)
+
+    def test_stale(self):
+        with self.pool.connection('server') as first:
+            pass
+        first.alive = False
+        # Recently used connections are not checked.
+        with self.pool.connection('server') as second:
+            self.assertIs(first, second)
+        # Connections idle for long are checked before being reused.
+        first.last_used -= ftp._CHECK_DELAY
+        with self.pool.connection('server') as second:
+            self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        second.last_used -= ftp._CHECK_DELAY
+        with self.pool.connection('server') as third:
+            self.assertIs(second, third)
+
+
+def _create_fetcher(server, cache=None):
+    fetcher = FTPFetcher('ftp://server/crashes/', retry_delay=0, cache=cache)
+    fetcher._connect = lambda: contextlib.nullcontext(server)
+    return fetcher
+
+
+class TestFTPFetcher(unittest.TestCase):
+    def setUp(self):
+        self.server = _FakeFTP({'crash-1.tar.gz': b'1',
+                                'crash-2.tar.gz': b'22',
+                                'other.tar.gz': b'333'})
+        self.server.dates.update({'crash-1.tar.gz': '20200101000000',
+                                  'other.tar.gz': '20210101000000'})
+
+    def _check_lookup(self):
+        fetcher = _create_fetcher(self.server)
+        self.assertEqual(fetcher.lookup(r'^crash', 2),
+                         [('crash-2.tar.gz', '2020-01-02--03:04:05'),
+                          ('crash-1.tar.gz', '2020-01-01--00:00:00')])
+        self.assertEqual(fetcher.lookup(), [('other.tar.gz',
+                                             '2021-01-01--00:00:00')])
+
+    def test_lookup(self):
+        self._check_lookup()
+        self.assertEqual(self.server.batches, [])
+
+    def test_lookup_invalid_date(self):
+        self.server.dates['crash-2.tar.gz'] = '2020-01-02'
+        fetcher = _create_fetcher(self.server)
+        self.assertEqual(fetcher.lookup(r'^crash', 2),
+                         [('crash-1.tar.gz', '2020-01-01--00:00:00')])
+
+    def test_lookup_without_mlsd(self):
+        self.server.has_mlsd = False
+        self._check_lookup()
+        self.assertFalse(self.server.use_mlsd)
+        self.assertEqual(self.server.batches, [2, 1])
+
+    def test_pipeline(self):
+        # The MDTM commands are sent by batches.
+        self.server.use_mlsd = False
+        fetcher = _create_fetcher(self.server)
+        with mock.patch.object(ftp, '_PIPELINE_SIZE', 2):
+            entries = fetcher._list(self.server)
+        self.assertEqual([e.name for e in entries],
+                         ['other.tar.gz', 'crash-2.tar.gz', 'crash-1.tar.gz'])
+        self.assertEqual(self.server.batches, [2, 1])
+
+    def test_dates(self):
+        responses = ['213 20200102030405.123', '213 2020', '213',
+                     '213 20200102030405 UTC', '550 Not a plain file']
+
+        def getresp():
+            response = responses.pop(0)
+            if response.startswith('5'):
+                raise error_perm(response)
+            return response
+
+        self.server.sendall = lambda data: None
+        self.server.getresp = getresp
+        fetcher = _create_fetcher(self.server)
+        dates = fetcher._get_dates(self.server, ['a', 'b', 'c', 'd', 'e'])
+        date = datetime(2020, 1, 2, 3, 4, 5)
+        # Files whose time is refused get the epoch.
+        epoch = ftp._parse_time(None)
+        self.assertEqual(dates, [date, None, None, date, epoch])
+
+
+class TestRetrieve(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        self.server = _FakeFTP({'crash.tar.gz': self.data,
+                                'empty.tar.gz': b''})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_retrieve(self):
+        fetcher = _create_fetcher(self.server)
+        path = fetcher.retrieve('crash.tar.gz', self.folder)
+        self.assertEqual(self._read(path), self.data)
+        self.assertEqual(os.listdir(self.folder), ['crash.tar.gz'])
+        self.assertEqual(self.server.offsets, [None])
+
+    def test_retrieve_empty(self):
+        fetcher = _create_fetcher(self.server)
+        path = fetcher.retrieve('empty.tar.gz', self.folder)
+        self.assertEqual(self._read(path), b'')
+        self.assertEqual(self.server.offsets, [])
+
+    def test_resume(self):
+        fetcher = _create_fetcher(self.server)
+        self.server.drop_after = 30000
+        path = fetcher.retrieve('crash.tar.gz', self.folder)
+        self.assertEqual(self._read(path), self.data)
+        self.assertEqual(self.server.offsets, [None, 30000])
+
+    def test_resume_later(self):
+        # A part left by a previous process is resumed.
+        fetcher = _create_fetcher(self.server)
+        path = os.path.join(self.folder, 'crash.tar.gz')
+        with fetcher._connect() as server:
+            remote = fetcher._stat(server, 'crash.tar.gz')
+        with open(path + ftp._CHECKPOINT_SUFFIX, 'w') as f:
+            json.dump(remote, f)
+        with open(path + ftp._PART_SUFFIX, 'wb') as f:
+            f.write(self.data[:5000])
+        fetcher.retrieve('crash.tar.gz', self.folder)
+        self.assertEqual(self._read(path), self.data)
+        self.assertEqual(self.server.offsets, [5000])
+
+    def test_restart_changed(self):
+        # A part of a file which changed on the server is discarded.
+        fetcher = _create_fetcher(self.server)
+        path = os.path.join(self.folder, 'crash.tar.gz')
+        with open(path + ftp._CHECKPOINT_SUFFIX, 'w') as f:
+            json.dump({'url': 'other', 'size': 1, 'date': _DATE}, f)
+        with open(path + ftp._PART_SUFFIX, 'wb') as f:
+            f.write(b'x' * 5000)
+        fetcher.retrieve('crash.tar.gz', self.folder)
+        self.assertEqual(self._read(path), self.data)
+        self.assertEqual(self.server.offsets, [None])
+
+    def test_give_up(self):
+        fetcher = _create_fetcher(self.server)
+        fetcher._retries = 0
+        self.server.drop_after = 30000
+        with self.assertRaises(EOFError):
+            fetcher.retrieve('crash.tar.gz', self.folder)
+
+    def test_cache(self):
+        cache = DownloadCache(os.path.join(self.folder, 'cache'), 1 << 30)
+        os.makedirs(cache.root)
+        fetcher = _create_fetcher(self.server, cache)
+        dest = os.path.join(self.folder, 'out')
+        for i in range(2):
+            path = fetcher.retrieve('crash.tar.gz', dest)
+            self.assertEqual(self._read(path), self.data)
+            self.assertEqual(os.listdir(dest), ['crash.tar.gz'])
+        # The second retrieval is served from the cache.
+        self.assertEqual(self.server.offsets, [None])
+
+    def test_retrieve_many(self):
+        fetcher = _create_fetcher(self.server)
+        paths, failures = fetcher.retrieve_many(['crash.tar.gz', 'missing'],
+                                                self.folder)
+        self.assertEqual(paths, [os.path.join(self.folder, 'crash.tar.gz')])
+        self.assertEqual([fn for fn, e in failures], ['missing'])
+
+
+class TestLink(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'crash.tar.gz')
+        with open(self.path, 'wb') as f:
+            f.write(b'crash')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_link(self):
+        dest = os.path.join(self.folder, 'out')
+        for i in range(2):
+            target = ftp._link(self.path, dest)
+            self.assertTrue(os.path.samefile(target, self.path))
+            self.assertEqual(os.listdir(dest), ['crash.tar.gz'])
+
+    def test_replace(self):
+        dest = os.path.join(self.folder, 'out')
+        os.makedirs(dest)
+        with open(os.path.join(dest, 'crash.tar.gz'), 'wb') as f:
+            f.write(b'other')
+        target = ftp._link(self.path, dest)
+        self.assertTrue(os.path.samefile(target, self.path))
+        self.assertEqual(os.listdir(dest), ['crash.tar.gz'])
+
+    def test_copy(self):
+        # Files can not be linked across file systems.
+        dest = os.path.join(self.folder, 'out')
+        with mock.patch('os.link', side_effect=OSError):
+            target = ftp._link(self.path, dest)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'crash')
+        self.assertEqual(os.listdir(dest), ['crash.tar.gz'])
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
+from vestricius.debugger import UnwindError
+from vestricius.debuggers import native
+from vestricius.debuggers.native import NativeUnwinder
+from vestricius.symbols import build_symbol_index
+from .helpers import make_core
+
+# Address where the executable is mapped in generated core dumps.
+_START = 0x555555554000
+
+
+class TestNativeUnwinder(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.name = os.path.basename(sys.executable)
+        self.functions = self._find_functions(sys.executable)
+        if len(self.functions) < 2:
+            self.skipTest('executable without call frame information')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _find_functions(self, path):
+        # Functions whose first instruction has call frame information.
+        module = native._Module(path, 0)
+        try:
+            functions = []
+            for start in build_symbol_index(module._elf)._starts:
+                if module.find_fde(start) is not None:
+                    functions.append((start, module.find_symbol(start)))
+            return functions
+        except UnwindError:
+            return []
+        finally:
+            module.close()
+
+    def _write_core(self, pc, stack, folder=b'/usr/bin/'):
+        path = os.path.join(self.folder, 'core')
+        files = [(_START, _START + 0x100000, 0, folder + self.name.encode())]
+        with open(path, 'wb') as f:
+            f.write(make_core(stack, pc=pc, files=files))
+        return path
+
+    def test_unwind(self):
+        (callee, callee_name), (caller, caller_name) = self.functions[:2]
+        # The callee has just been called by the first instruction of the
+        # caller, so its return address is on the top of the stack.
+        ra = _START + caller + 1
+        path = self._write_core(_START + callee,
+                                struct.pack('<QQ', ra, 0) + bytes(256))
+        unwinder = NativeUnwinder()
+        # Only the sections holding call frame information are read.
+        with mock.patch.object(ELFFile, 'get_dwarf_info',
+                               side_effect=AssertionError):
+            lines = unwinder.generate_backtrace(path, sys.executable)
+        where = 'from /usr/bin/' + self.name
+        self.assertEqual(lines[:2], [
+            '#0  0x{:016x} in {} () {}'.format(_START + callee, callee_name,
+                                               where),
+            '#1  0x{:016x} in {} () {}'.format(ra, caller_name, where)])
+
+    def test_invalid_pc(self):
+        # A call through an invalid pointer is unwound from the stack.
+        callee = self.functions[0][0]
+        path = self._write_core(0x10,
+                                struct.pack('<QQ', _START + callee + 1, 0))
+        lines = NativeUnwinder().generate_backtrace(path, sys.executable)
+        self.assertTrue(lines[0].startswith('#0  0x0000000000000010 in ??'))
+        self.assertIn(self.functions[0][1], lines[1])
+
+    def test_missing_stack(self):
+        callee = self.functions[0][0]
+        path = self._write_core(_START + callee, b'')
+        with self.assertRaises(UnwindError):
+            NativeUnwinder().generate_backtrace(path, sys.executable)
+
+    def test_missing_module(self):
+        path = self._write_core(_START + self.functions[0][0], bytes(16),
+                                b'/nonexistent/')
+        with self.assertRaises(UnwindError):
+            NativeUnwinder().generate_backtrace(path, '/nonexistent/vm')
+
+    def test_invalid_module(self):
+        path = os.path.join(self.folder, self.name)
+        with open(path, 'wb') as f:
+            f.write(b'\x7fELF' + bytes(60))
+        with self.assertRaises(UnwindError):
+            with native._parsing():
+                native._Module(path, 0)
+
+    def test_close_invalid_module(self):
+        files = []
+
+        def parse(f):
+            files.append(f)
+            raise ELFError('invalid')
+
+        with mock.patch.object(native, 'ELFFile', parse):
+            with self.assertRaises(ELFError):
+                native._Module(sys.executable, 0)
+        self.assertTrue(files[0].closed)
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from vestricius import elf
+from vestricius.plugins.simple import SimpleCoreHaruspex
+from .helpers import make_core
+
+
+class TestSimpleCoreHaruspex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'core.gz')
+        with open(self.path, 'wb') as f:
+            f.write(gzip.compress(make_core(os.urandom(256 * 1024))))
+        self.analyzer = mock.Mock()
+        self.analyzer.lookup.return_value = None
+        self.analyzer.find_executable.return_value = '/usr/bin/crasher'
+        self.haruspex = SimpleCoreHaruspex(
+            {'core-dump-analyzer': self.analyzer}, 'ftp://server/')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_analyze(self):
+        self.haruspex.analyze_core_dump(self.path)
+        self.analyzer.find_executable.assert_called_once()
+        programfile = self.analyzer.analyze.call_args[0][2]
+        self.assertEqual(programfile, '/usr/bin/crasher')
+
+    def test_analyze_without_fingerprint(self):
+        # The executable is only looked up once the crash is not known.
+        with mock.patch.object(elf, '_STREAM_LIMIT', 4096):
+            self.haruspex.analyze_core_dump(self.path)
+        self.analyzer.find_executable.assert_not_called()
+        programfile = self.analyzer.analyze.call_args[0][2]
+        self.assertIsNone(programfile)
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from array import array
+from elftools.elf.elffile import ELFFile
+from vestricius.symbols import SymbolIndex, SymbolCache
+from vestricius.symbols import build_symbol_index, load_symbol_index
+
+
+def _make_index():
+    return SymbolIndex(array('Q', [0x1000, 0x1100, 0x1200]),
+                       array('Q', [0x80, 0, 0x10]),
+                       array('Q', [0, 5, 11]),
+                       b'main\0start\0helper\0')
+
+
+class TestSymbolIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _check(self, index):
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.lookup(0x1000), 'main')
+        self.assertEqual(index.lookup(0x107f), 'main')
+        self.assertIsNone(index.lookup(0x1080))
+        self.assertIsNone(index.lookup(0xfff))
+        # Symbols without size extend up to the next one.
+        self.assertEqual(index.lookup(0x11ff), 'start')
+        self.assertEqual(index.lookup(0x1208), 'helper')
+
+    def test_lookup(self):
+        self._check(_make_index())
+
+    def test_save(self):
+        filename = os.path.join(self.folder, 'index')
+        _make_index().save(filename)
+        index = load_symbol_index(filename)
+        self._check(index)
+        index.close()
+        self.assertEqual(os.listdir(self.folder), ['index'])
+
+    def test_load_invalid(self):
+        filename = os.path.join(self.folder, 'index')
+        _make_index().save(filename)
+        with open(filename, 'r+b') as f:
+            f.truncate(os.path.getsize(filename) - 1)
+        self.assertIsNone(load_symbol_index(filename))
+        open(filename, 'w').close()
+        self.assertIsNone(load_symbol_index(filename))
+
+
+class TestSymbolCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = SymbolCache(os.path.join(self.folder, 'cache'))
+        self.file = open(sys.executable, 'rb')
+        self.elf = ELFFile(self.file)
+
+    def tearDown(self):
+        self.file.close()
+        shutil.rmtree(self.folder)
+
+    def test_get(self):
+        expected = build_symbol_index(self.elf)
+        if not len(expected):
+            self.skipTest('executable without function symbols')
+        address = expected._starts[0]
+        name = expected.lookup(address)
+        for i in range(2):
+            index = self.cache.get(self.elf, 'ab' * 20)
+            self.assertEqual(len(index), len(expected))
+            self.assertEqual(index.lookup(address), name)
+            # The second index is loaded from the cache.
+            self.assertEqual(index._map is not None, i == 1)
+            index.close()
+        self.assertEqual(os.listdir(os.path.join(self.cache.root, 'ab')),
+                         ['ab' * 19])
+
+    def test_invalid(self):
+        filename = os.path.join(self.cache.root, 'cd', 'cd' * 19)
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as f:
+            f.write(b'invalid')
+        index = self.cache.get(self.elf, 'cd' * 20)
+        self.assertEqual(len(index), len(build_symbol_index(self.elf)))
+        self.assertIsNotNone(load_symbol_index(filename))
+
+    def test_no_build_id(self):
+        self.cache.get(self.elf)
+        self.assertFalse(os.path.exists(self.cache.root))
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from vestricius.utils import atomic_write, iter_evictions
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'file')
+        with open(self.path, 'w') as f:
+            f.write('old')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_write(self):
+        with atomic_write(self.path, 'wb') as f:
+            f.write(b'new')
+            with open(self.path) as g:
+                self.assertEqual(g.read(), 'old')
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.folder), ['file'])
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with atomic_write(self.path) as f:
+                f.write('partial')
+                raise ValueError
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.folder), ['file'])
+
+
+class TestIterEvictions(unittest.TestCase):
+    def test_evictions(self):
+        entries = [(3, 'c', 10), (1, 'a', 10), (2, 'b', 10)]
+        self.assertEqual(list(iter_evictions(entries, 40, 40)), [])
+        self.assertEqual(list(iter_evictions(entries, 40, 25)),
+                         [(1, 'a', 10), (2, 'b', 10)])
+        # Entries which can not be removed still count.
+        self.assertEqual([e[1] for e in iter_evictions(entries, 100, 0)],
+                         ['a', 'b', 'c'])
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.backtraces
+   `````````````````````
+
+   Store of backtraces indexed by crash fingerprint
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import json
+from .log import debug
+from .utils import atomic_write
+from gettext import gettext as _
+
+
+class BacktraceStore:
+    """Stores the backtraces of already analyzed crashes.
+
+    The backtrace of the crash whose fingerprint is 'abcdef...' is stored in
+    the 'ab/cdef...' file, along with the path to the debugger which generated
+    it.
+
+    @param root: path to the store
+    @type root: str
+    """
+    def __init__(self, root):
+        self._root = root
+
+    @property
+    def root(self):
+        return self._root
+
+    def _get_path(self, fingerprint):
+        return os.path.join(self._root, fingerprint[:2], fingerprint[2:])
+
+    def lookup(self, fingerprint):
+        """Looks for the backtrace of a crash.
+
+        @param fingerprint: the fingerprint of the crash
+        @type fingerprint: str
+
+        @return: the path to the debugger and the lines of the backtrace, or
+        None if the crash is unknown
+        @rtype: tuple
+        """
+        try:
+            with open(self._get_path(fingerprint)) as f:
+                entry = json.load(f)
+            return entry['debugger'], entry['backtrace']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            debug(_("Ignoring backtrace of crash {} ({})")
+                  .format(fingerprint, e))
+            return None
+
+    def add(self, fingerprint, debugger, backtrace):
+        """Stores the backtrace of a crash.
+
+        @param fingerprint: the fingerprint of the crash
+        @type fingerprint: str
+
+        @param debugger: path to the debugger which generated the backtrace
+        @type debugger: str
+
+        @param backtrace: lines of the backtrace
+        @type backtrace: list of str
+        """
+        path = self._get_path(fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent instances must never read a partially written file.
+        with atomic_write(path) as f:
+            json.dump({'debugger': debugger, 'backtrace': backtrace}, f)
+
+# vim: ts=4 sw=4 sts=4 et ai
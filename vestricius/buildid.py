@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.buildid
+   ``````````````````
+
+   Store of ELF files indexed by GNU build-id
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import json
+import stat
+from .elf import read_build_id
+from .fileindex import FileIndex
+from .log import debug, info
+from .utils import atomic_write
+from gettext import gettext as _
+
+
+class BuildIdStore:
+    """Finds ELF files by GNU build-id.
+
+    The store uses the layout of the '.build-id' directory of debug file
+    systems: the file whose build-id is 'abcdef...' is referenced by the
+    'ab/cdef...' symbolic link. Any '.build-id' directory found at the top of
+    a search path is used as is.
+
+    The links are checked first, so a known build-id costs no traversal of
+    the search paths. On a miss, the files listed by the file index in the
+    directories scanned since the store was last updated are indexed.
+
+    @param root: path to the store
+    @type root: str
+
+    @param files: index of the files of the search paths, or None to keep
+    one in the store
+    @type files: :class:`FileIndex`
+    """
+    def __init__(self, root, files=None):
+        self._root = root
+        if files is None:
+            os.makedirs(root, exist_ok=True)
+            files = FileIndex(os.path.join(root, 'files.db'))
+        self._files = files
+        self._validated = set()
+        self._serials_file = os.path.join(root, 'serials.json')
+        self._serials = None
+
+    @property
+    def root(self):
+        return self._root
+
+    def _load_serials(self):
+        if self._serials is None:
+            try:
+                with open(self._serials_file) as f:
+                    self._serials = json.load(f)
+            except (OSError, ValueError):
+                self._serials = {}
+        return self._serials
+
+    def _save_serials(self):
+        os.makedirs(self._root, exist_ok=True)
+        with atomic_write(self._serials_file) as f:
+            json.dump(self._serials, f)
+
+    def index(self, paths):
+        """Indexes the ELF files found in some directories.
+
+        Directories already indexed by the process are skipped, and only the
+        files of the directories scanned by the file index since they were
+        last indexed are read.
+
+        @param paths: list of paths to directories
+        @type paths: list of str
+        """
+        serials = self._load_serials()
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in self._validated or not os.path.isdir(path):
+                continue
+            debug(_("Indexing build-ids of files in '{}'").format(path))
+            count = 0
+            for filename in self._files.iter_files([path],
+                                                   serials.get(path, 0)):
+                if self._index_file(filename):
+                    count += 1
+            serial = self._files.serial
+            if serials.get(path) != serial:
+                info(_("Indexed {} files of '{}'").format(count, path))
+                serials[path] = serial
+                self._save_serials()
+            self._validated.add(path)
+
+    def _index_file(self, filename):
+        try:
+            # Reading a FIFO or a device could block or never end.
+            if not stat.S_ISREG(os.stat(filename).st_mode):
+                return False
+            build_id = read_build_id(filename)
+        except OSError:
+            return False
+        return build_id is not None and self._add(build_id, filename)
+
+    def _add(self, build_id, filename):
+        folder = os.path.join(self._root, build_id[:2])
+        os.makedirs(folder, exist_ok=True)
+        link = os.path.join(folder, build_id[2:])
+        # A link to a file removed since it was indexed is replaced.
+        if os.path.exists(link):
+            return False
+        tmp = '{}.{}'.format(link, os.getpid())
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(filename, tmp)
+        os.replace(tmp, link)
+        return True
+
+    def lookup(self, build_id, paths=[]):
+        """Looks for the ELF file with a given build-id.
+
+        @param build_id: the build-id, as an hexadecimal string
+        @type build_id: str
+
+        @param paths: list of directories to index if the build-id is unknown
+        @type paths: list of str
+
+        @return: path to the ELF file, or None if not found
+        @rtype: str
+        """
+        path = self._find(build_id, paths)
+        if path is None:
+            self.index(paths)
+            path = self._find(build_id, paths)
+        return path
+
+    def _find(self, build_id, paths):
+        roots = [os.path.join(p, '.build-id') for p in paths]
+        roots.append(self._root)
+        for root in roots:
+            link = os.path.join(root, build_id[:2], build_id[2:])
+            if not os.path.exists(link):
+                continue
+            path = os.path.realpath(link)
+            # The file may have been replaced since it was indexed.
+            if read_build_id(path) == build_id:
+                return path
+            debug(_("Ignoring '{}', build-id does not match").format(path))
+        return None
+
+# vim: ts=4 sw=4 sts=4 et ai
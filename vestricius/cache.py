@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.cache
+   ````````````````
+
+   Cache of the files extracted from crash archives
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import time
+from .log import debug, info
+from .utils import atomic_write, iter_evictions
+from gettext import gettext as _
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# Number of file digests remembered.
+_MAX_DIGESTS = 1024
+
+# Staging directories older than this number of seconds have been left by
+# interrupted extractions.
+_STAGING_TIMEOUT = 24 * 60 * 60
+
+
+class ExtractionCache:
+    """Cache of the files extracted from archives, by content.
+
+    Each entry is a directory named after a digest of the content of the
+    archive and of the extraction parameters. It holds the extracted files in
+    its 'data' subdirectory, the metadata of the extraction and its size on
+    disk. Entries are built in a staging directory, then renamed, so an entry
+    is always complete.
+
+    When the size of the entries exceeds the quota, the least recently used
+    ones are removed.
+
+    The digests of the archives are remembered by path, size and
+    modification time, so an archive is read only once to compute it.
+
+    @param root: path to the cache
+    @type root: str
+
+    @param quota: maximum size of the cache in bytes
+    @type quota: int
+    """
+    def __init__(self, root, quota):
+        self._root = root
+        self._quota = quota
+        self._digests_file = os.path.join(root, 'digests.json')
+        self._digests = None
+
+    @property
+    def root(self):
+        return self._root
+
+    def _load_digests(self):
+        if self._digests is None:
+            try:
+                with open(self._digests_file) as f:
+                    self._digests = json.load(f)
+            except (OSError, ValueError):
+                self._digests = {}
+        return self._digests
+
+    def _save_digests(self):
+        digests = self._digests
+        if len(digests) > _MAX_DIGESTS:
+            # Keep the most recently computed digests.
+            paths = sorted(digests, key=lambda p: digests[p][3])
+            for path in paths[:len(digests) - _MAX_DIGESTS]:
+                del digests[path]
+        with atomic_write(self._digests_file) as f:
+            json.dump(digests, f)
+
+    def get_digest(self, filename):
+        """Returns the digest of the content of a file.
+
+        @param filename: path to the file
+        @type filename: str
+
+        @return: the SHA-1 digest, as an hexadecimal string
+        @rtype: str
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        digests = self._load_digests()
+        known = digests.get(path)
+        if known and known[:2] == [st.st_size, st.st_mtime_ns]:
+            return known[2]
+        debug(_("Computing digest of '{}'").format(filename))
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        digests[path] = [st.st_size, st.st_mtime_ns, digest, time.time()]
+        self._save_digests()
+        return digest
+
+    def get_key(self, filename, *params):
+        """Returns the key of the extraction of a file.
+
+        @param filename: path to the file to extract
+        @type filename: str
+
+        @param params: parameters of the extraction, as strings
+        @type params: list of str
+
+        @return: the key
+        @rtype: str
+        """
+        items = [self.get_digest(filename)] + list(params)
+        return hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        """Looks for an entry, marking it as recently used.
+
+        @param key: the key of the entry
+        @type key: str
+
+        @return: the path to the extracted files and the metadata of the
+        entry, or None if there is no such entry
+        @rtype: tuple
+        """
+        entry = os.path.join(self._root, key)
+        try:
+            with open(os.path.join(entry, 'metadata.json')) as f:
+                metadata = json.load(f)
+            os.utime(os.path.join(entry, 'size'))
+        except (OSError, ValueError):
+            return None
+        info(_("Using cached extraction '{}'").format(entry))
+        return os.path.join(entry, 'data'), metadata
+
+    def create(self):
+        """Creates a staging directory for a new entry.
+
+        @return: the path to the directory to extract files to
+        @rtype: str
+        """
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self._root)
+        path = os.path.join(staging, 'data')
+        os.mkdir(path)
+        return path
+
+    def discard(self, path):
+        """Removes a staging directory.
+
+        @param path: the path returned by :meth:`create`
+        @type path: str
+        """
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def commit(self, key, path, metadata=None):
+        """Turns a staging directory into an entry.
+
+        @param key: the key of the entry
+        @type key: str
+
+        @param path: the path returned by :meth:`create`
+        @type path: str
+
+        @param metadata: metadata of the entry, serializable as JSON
+        @type metadata: dict
+
+        @return: the path to the extracted files
+        @rtype: str
+        """
+        staging = os.path.dirname(path)
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                # Holes of sparse files do not count.
+                size += os.lstat(os.path.join(root, f)).st_blocks * 512
+        with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+            json.dump(metadata or {}, f)
+        with open(os.path.join(staging, 'size'), 'w') as f:
+            f.write(str(size))
+        entry = os.path.join(self._root, key)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another process created the same entry in the meantime.
+            self.discard(path)
+        self._evict(key)
+        return os.path.join(entry, 'data')
+
+    def _evict(self, current):
+        entries = []
+        total = 0
+        for name in os.listdir(self._root):
+            if name.startswith('.staging-'):
+                self._remove_stale(name)
+                continue
+            path = os.path.join(self._root, name, 'size')
+            try:
+                with open(path) as f:
+                    size = int(f.read())
+                mtime = os.stat(path).st_mtime
+            except (OSError, ValueError):
+                continue
+            if name != current:
+                entries.append((mtime, name, size))
+            total += size
+        for mtime, name, size in iter_evictions(entries, total, self._quota):
+            debug(_("Removing cached extraction '{}'").format(name))
+            shutil.rmtree(os.path.join(self._root, name), ignore_errors=True)
+
+    def _remove_stale(self, name):
+        path = os.path.join(self._root, name)
+        try:
+            if os.stat(path).st_mtime > time.time() - _STAGING_TIMEOUT:
+                return
+        except OSError:
+            return
+        debug(_("Removing stale staging directory '{}'").format(name))
+        shutil.rmtree(path, ignore_errors=True)
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -140,6 +140,32 @@ class Application:
                        help=_('pattern of crash archive name'))
         p.set_defaults(func=self._parse_cmd_reveal)
 
+        p = subparsers.add_parser('fetch',
+                                  help=_('fetch the latest available archives'))
+        p.add_argument('-C', '--count',
+                       metavar=_('COUNT'),
+                       type=int,
+                       default=1,
+                       help=_('number of archives to fetch'))
+        p.add_argument('-d', '--directory',
+                       metavar=_('DIRECTORY'),
+                       help=_('set output directory'))
+        p.add_argument('-j', '--jobs',
+                       metavar=_('JOBS'),
+                       type=int,
+                       help=_('number of archives fetched at the same time'))
+        p.add_argument('-p', '--preset',
+                       metavar=_('PRESET'),
+                       help=_('name of the preset to use'))
+        p.add_argument('-P', '--pattern',
+                       metavar=_('EXPRESSION'),
+                       help=_('pattern of crash archive name'))
+        p.add_argument('filenames',
+                       metavar=_('FILE'),
+                       nargs='*',
+                       help=_('name of an archive to fetch'))
+        p.set_defaults(func=self._parse_cmd_fetch)
+
         p = subparsers.add_parser('peek',
                                   help=_('show information about the latest available archive'))
         p.add_argument('-C', '--count',
@@ -217,6 +243,20 @@ class Application:
         report = haruspex.reveal(args.pattern)
         self._handle_report(report, args.output)
 
+    def _parse_cmd_fetch(self, args):
+        haruspex = self._create_haruspex(args.preset)
+        paths, failures = haruspex.fetch(args.pattern,
+                                         args.count,
+                                         args.filenames,
+                                         args.directory,
+                                         args.jobs)
+        for path in paths:
+            print(path)
+        if failures:
+            msg = _("{} out of {} files could not be retrieved")
+            raise RuntimeError(msg.format(len(failures),
+                                          len(paths) + len(failures)))
+
     def _parse_cmd_peek(self, args):
         haruspex = self._create_haruspex(args.preset)
         results = haruspex.peek(args.pattern, args.count)
@@ -28,15 +28,28 @@
    :license: GPLv3+
 """
 
+import io
 import os
+import abc
 import re
+import stat
+import bz2
 import gzip
+import lzma
 import tempfile
 import shutil
 import tarfile
-from .log import debug, info
+import zipfile
+import subprocess
+from collections import namedtuple
+from .log import debug, info, warning
 from gettext import gettext as _
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 class FileNotFoundError(Exception):
     """Exception raised when a file can not be found"""
@@ -50,7 +63,55 @@ class NoMatchError(Exception):
     """Exception rasied when no matching item is found"""
 
 
-def find_file(pattern, paths):
+# Size of the chunks read while decompressing, and of the blocks checked for
+# zeros, which should match the block size of the file system.
+_CHUNK_SIZE = 1024 * 1024
+_SPARSE_BLOCK_SIZE = 4096
+_ZEROS = bytes(_CHUNK_SIZE)
+
+# Members of archives up to this size are read in memory instead of being
+# extracted.
+_SMALL_MEMBER_SIZE = 64 * 1024
+
+# Files up to this size are extracted to RAM-backed storage, if available.
+_MEMORY_THRESHOLD = 50 * 1024 * 1024
+_MEMORY_DIR = '/dev/shm'
+
+# Maximum compression ratio of deflate.
+_MAX_DEFLATE_RATIO = 1032
+
+# Compression formats, with the magic bytes and extension of the compressed
+# files, and the external tools able to decompress them using several
+# threads, the fastest first. Single-threaded tools are not worth a pipe
+# compared to the Python modules.
+_Compression = namedtuple('_Compression', ['name', 'magic', 'extension',
+                                           'commands'])
+
+_COMPRESSIONS = [
+    _Compression('gzip', b'\x1f\x8b', '.gz',
+                 [['pigz', '-dc']]),
+    _Compression('xz', b'\xfd7zXZ\x00', '.xz',
+                 [['xz', '-dc', '-T0']]),
+    _Compression('bzip2', b'BZh', '.bz2',
+                 [['lbzip2', '-dc'], ['pbzip2', '-dc']]),
+    _Compression('zstd', b'\x28\xb5\x2f\xfd', '.zst',
+                 [['zstd', '-dc', '-T0']]),
+]
+
+_MAGIC_SIZE = max(len(c.magic) for c in _COMPRESSIONS)
+
+# Magic bytes of the zip local file header and of the end of the central
+# directory of an empty zip file.
+_ZIP_MAGICS = (b'PK\x03\x04', b'PK\x05\x06')
+
+# Magic bytes of the portable ASCII (odc) and new ASCII (newc, with or
+# without checksum) cpio formats.
+_CPIO_ODC_MAGIC = b'070707'
+_CPIO_NEWC_MAGICS = (b'070701', b'070702')
+_CPIO_TRAILER = 'TRAILER!!!'
+
+
+def find_file(pattern, paths, index=None):
     """Find the needle in the haystack.
 
     @param pattern: pattern for the name of the file to look for
@@ -59,18 +120,88 @@ def find_file(pattern, paths):
     @param paths: list of paths to search into
     @type paths: list of str
 
+    @param index: index of the files of the paths, to use instead of walking
+    them
+    @type index: :class:`FileIndex`
+
     @return: the full path of the needle
     @rtype: str
     """
-    p = re.compile(pattern)
+    if index is not None:
+        debug(_("Looking up file matching '{}' in index").format(pattern))
+        path = index.find(pattern, paths)
+        if path is None:
+            raise FileNotFoundError(_("can not find '{}'").format(pattern))
+        return path
+    found = find_files({pattern: pattern}, paths)
+    if pattern not in found:
+        raise FileNotFoundError(_("can not find '{}'").format(pattern))
+    return found[pattern]
+
+
+def _iter_files(path):
+    # Same order as os.walk(): the files of a directory come before those of
+    # its subdirectories, which are not followed if they are symbolic links.
+    pending = [path]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                yield folder, entry.name
+            elif not entry.is_symlink():
+                subdirs.append(entry.path)
+        pending.extend(reversed(subdirs))
+
+
+def find_files(patterns, paths):
+    """Find several needles in the haystack at once.
+
+    The paths are traversed only once, until a file has been found for every
+    pattern.
+
+    @param patterns: patterns for the names of the files to look for, by
+    hint
+    @type patterns: dict
+
+    @param paths: list of paths to search into
+    @type paths: list of str
+
+    @return: the full path of the first file matching each pattern, by hint.
+    Hints without matching file are left out.
+    @rtype: dict
+    """
+    pending = dict((h, re.compile(p)) for h, p in patterns.items())
+    try:
+        # Most file names match no pattern, so check them all at once first.
+        combined = re.compile('|'.join('(?:{})'.format(p.pattern)
+                                       for p in pending.values()))
+    except re.error:
+        combined = None
+    found = {}
     for path in paths:
-        msg = _("Searching for file matching '{}' in '{}'")
-        debug(msg.format(pattern, path))
-        for root, dirs, files in os.walk(path):
-            for f in files:
+        if not pending:
+            break
+        msg = _("Searching for files matching {} in '{}'")
+        debug(msg.format(', '.join(patterns.values()), path))
+        for root, f in _iter_files(path):
+            if combined and not combined.match(f):
+                continue
+            for hint, p in list(pending.items()):
                 if p.match(f):
-                    return os.path.join(root, f)
-    raise FileNotFoundError(_("can not find '{}'").format(pattern))
+                    found[hint] = os.path.join(root, f)
+                    del pending[hint]
+            if not pending:
+                break
+    return found
 
 
 def find_text(filename, pattern):
@@ -85,17 +216,65 @@ def find_text(filename, pattern):
     @return: the matching text
     @rtype: str
     """
-    expr = re.compile(pattern)
-    with open(filename) as f:
-        for line in f.readlines():
-            match = expr.match(line.strip())
+    with open(filename, 'rb') as f:
+        return search_text(f, pattern)
+
+
+def search_text(source, pattern):
+    """Look for some text matching a pattern in a file object or a string.
+
+    @param source: file object, or contents to look into
+    @type source: file, str or bytes
+
+    @param pattern: regular expression the text should match
+    @type pattern: str
+
+    @return: the matching text
+    @rtype: str
+    """
+    hints = extract_hints(source, {'text': pattern})
+    if 'text' not in hints:
+        msg = _("can not find text matching '{}'")
+        raise NoMatchError(msg.format(pattern))
+    return hints['text']
+
+
+def extract_hints(source, patterns):
+    """Extract several hints from some text in a single pass.
+
+    The text is read line by line, until every pattern has matched a line,
+    with leading and trailing whitespace removed. The value of a hint is the
+    first group captured by its pattern, or the whole match if there is no
+    group.
+
+    @param source: file object, or contents to look into
+    @type source: file, str or bytes
+
+    @param patterns: regular expressions the lines should match, by hint
+    @type patterns: dict
+
+    @return: the values of the hints found, by hint
+    @rtype: dict
+    """
+    pending = dict((h, re.compile(p)) for h, p in patterns.items())
+    if isinstance(source, (str, bytes, bytearray)):
+        lines = source.splitlines()
+    else:
+        lines = source
+    found = {}
+    for line in lines:
+        if not pending:
+            break
+        if not isinstance(line, str):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        for hint, expr in list(pending.items()):
+            match = expr.match(line)
             if match:
-                if match.lastindex:
-                    index = 1
-                else:
-                    index = 0
-                return match.group(index)
-    raise NoMatchError(_("can not find text matching '{}'").format(pattern))
+                index = 1 if match.lastindex else 0
+                found[hint] = match.group(index)
+                del pending[hint]
+    return found
 
 def format_for_shell(args):
     """Formats a list of string as a command line, suitable for shell.
@@ -111,22 +290,336 @@ def format_for_shell(args):
     return ' '.join(new_args)
 
 
-class GZippedFileAdapter:
-    """Gunzip file to a temporary directory if needed"""
-    def __init__(self, filename):
-        if filename.endswith('.gz'):
-            root, ext = os.path.splitext(os.path.basename(filename))
-            folder = tempfile.mkdtemp(prefix="vestricius-")
-            path = os.path.join(folder, root)
-            info(_("Extracting to '{}'").format(path))
+def copy_sparse(src, dst, block_size=_SPARSE_BLOCK_SIZE):
+    """Copies a file object, leaving holes instead of blocks of zeros.
+
+    Core dumps are mostly made of zeros, so the copy only takes the disk
+    space of the non-zero blocks, while reading it still gives the same
+    data.
+
+    @param src: file object to read from
+    @type src: file
+
+    @param dst: file object to write to, which must be seekable
+    @type dst: file
+
+    @param block_size: size of the blocks checked for zeros
+    @type block_size: int
+
+    @return: the number of bytes written and the size of the copy
+    @rtype: tuple
+    """
+    buf = bytearray(_CHUNK_SIZE - _CHUNK_SIZE % block_size)
+    view = memoryview(buf)
+    # Comparing bytearray and bytes objects is way faster than comparing
+    # memoryview objects.
+    zeros = _ZEROS[:len(buf)]
+
+    def is_zero(start, stop):
+        return buf[start:stop] == zeros[:stop - start]
+
+    written = 0
+    size = 0
+    while True:
+        count = src.readinto(buf)
+        if not count:
+            break
+        if (buf == zeros) if count == len(buf) else is_zero(0, count):
+            dst.seek(count, os.SEEK_CUR)
+        else:
+            start = 0
+            while start < count:
+                # Write consecutive non-zero blocks at once.
+                end = start
+                while end < count:
+                    stop = min(end + block_size, count)
+                    if is_zero(end, stop):
+                        break
+                    end = stop
+                if end > start:
+                    dst.write(view[start:end])
+                    written += end - start
+                    start = end
+                while end < count:
+                    stop = min(end + block_size, count)
+                    if not is_zero(end, stop):
+                        break
+                    end = stop
+                if end > start:
+                    dst.seek(end - start, os.SEEK_CUR)
+                    start = end
+        size += count
+    # Seeking past the end does not extend the file.
+    dst.truncate(size)
+    return written, size
+
+
+def make_temp_dir(size=None, memory_threshold=None):
+    """Creates a temporary directory for extracted files.
+
+    If the files are small enough, the directory is created in RAM-backed
+    storage, so extracting and removing them costs no disk I/O. External
+    tools like gdb can still open them by path.
+
+    @param size: expected size of the files, if known
+    @type size: int
+
+    @param memory_threshold: maximum size of the files for the directory to
+    be created in RAM-backed storage, or None for the default one
+    @type memory_threshold: int
+
+    @return: the path to the directory
+    @rtype: str
+    """
+    if _fits_in_memory(size, memory_threshold):
+        folder = tempfile.mkdtemp(prefix="vestricius-", dir=_MEMORY_DIR)
+        debug(_("Using RAM-backed directory '{}'").format(folder))
+        return folder
+    return tempfile.mkdtemp(prefix="vestricius-")
+
+
+def _fits_in_memory(size, memory_threshold=None):
+    if memory_threshold is None:
+        memory_threshold = _MEMORY_THRESHOLD
+    if size is None or size > memory_threshold:
+        return False
+    try:
+        st = os.statvfs(_MEMORY_DIR)
+    except OSError:
+        return False
+    # Leave room for the other users of the storage.
+    return st.f_bavail * st.f_frsize >= 2 * size
+
+
+def _get_decompressed_size(filename, compression):
+    # Only gzip stores the size of the decompressed data, modulo 2^32, at the
+    # end of the file.
+    if compression.name != 'gzip':
+        return None
+    with open(filename, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        # Deflate can store 4 GiB of zeros in about 4 MiB, so the size of
+        # the data of a larger file may have wrapped around.
+        if size < 4 or size * _MAX_DEFLATE_RATIO >= 1 << 32:
+            return None
+        f.seek(-4, os.SEEK_END)
+        isize = int.from_bytes(f.read(4), 'little')
+    if isize < size or isize > size * _MAX_DEFLATE_RATIO:
+        return None
+    return isize
+
+
+def _sniff_compression(filename):
+    with open(filename, 'rb') as f:
+        return _find_compression(f.read(_MAGIC_SIZE))
+
+
+def _find_compression(magic):
+    for compression in _COMPRESSIONS:
+        if magic.startswith(compression.magic):
+            return compression
+    return None
+
+
+def get_compression(filename):
+    """Returns the compression format of a file, from its magic bytes.
+
+    @param filename: path to the file
+    @type filename: str
+
+    @return: 'gzip', 'xz', 'bzip2' or 'zstd', or None if the file is not
+    compressed
+    @rtype: str
+    """
+    compression = _sniff_compression(filename)
+    return compression.name if compression else None
+
+
+class _DecompressedStream:
+    """Decompressed data of a file, read from a Python decoder or from the
+    output of an external tool.
+
+    Reads always return the size requested, unless the end of the data is
+    reached, and decoding errors are raised as OSError.
+    """
+    def __init__(self, fileobj, process=None):
+        self._fileobj = fileobj
+        self._process = process
+
+    def readinto(self, buf):
+        view = memoryview(buf)
+        count = 0
+        while count < len(view):
+            try:
+                n = self._fileobj.readinto(view[count:])
+            except (EOFError, OSError):
+                raise
+            except Exception as e:
+                raise OSError(str(e))
+            if not n:
+                self._check()
+                break
+            count += n
+        return count
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(_CHUNK_SIZE)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        buf = bytearray(size)
+        return bytes(buf[:self.readinto(buf)])
+
+    def _check(self):
+        if self._process is None:
+            return
+        if self._process.wait() != 0:
+            msg = _("'{}' failed with status {}")
+            raise OSError(msg.format(self._process.args[0],
+                                     self._process.returncode))
+
+    def close(self):
+        self._fileobj.close()
+        if self._process is not None:
+            # The tool may still be writing data nobody will read.
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def _open_with_module(compression, source):
+    # The source is either the path to a file or a binary file object.
+    if compression.name == 'gzip':
+        return gzip.open(source)
+    if compression.name == 'xz':
+        return lzma.open(source)
+    if compression.name == 'bzip2':
+        return bz2.open(source)
+    if zstandard is not None:
+        if isinstance(source, str):
+            source = open(source, 'rb')
+        return zstandard.ZstdDecompressor().stream_reader(source,
+                                                          closefd=True)
+    return None
+
+
+def _open_with_tool(compression, filename):
+    for command in compression.commands:
+        path = shutil.which(command[0])
+        if path is None:
+            continue
+        debug(_("Decompressing '{}' using {}").format(filename, path))
+        with open(filename, 'rb') as f:
+            process = subprocess.Popen([path] + command[1:],
+                                       stdin=f,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+        return process
+    return None
+
+
+def open_decompressed(filename, external=True):
+    """Opens a compressed file for reading its decompressed data.
+
+    The data is read by chunks, so the memory used does not depend on the
+    size of the file. If allowed, an external tool is used to decompress
+    the file, as tools like pigz or zstd run in parallel with the reader and
+    can use several threads.
+
+    @param filename: path to the compressed file
+    @type filename: str
+
+    @param external: if True, prefer an external tool to a Python module
+    @type external: bool
+
+    @return: the decompressed data, as a binary file object
+    @rtype: file
+
+    @raise InvalidFileError: if the file is not compressed in a supported
+    format
+    """
+    compression = _sniff_compression(filename)
+    if compression is None:
+        raise InvalidFileError(_("'{}' is not compressed").format(filename))
+    openers = [_open_with_module, _open_with_tool]
+    if external:
+        openers.reverse()
+    for opener in openers:
+        stream = opener(compression, filename)
+        if isinstance(stream, subprocess.Popen):
+            return _DecompressedStream(stream.stdout, stream)
+        if stream is not None:
+            return _DecompressedStream(stream)
+    msg = _("no decoder available for {} compressed file '{}'")
+    raise InvalidFileError(msg.format(compression.name, filename))
+
+
+class DecompressedFileAdapter:
+    """Decompress file to a temporary directory if needed.
+
+    The compression format is guessed from the magic bytes of the file.
+    The extension of the compressed file, if any, is removed from the name
+    of the decompressed one.
+
+    @param filename: path to the file
+    @type filename: str
+
+    @param cache: cache to keep the decompressed file in, instead of a
+    temporary directory
+    @type cache: :class:`ExtractionCache`
+
+    @param memory_threshold: maximum size of the decompressed file for the
+    temporary directory to be created in RAM-backed storage, or None for the
+    default one
+    @type memory_threshold: int
+    """
+    def __init__(self, filename, cache=None,
+                 memory_threshold=None):
+        self._need_cleanup = False
+        compression = _sniff_compression(filename)
+        if not compression:
+            self._path = filename
+            return
+        root = os.path.basename(filename)
+        if root.endswith(compression.extension):
+            root = root[:-len(compression.extension)]
+        if cache:
+            key = cache.get_key(filename, 'decompressed', root)
+            entry = cache.lookup(key)
+            if entry:
+                self._path = os.path.join(entry[0], root)
+                return
+            folder = cache.create()
+        else:
+            size = _get_decompressed_size(filename, compression)
+            folder = make_temp_dir(size, memory_threshold)
+        path = os.path.join(folder, root)
+        info(_("Extracting to '{}'").format(path))
+        try:
             with open(path, 'wb') as dst:
-                with gzip.open(filename) as src:
-                    dst.write(src.read())
+                with open_decompressed(filename) as src:
+                    written, size = copy_sparse(src, dst)
+        except:
+            if cache:
+                cache.discard(folder)
+            else:
+                shutil.rmtree(folder)
+            raise
+        debug(_("Wrote {} bytes out of {}").format(written, size))
+        if cache:
+            self._path = os.path.join(cache.commit(key, folder), root)
+        else:
             self._path = path
             self._need_cleanup = True
-        else:
-            self._path = filename
-            self._need_cleanup = False
 
     def clean(self):
         keep = 'VESTRICIUS_KEEP_GUNZIPPED' in os.environ or False
@@ -148,28 +641,668 @@ class GZippedFileAdapter:
         self.clean()
 
 
-class TarballAdapter:
-    """Extract tarball to to temporary directory.
+# Kept for plugins written when only gzip was supported.
+GZippedFileAdapter = DecompressedFileAdapter
 
-    @param filename: path to the tarball
-    @type filename: str
+
+ArchiveMember = namedtuple('ArchiveMember', ['name', 'size', 'info', 'mode',
+                                             'symlink', 'hardlink'])
+ArchiveMember.__new__.__defaults__ = (None, None, None)
+ArchiveMember.__doc__ = """Regular file or link stored in an archive.
+
+The info field holds the format-specific description of the member. The
+mode field holds the permission bits of the file, if known. The symlink
+field holds the target of a symbolic link, and the hardlink field the name
+of the member a hard link refers to. Links have no data.
+"""
+
+
+class _Archive:
+    """Base class for the readers of archives.
+
+    Iterating over an archive gives its regular files and links, as
+    :class:`ArchiveMember` objects, in the order they are stored. Their data
+    is only read when opened.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def __iter__(self):
+        """Iterates over the members of the archive"""
+        pass
+
+    @abc.abstractmethod
+    def open(self, member):
+        """Opens a member of the archive for reading.
+
+        If the archive is read as a stream, only the current member of the
+        iteration can be opened.
+
+        @param member: the member
+        @type member: :class:`ArchiveMember`
+
+        @return: the data of the member, as a buffered binary file object
+        @rtype: :class:`io.BufferedIOBase`
+        """
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        """Closes the archive"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class _TarArchive(_Archive):
+    """Reader of tarballs.
+
+    A compressed tarball is read as a stream, decompressed by an external
+    tool if available, so skipping a member does not restart the
+    decompression.
+    """
+    def __init__(self, filename, compression):
+        self._stream = None
+        try:
+            if compression:
+                self._stream = open_decompressed(filename)
+                self._tar = tarfile.open(fileobj=self._stream, mode='r|')
+            else:
+                self._tar = tarfile.open(filename, 'r:')
+        except tarfile.TarError as e:
+            if self._stream:
+                self._stream.close()
+            msg = _("'{}' is not a valid archive: {}")
+            raise InvalidFileError(msg.format(filename, e))
+
+    def __iter__(self):
+        for tarinfo in self._tar:
+            mode = stat.S_IMODE(tarinfo.mode)
+            if tarinfo.isfile():
+                yield ArchiveMember(tarinfo.name, tarinfo.size, tarinfo,
+                                    mode)
+            elif tarinfo.issym():
+                yield ArchiveMember(tarinfo.name, 0, tarinfo, mode,
+                                    symlink=tarinfo.linkname)
+            elif tarinfo.islnk():
+                yield ArchiveMember(tarinfo.name, 0, tarinfo, mode,
+                                    hardlink=tarinfo.linkname)
+
+    def open(self, member):
+        return self._tar.extractfile(member.info)
+
+    def close(self):
+        self._tar.close()
+        if self._stream:
+            self._stream.close()
+
+
+class _ZipArchive(_Archive):
+    """Reader of zip files.
+
+    The members are listed from the central directory at the end of the
+    file, and each one is read directly from its offset.
     """
     def __init__(self, filename):
-        self._folder = tempfile.mkdtemp(prefix="vestricius-")
-        debug(_("Extracting to '{}'").format(self._folder))
-        tar = tarfile.open(filename, 'r')
-        tar.extractall(self._folder)
-        tar.close()
+        try:
+            self._zip = zipfile.ZipFile(filename)
+        except zipfile.BadZipFile as e:
+            msg = _("'{}' is not a valid archive: {}")
+            raise InvalidFileError(msg.format(filename, e))
+
+    def __iter__(self):
+        for zipinfo in self._zip.infolist():
+            if zipinfo.is_dir():
+                continue
+            # Archivers running on Unix store the mode of the file.
+            mode = zipinfo.external_attr >> 16
+            if stat.S_ISLNK(mode):
+                target = self._zip.read(zipinfo)
+                yield ArchiveMember(zipinfo.filename, 0, zipinfo,
+                                    stat.S_IMODE(mode),
+                                    symlink=os.fsdecode(target))
+            elif stat.S_ISREG(mode):
+                yield ArchiveMember(zipinfo.filename, zipinfo.file_size,
+                                    zipinfo, stat.S_IMODE(mode))
+            else:
+                yield ArchiveMember(zipinfo.filename, zipinfo.file_size,
+                                    zipinfo)
+
+    def open(self, member):
+        return self._zip.open(member.info)
+
+    def close(self):
+        self._zip.close()
+
+
+class _CpioArchive(_Archive):
+    """Reader of cpio archives, in the odc or newc formats.
+
+    An uncompressed archive is read by seeking from header to header, so
+    listing it does not read the data of the members. A compressed one is
+    read as a stream.
+    """
+    def __init__(self, filename, compression):
+        self._filename = filename
+        if compression:
+            self._file = open_decompressed(filename)
+        else:
+            self._file = open(filename, 'rb')
+        self._seekable = compression is None
+        self._position = 0
+
+    def _read_at(self, offset, size):
+        if self._seekable:
+            self._file.seek(offset)
+        elif offset != self._position:
+            msg = _("can not go back in compressed archive '{}'")
+            raise InvalidFileError(msg.format(self._filename))
+        data = self._file.read(size)
+        self._position = offset + len(data)
+        return data
+
+    def _read_header(self, offset, size):
+        data = self._read_at(offset, size)
+        if len(data) < size:
+            msg = _("'{}' is not a valid archive: truncated header")
+            raise InvalidFileError(msg.format(self._filename))
+        return data
+
+    def _skip_to(self, offset):
+        # Without seeking, the data left unread is skipped by reading it.
+        while not self._seekable and self._position < offset:
+            size = min(offset - self._position, _CHUNK_SIZE)
+            if not self._read_at(self._position, size):
+                break
+
+    def __iter__(self):
+        offset = 0
+        while True:
+            self._skip_to(offset)
+            magic = self._read_header(offset, 6)
+            if magic in _CPIO_NEWC_MAGICS:
+                header = self._read_header(offset + 6, 104)
+                fields = [int(header[i:i + 8], 16) for i in range(0, 104, 8)]
+                mode, size, name_size = fields[1], fields[6], fields[11]
+                # The name and the data are aligned on 4 bytes.
+                start = (offset + 110 + name_size + 3) & ~3
+                end = (start + size + 3) & ~3
+            elif magic == _CPIO_ODC_MAGIC:
+                header = self._read_header(offset + 6, 70)
+                mode = int(header[12:18], 8)
+                name_size = int(header[53:59], 8)
+                size = int(header[59:70], 8)
+                start = offset + 76 + name_size
+                end = start + size
+            else:
+                msg = _("'{}' is not a valid archive: bad magic at {}")
+                raise InvalidFileError(msg.format(self._filename, offset))
+            name = self._read_header(self._position, name_size)
+            name = name.rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            if name == _CPIO_TRAILER:
+                return
+            if stat.S_ISREG(mode):
+                self._skip_to(start)
+                yield ArchiveMember(name, size, start, stat.S_IMODE(mode))
+            elif stat.S_ISLNK(mode):
+                # The target of a symbolic link is stored as its data.
+                self._skip_to(start)
+                target = self._read_header(start, size)
+                yield ArchiveMember(name, 0, start, stat.S_IMODE(mode),
+                                    symlink=os.fsdecode(target))
+            offset = end
+
+    def open(self, member):
+        return io.BufferedReader(_MemberFile(self, member.info, member.size))
+
+    def close(self):
+        self._file.close()
+
+
+class _MemberFile(io.RawIOBase):
+    """Data of a member of an archive, read from its offset."""
+    def __init__(self, archive, offset, size):
+        io.RawIOBase.__init__(self)
+        self._archive = archive
+        self._offset = offset
+        self._left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self._archive._read_at(self._offset, min(len(buf), self._left))
+        count = len(data)
+        buf[:count] = data
+        self._offset += count
+        self._left -= count
+        return count
+
+
+class _IndexedTarArchive(_Archive):
+    """Reader of gzipped tarballs, using their index."""
+    def __init__(self, tarball):
+        self._tarball = tarball
+
+    def _read_at(self, offset, size):
+        return self._tarball.read_at(offset, size)
+
+    def __iter__(self):
+        for name, size, offset, mode, symlink, hardlink in \
+                self._tarball.members:
+            yield ArchiveMember(name, size, offset, mode, symlink, hardlink)
+
+    def open(self, member):
+        return io.BufferedReader(_MemberFile(self, member.info, member.size))
+
+    def close(self):
+        self._tarball.close()
+
+
+def open_archive(filename, index=None):
+    """Opens a tarball, zip file or cpio archive for reading its members.
+
+    The format is guessed from the magic bytes of the file. Tarballs and
+    cpio archives may be compressed in any supported format.
+
+    @param filename: path to the archive
+    @type filename: str
+
+    @param index: store of the indexes of gzipped tarballs, to read their
+    members without decompressing them from the start
+    @type index: :class:`vestricius.tarindex.TarIndexStore`
+
+    @return: the archive, to iterate over for its members
+    @rtype: :class:`_Archive`
+
+    @raise InvalidFileError: if the file is not a valid archive
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(_MAGIC_SIZE)
+    if magic.startswith(_ZIP_MAGICS):
+        return _ZipArchive(filename)
+    compression = _sniff_compression(filename)
+    if compression:
+        with open_decompressed(filename) as f:
+            magic = f.read(6)
+    else:
+        magic = magic[:6]
+    if magic == _CPIO_ODC_MAGIC or magic in _CPIO_NEWC_MAGICS:
+        return _CpioArchive(filename, compression)
+    if compression and compression.name == 'gzip' and index is not None:
+        tarball = index.open(filename)
+        if tarball is not None:
+            return _IndexedTarArchive(tarball)
+    return _TarArchive(filename, compression)
+
+
+def _get_member_path(folder, name):
+    # Members must not be written outside of the folder.
+    path = os.path.normpath(os.path.join(folder, name.lstrip('/')))
+    if not path.startswith(folder + os.sep):
+        raise InvalidFileError(_("invalid member name '{}'").format(name))
+    return path
+
+
+class _LimitedReader:
+    """Reader of at most a given number of bytes of a file object."""
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self._remaining = size
+
+    def readinto(self, buf):
+        view = memoryview(buf)[:self._remaining]
+        count = self._fileobj.readinto(view) if len(view) else 0
+        self._remaining -= count
+        return count
+
+
+class _ChainedReader:
+    """Reader of several file objects, one after the other."""
+    def __init__(self, *fileobjs):
+        self._fileobjs = list(fileobjs)
+
+    def readinto(self, buf):
+        while self._fileobjs:
+            count = self._fileobjs[0].readinto(buf)
+            if count:
+                return count
+            self._fileobjs.pop(0)
+        return 0
+
+
+def _is_inside(folder, path):
+    # Both paths must be real paths.
+    return path == folder or path.startswith(folder + os.sep)
+
+
+class ArchiveAdapter:
+    """Extract archive to temporary directory.
+
+    The archive may be a tarball, a zip file or a cpio archive, see
+    :func:`open_archive`.
+
+    If patterns are given, only the first member whose name matches each
+    pattern is extracted, and the archive is read only until all of them
+    are found. Small members are kept in memory, and only written to the
+    temporary directory if their path is needed.
+
+    Compressed members found for the hints to decompress are decompressed
+    while being extracted, so a core dump file compressed inside a
+    compressed archive is written to disk only once.
+
+    @param filename: path to the archive
+    @type filename: str
+
+    @param patterns: patterns for the names of the members to extract, by
+    hint
+    @type patterns: dict
+
+    @param cache: cache to keep the extracted members in, instead of a
+    temporary directory. All the members are then written to disk.
+    @type cache: :class:`ExtractionCache`
+
+    @param memory_threshold: maximum size of the extracted members for the
+    temporary directory to be created in RAM-backed storage, or None for the
+    default one
+    @type memory_threshold: int
+
+    @param decompress: hints whose members should be decompressed, if
+    compressed
+    @type decompress: list of str
+
+    @param index: store of the indexes of gzipped tarballs
+    @type index: :class:`vestricius.tarindex.TarIndexStore`
+    """
+    def __init__(self, filename, patterns=None, cache=None,
+                 memory_threshold=None, decompress=None, index=None):
+        self._folder = None
+        self._memory_folder = None
+        self._memory_size = 0
+        self._index = index
+        self._memory_threshold = memory_threshold
+        self._paths = {}
+        self._contents = {}
+        self._patterns = patterns or {}
+        self._decompress = set(decompress or [])
+        self._need_cleanup = cache is None
+        if cache:
+            if patterns is None:
+                key = cache.get_key(filename, 'archive')
+            else:
+                items = sorted(patterns.items())
+                key = cache.get_key(filename, 'archive', repr(items),
+                                    repr(sorted(self._decompress)))
+            entry = cache.lookup(key)
+            if entry:
+                self._folder, names = entry
+                for hint, name in names.items():
+                    self._paths[hint] = os.path.join(self._folder, name)
+                return
+            self._folder = cache.create()
+        try:
+            self._extract(filename, patterns)
+        except:
+            if cache:
+                cache.discard(self._folder)
+            else:
+                self._remove_folders()
+            raise
+        if cache:
+            for hint in list(self._contents):
+                self.get_path(hint)
+            names = dict((h, os.path.basename(p))
+                         for h, p in self._paths.items())
+            self._folder = cache.commit(key, self._folder, names)
+            for hint, name in names.items():
+                self._paths[hint] = os.path.join(self._folder, name)
+
+    def _get_folder(self, size):
+        # Each member is written to RAM-backed storage as long as the total
+        # size of the members written there stays below the threshold, and
+        # to disk otherwise, like the members whose size is unknown.
+        if size is not None and self._get_memory_room(size):
+            self._memory_size += size
+            return self._get_memory_folder()
+        if self._folder is None:
+            self._folder = make_temp_dir()
+        return self._folder
+
+    def _get_memory_room(self, size):
+        # Number of bytes which can still be written to RAM-backed storage,
+        # or 0 if a member of at least `size` bytes does not fit there.
+        # Members kept in the cache are always written to disk.
+        total = self._memory_size + size
+        if not self._need_cleanup or \
+                not _fits_in_memory(total, self._memory_threshold):
+            return 0
+        threshold = self._memory_threshold
+        if threshold is None:
+            threshold = _MEMORY_THRESHOLD
+        return threshold - self._memory_size
+
+    def _get_memory_folder(self):
+        if self._memory_folder is None:
+            self._memory_folder = make_temp_dir(self._memory_size,
+                                                self._memory_threshold)
+        return self._memory_folder
+
+    def _extract(self, filename, patterns):
+        if patterns is None:
+            self._extract_all(filename)
+        else:
+            self._extract_members(filename, patterns)
+
+    def _extract_all(self, filename):
+        # The size of the members is not known before reading the whole
+        # archive, so they are extracted to disk.
+        folder = self._get_folder(None)
+        root = os.path.realpath(folder)
+        debug(_("Extracting to '{}'").format(folder))
+        with open_archive(filename, self._index) as archive:
+            for member in archive:
+                path = _get_member_path(folder, member.name)
+                parent = os.path.dirname(path)
+                os.makedirs(parent, exist_ok=True)
+                # Symbolic links extracted before must not lead outside of
+                # the folder either.
+                if not _is_inside(root, os.path.realpath(parent)):
+                    msg = _("invalid member name '{}'")
+                    raise InvalidFileError(msg.format(member.name))
+                if os.path.islink(path) or os.path.isfile(path):
+                    # Like tar, a member replaces the previous one.
+                    os.unlink(path)
+                if member.symlink is not None:
+                    self._extract_symlink(root, path, member)
+                elif member.hardlink is not None:
+                    self._extract_hardlink(folder, path, member)
+                else:
+                    with archive.open(member) as src, \
+                            open(path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+                    if member.mode is not None:
+                        # Special bits are dropped, and the files are kept
+                        # writable, so they can be removed.
+                        os.chmod(path, member.mode & 0o777 | stat.S_IWUSR)
+
+    def _extract_symlink(self, root, path, member):
+        target = os.path.join(os.path.dirname(path), member.symlink)
+        if os.path.isabs(member.symlink) or \
+                not _is_inside(root, os.path.realpath(target)):
+            msg = _("Ignoring link '{}' pointing outside of the archive")
+            warning(msg.format(member.name))
+            return
+        os.symlink(member.symlink, path)
+
+    def _extract_hardlink(self, folder, path, member):
+        target = _get_member_path(folder, member.hardlink)
+        try:
+            os.link(target, path, follow_symlinks=False)
+        except OSError as e:
+            msg = _("Can not link '{}' to '{}' ({})")
+            warning(msg.format(member.name, member.hardlink, e))
+
+    def _extract_members(self, filename, patterns):
+        pending = dict((h, re.compile(p)) for h, p in patterns.items())
+        # Reading stops at the last member needed, so the rest of a
+        # compressed archive is not decompressed.
+        with open_archive(filename, self._index) as archive:
+            for member in archive:
+                if not pending:
+                    break
+                if member.symlink is not None or member.hardlink is not None:
+                    continue
+                name = os.path.basename(member.name)
+                hints = [h for h, p in pending.items() if p.match(name)]
+                if not hints:
+                    continue
+                src = archive.open(member)
+                compression = None
+                if self._decompress.intersection(hints):
+                    magic = src.peek(_MAGIC_SIZE)[:_MAGIC_SIZE]
+                    compression = _find_compression(magic)
+                if compression:
+                    path = self._extract_decompressed(src, member, name,
+                                                      compression)
+                    for hint in hints:
+                        self._paths[hint] = path
+                elif member.size <= _SMALL_MEMBER_SIZE:
+                    debug(_("Reading '{}'").format(member.name))
+                    data = src.read()
+                    for hint in hints:
+                        self._contents[hint] = (name, data)
+                else:
+                    folder = self._get_folder(member.size)
+                    path = os.path.join(folder, name)
+                    debug(_("Extracting '{}' to '{}'").format(member.name,
+                                                              path))
+                    with open(path, 'wb') as dst:
+                        written, size = copy_sparse(src, dst)
+                    debug(_("Wrote {} bytes out of {}").format(written, size))
+                    for hint in hints:
+                        self._paths[hint] = path
+                src.close()
+                for hint in hints:
+                    del pending[hint]
+
+    def _extract_decompressed(self, src, member, name, compression):
+        if name.endswith(compression.extension):
+            name = name[:-len(compression.extension)]
+        stream = _open_with_module(compression, src)
+        if stream is None:
+            # External tools only read from files, so the member is written
+            # compressed first.
+            return self._extract_with_tool(src, member, name, compression)
+        with _DecompressedStream(stream) as stream:
+            return self._write_decompressed(stream, name, member.size)
+
+    def _extract_with_tool(self, src, member, name, compression):
+        # The compressed member is only needed while it is decompressed, so
+        # it may be written to RAM-backed storage even if the decompressed
+        # one is kept in the cache.
+        folder = make_temp_dir(member.size, self._memory_threshold)
+        try:
+            compressed = os.path.join(folder, name + compression.extension)
+            with open(compressed, 'wb') as dst:
+                shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+            process = _open_with_tool(compression, compressed)
+            if process is None:
+                msg = _("no decoder available for {} compressed file '{}'")
+                raise InvalidFileError(msg.format(compression.name, name))
+            with _DecompressedStream(process.stdout, process) as stream:
+                return self._write_decompressed(stream, name, member.size)
+        finally:
+            shutil.rmtree(folder)
+
+    def _write_decompressed(self, stream, name, size_hint):
+        # The decompressed size is only known once the whole member is read,
+        # so the member is written to RAM-backed storage until it exceeds the
+        # room left there, and then moved to disk.
+        room = self._get_memory_room(size_hint)
+        staged = None
+        if room:
+            path = os.path.join(self._get_memory_folder(), name)
+            info(_("Extracting to '{}'").format(path))
+            with open(path, 'wb') as dst:
+                written, size = copy_sparse(_LimitedReader(stream, room), dst)
+            extra = stream.read(1)
+            if not extra:
+                self._memory_size += size
+                debug(_("Wrote {} bytes out of {}").format(written, size))
+                return path
+            debug(_("'{}' does not fit in RAM-backed storage").format(name))
+            staged = open(path, 'rb')
+            stream = _ChainedReader(staged, io.BytesIO(extra), stream)
+        path = os.path.join(self._get_folder(None), name)
+        info(_("Extracting to '{}'").format(path))
+        try:
+            with open(path, 'wb') as dst:
+                written, size = copy_sparse(stream, dst)
+        finally:
+            if staged:
+                staged.close()
+                os.unlink(staged.name)
+        debug(_("Wrote {} bytes out of {}").format(written, size))
+        return path
+
+    def get_path(self, hint):
+        """Returns the path to the member extracted for a hint.
+
+        @param hint: the hint
+        @type hint: str
+
+        @return: the path to the extracted member
+        @rtype: str
+        """
+        if hint not in self._paths:
+            name, data = self._get_member(hint)
+            path = os.path.join(self._get_folder(len(data)), name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._paths[hint] = path
+        return self._paths[hint]
+
+    def read(self, hint):
+        """Returns the contents of the member extracted for a hint.
+
+        @param hint: the hint
+        @type hint: str
+
+        @return: the contents of the member
+        @rtype: bytes
+        """
+        if hint in self._paths:
+            with open(self._paths[hint], 'rb') as f:
+                return f.read()
+        return self._get_member(hint)[1]
+
+    def _get_member(self, hint):
+        try:
+            return self._contents[hint]
+        except KeyError:
+            pattern = self._patterns.get(hint, hint)
+            raise FileNotFoundError(_("can not find '{}'").format(pattern))
 
     def clean(self):
         keep = 'VESTRICIUS_KEEP_TMPDIR' in os.environ or False
-        if not keep:
-            debug(_("Removing '{}'").format(self._folder))
-            shutil.rmtree(self._folder)
+        if self._need_cleanup and not keep:
+            self._remove_folders()
+
+    def _remove_folders(self):
+        for folder in (self._folder, self._memory_folder):
+            if folder:
+                debug(_("Removing '{}'").format(folder))
+                shutil.rmtree(folder)
 
     @property
     def folder(self):
-        return self._folder
+        """Directory holding the extracted members, or None if none was
+        written. Members may also be written to a RAM-backed directory."""
+        return self._folder or self._memory_folder
 
     def __enter__(self):
         return self
@@ -177,4 +1310,8 @@ class TarballAdapter:
     def __exit__(self, type, value, traceback):
         self.clean()
 
+
+# Kept for plugins written when only tarballs were supported.
+TarballAdapter = ArchiveAdapter
+
 # vim: ts=4 sw=4 sts=4 et ai
@@ -33,7 +33,12 @@ from collections import namedtuple
 
 
 ProgramCrashInfo = namedtuple('ProgramCrashInfo',
-                              ['executable', 'backtrace', 'core_dump'])
+                              ['executable', 'backtrace', 'core_dump',
+                               'debugger', 'fingerprint', 'threads'])
+
+
+class UnwindError(Exception):
+    """Exception raised when a debugger can not unwind a stack"""
 
 
 class Debugger:
@@ -41,7 +46,7 @@ class Debugger:
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod
-    def generate_backtrace(self, dumpfile, programfile):
+    def generate_backtrace(self, dumpfile, programfile, solib_paths=None):
         """Generates a backtrace from the core dump file of a given program.
 
         @param dumpfile: path to core dump file
@@ -49,6 +54,10 @@ class Debugger:
 
         @param programfile: path to the unstripped binary executable file
         @type programfile: str
+
+        @param solib_paths: directories holding the shared libraries, or None
+        to use the default ones
+        @type solib_paths: list of str
         """
         pass
 
@@ -43,13 +43,15 @@ class GDBWrapper(Debugger):
         self._solib_paths = solib_paths
         self._solib_prefix = solib_prefix
 
-    def generate_backtrace(self, dumpfile, programfile):
+    def generate_backtrace(self, dumpfile, programfile, solib_paths=None):
         info(_("Generating backtrace for {} using {}").format(programfile,
                                                               dumpfile))
+        if solib_paths is None:
+            solib_paths = self._solib_paths
         args = [self._exec, '-q']
-        if len(self._solib_paths):
+        if len(solib_paths):
             args.append('-ex')
-            args.append('set solib-search-path ' + ':'.join(self._solib_paths))
+            args.append('set solib-search-path ' + ':'.join(solib_paths))
         if self._solib_prefix:
             args.append('-ex')
             args.append('set solib-absolute-prefix ' + self._solib_prefix)
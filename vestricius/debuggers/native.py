@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.debuggers.native
+   ```````````````````````````
+
+   Unwinder reading core dump files without external debugger
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import io
+import os
+import sys
+import struct
+import contextlib
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from elftools.common.exceptions import ELFError, DWARFError
+from elftools.construct import ConstructError
+from elftools.dwarf.callframe import CallFrameInfo, RegisterRule, FDE
+from elftools.dwarf.structs import DWARFStructs
+from elftools.elf.elffile import ELFFile
+from ..debugger import Debugger, UnwindError
+from ..elf import CoreFile, NT_FILE, NT_PRSTATUS, read_build_id
+from ..elf import parse_file_note, parse_prstatus_note
+from ..log import info, debug
+from ..symbols import build_symbol_index
+from gettext import gettext as _
+
+# Unusual or corrupted DWARF data make pyelftools raise all kinds of
+# exceptions, which should only make the unwinder give up.
+_PARSE_ERRORS = (ELFError, DWARFError, ConstructError, struct.error,
+                 AttributeError, EOFError, IndexError, KeyError, TypeError,
+                 ValueError)
+
+
+@contextlib.contextmanager
+def _parsing():
+    # Only wraps calls to pyelftools, so errors in the unwinder itself are
+    # not mistaken for unusual data.
+    try:
+        yield
+    except _PARSE_ERRORS as e:
+        raise UnwindError(str(e) or type(e).__name__)
+
+
+# Description of an architecture supported by the unwinder:
+# - registers: index in elf_prstatus of each register, by DWARF number.
+# - sp: DWARF number of the stack pointer.
+# - pc: index in elf_prstatus of the program counter.
+# - link: DWARF number of the link register, or None if the return address
+#   is pushed on the stack by the call instruction.
+_Arch = namedtuple('_Arch', ['registers', 'sp', 'pc', 'link'])
+
+_ARCHS = {
+    'x86': _Arch(registers=(6, 1, 2, 0, 15, 5, 3, 4, 12),
+                 sp=4, pc=12, link=None),
+    'x64': _Arch(registers=(10, 12, 11, 5, 13, 14, 4, 19,
+                            9, 8, 7, 6, 3, 2, 1, 0, 16),
+                 sp=7, pc=16, link=None),
+    'AArch64': _Arch(registers=tuple(range(32)),
+                     sp=31, pc=32, link=30),
+}
+
+_MAX_FRAMES = 256
+
+# Encoding of the binary search table of .eh_frame_hdr: pairs of signed
+# 32-bit values relative to the start of the section.
+_DW_EH_PE_datarel_sdata4 = 0x3b
+_DW_EH_PE_udata4 = 0x03
+
+
+Frame = namedtuple('Frame', ['pc', 'function', 'path'])
+
+
+class _Module:
+    """ELF file mapped in the address space of the crashed process.
+
+    @param path: path to the ELF file
+    @type path: str
+
+    @param start: address of the first mapping of the file
+    @type start: int
+
+    @param build_id: the build-id of the file, as an hexadecimal string
+    @type build_id: str
+
+    @param symbols: cache of the indexes of function symbols
+    @type symbols: :class:`SymbolCache`
+    """
+    def __init__(self, path, start, build_id=None, symbols=None):
+        self._file = open(path, 'rb')
+        try:
+            self._elf = ELFFile(self._file)
+            loads = [s for s in self._elf.iter_segments()
+                     if s['p_type'] == 'PT_LOAD']
+            if not loads:
+                msg = _("'{}' has no loadable segment")
+                raise UnwindError(msg.format(path))
+        except:
+            self._file.close()
+            raise
+        self.bias = start - (loads[0]['p_vaddr'] - loads[0]['p_offset'])
+        self._structs = DWARFStructs(little_endian=self._elf.little_endian,
+                                     dwarf_format=32,
+                                     address_size=self._elf.elfclass // 8)
+        self._eh_cfi = None
+        self._eh_table = None
+        self._fdes = None
+        self._build_id = build_id
+        self._symbol_cache = symbols
+        self._symbols = None
+
+    def close(self):
+        if self._symbols is not None:
+            self._symbols.close()
+        self._file.close()
+
+    def _load_cfi(self, name):
+        # Only the section holding the call frame information is read, while
+        # ELFFile.get_dwarf_info() would copy all the DWARF sections.
+        section = self._elf.get_section_by_name(name)
+        if section is None or section['sh_type'] == 'SHT_NOBITS':
+            return None
+        data = section.data()
+        return CallFrameInfo(stream=io.BytesIO(data),
+                             size=len(data),
+                             address=section['sh_addr'],
+                             base_structs=self._structs,
+                             for_eh_frame=name == '.eh_frame')
+
+    def _load_eh_frame_hdr(self):
+        self._eh_table = array('i')
+        # CallFrameInfo only parses the whole section, so the entries pointed
+        # by the search table are parsed using a private method, which may
+        # not exist in other versions of pyelftools.
+        if not hasattr(CallFrameInfo, '_parse_entry_at'):
+            debug(_("Ignoring .eh_frame_hdr, unsupported by pyelftools"))
+            return
+        section = self._elf.get_section_by_name('.eh_frame_hdr')
+        if section is None:
+            return
+        data = section.data()
+        if (len(data) < 12 or data[0] != 1 or
+                data[2] != _DW_EH_PE_udata4 or
+                data[3] != _DW_EH_PE_datarel_sdata4):
+            return
+        count = int.from_bytes(data[8:12], self._byteorder)
+        self._eh_table.frombytes(data[12:12 + 8 * count])
+        if self._byteorder != sys.byteorder:
+            self._eh_table.byteswap()
+        self._eh_locations = [l + section['sh_addr']
+                              for l in self._eh_table[0::2]]
+        self._eh_address = section['sh_addr']
+        self._eh_cfi = self._load_cfi('.eh_frame')
+
+    @property
+    def _byteorder(self):
+        return 'little' if self._elf.little_endian else 'big'
+
+    def _find_fde_in_eh_frame_hdr(self, address):
+        if self._eh_table is None:
+            self._load_eh_frame_hdr()
+        if self._eh_cfi is None:
+            return None
+        index = bisect_right(self._eh_locations, address) - 1
+        if index < 0:
+            return None
+        offset = (self._eh_table[index * 2 + 1] + self._eh_address -
+                  self._eh_cfi.address)
+        entry = self._eh_cfi._parse_entry_at(offset)
+        return entry if isinstance(entry, FDE) else None
+
+    def _find_fde_in_sections(self, address):
+        if self._fdes is None:
+            entries = []
+            for name in ('.eh_frame', '.debug_frame'):
+                cfi = self._load_cfi(name)
+                if cfi is not None:
+                    entries += cfi.get_entries()
+            self._fdes = [e for e in entries if isinstance(e, FDE)]
+        for fde in self._fdes:
+            start = fde.header['initial_location']
+            if start <= address < start + fde.header['address_range']:
+                return fde
+        return None
+
+    def find_fde(self, address):
+        """Finds the Frame Description Entry covering an address.
+
+        The binary search table of the .eh_frame_hdr section is used if
+        available, otherwise the .eh_frame and .debug_frame sections are
+        fully parsed.
+
+        @param address: the address, relative to the module
+        @type address: int
+
+        @return: the FDE, or None
+        @rtype: :class:`FDE`
+        """
+        with _parsing():
+            fde = self._find_fde_in_eh_frame_hdr(address)
+            if fde is not None:
+                start = fde.header['initial_location']
+                if start <= address < start + fde.header['address_range']:
+                    return fde
+            return self._find_fde_in_sections(address)
+
+    def find_symbol(self, address):
+        """Finds the name of the function holding an address.
+
+        @param address: the address, relative to the module
+        @type address: int
+
+        @return: the name of the function, or None
+        @rtype: str
+        """
+        if self._symbols is None:
+            with _parsing():
+                if self._symbol_cache:
+                    self._symbols = self._symbol_cache.get(self._elf,
+                                                           self._build_id)
+                else:
+                    self._symbols = build_symbol_index(self._elf)
+        return self._symbols.lookup(address)
+
+
+class NativeUnwinder(Debugger):
+    """Generates backtraces without external debugger.
+
+    The registers of the crashed thread are read from the core dump file,
+    then the stack is unwound using the call frame information (.eh_frame or
+    .debug_frame) of the executable and the shared libraries. Frames are
+    symbolized using their symbol tables.
+
+    Only the crashed thread is unwound. When the call frame information is
+    incomplete, :class:`UnwindError` is raised, so a full-fledged debugger
+    can be used instead.
+
+    @param solib_paths: list of paths where to look for shared libraries
+    @type solib_paths: list of str
+
+    @param solib_prefix: prefix of the absolute paths of the shared libraries
+    @type solib_prefix: str
+
+    @param symbols: cache of the indexes of function symbols
+    @type symbols: :class:`SymbolCache`
+    """
+    def __init__(self, solib_paths=[], solib_prefix=None, symbols=None):
+        self._solib_paths = solib_paths
+        self._solib_prefix = solib_prefix
+        self._symbols = symbols
+
+    @property
+    def path(self):
+        """Returns 'native', as no external debugger is used"""
+        return 'native'
+
+    @property
+    def solib_paths(self):
+        return self._solib_paths
+
+    @property
+    def solib_prefix(self):
+        return self._solib_prefix
+
+    def generate_backtrace(self, dumpfile, programfile, solib_paths=None):
+        info(_("Unwinding stack of {} using {}").format(programfile,
+                                                        dumpfile))
+        if solib_paths is None:
+            solib_paths = self._solib_paths
+        with CoreFile(dumpfile) as core:
+            if core.arch not in _ARCHS:
+                msg = _("unsupported architecture '{}'")
+                raise UnwindError(msg.format(core.arch))
+            status = None
+            mappings = None
+            for note in core.iter_notes():
+                if note.name != 'CORE':
+                    continue
+                if note.type == NT_PRSTATUS and status is None:
+                    status = parse_prstatus_note(note, core)
+                elif note.type == NT_FILE:
+                    mappings = parse_file_note(note, core)
+            if status is None or mappings is None:
+                raise UnwindError(_("missing thread status or mappings"))
+            modules = _ModuleSet(core, mappings, programfile,
+                                 solib_paths, self._solib_prefix,
+                                 self._symbols)
+            try:
+                frames = self._unwind(core, status, modules)
+            finally:
+                modules.close()
+        lines = []
+        for n, frame in enumerate(frames):
+            line = "#{:<3}0x{:0{}x} in {} ()".format(n,
+                                                     frame.pc,
+                                                     core.elfclass // 4,
+                                                     frame.function or '??')
+            if frame.path:
+                line += " from {}".format(frame.path)
+            lines.append(line)
+        return lines
+
+    def _unwind(self, core, status, modules):
+        arch = _ARCHS[core.arch]
+        word = core.elfclass // 8
+        byteorder = 'little' if core.little_endian else 'big'
+
+        def read_word(address):
+            data = core.read_memory(address, word)
+            if data is None:
+                msg = _("can not read memory at 0x{:x}")
+                raise UnwindError(msg.format(address))
+            return int.from_bytes(data, byteorder)
+
+        registers = {n: status.registers[i]
+                     for n, i in enumerate(arch.registers)}
+        pc = status.registers[arch.pc]
+        frames = []
+        while len(frames) < _MAX_FRAMES:
+            module, path = modules.find(pc)
+            if module is None:
+                if frames:
+                    msg = _("no module found for address 0x{:x}")
+                    raise UnwindError(msg.format(pc))
+                # Most likely a call through an invalid function pointer:
+                # the return address is still where the call left it.
+                debug(_("Invalid program counter 0x{:x}").format(pc))
+                frames.append(Frame(pc, None, None))
+                if arch.link is None:
+                    pc = read_word(registers[arch.sp])
+                    registers[arch.sp] += word
+                else:
+                    pc = registers[arch.link]
+                continue
+            # Return addresses point after the call instruction, which may be
+            # the first instruction of the next function.
+            address = pc - module.bias - (1 if frames else 0)
+            frames.append(Frame(pc, module.find_symbol(address), path))
+            fde = module.find_fde(address)
+            if fde is None:
+                msg = _("no call frame information for 0x{:x} in '{}'")
+                raise UnwindError(msg.format(pc, path))
+            pc = self._step(arch, fde, address, registers, read_word)
+            if not pc:
+                break
+        return frames
+
+    def _step(self, arch, fde, address, registers, read_word):
+        with _parsing():
+            table = fde.get_decoded().table
+        row = None
+        for r in table:
+            if r['pc'] > address:
+                break
+            row = r
+        if row is None:
+            raise UnwindError(_("no call frame information row"))
+        rule = row['cfa']
+        if rule.expr is not None or rule.reg not in registers:
+            raise UnwindError(_("unsupported CFA rule"))
+        cfa = registers[rule.reg] + rule.offset
+        caller = dict(registers)
+        for reg, rule in row.items():
+            if not isinstance(reg, int):
+                continue
+            if rule.type == RegisterRule.OFFSET:
+                caller[reg] = read_word(cfa + rule.arg)
+            elif rule.type == RegisterRule.VAL_OFFSET:
+                caller[reg] = cfa + rule.arg
+            elif rule.type == RegisterRule.REGISTER and rule.arg in registers:
+                caller[reg] = registers[rule.arg]
+            elif rule.type != RegisterRule.SAME_VALUE:
+                caller.pop(reg, None)
+        ra = fde.cie.header['return_address_register']
+        if ra not in caller:
+            # The return address is undefined in the outermost frame.
+            return None
+        registers.clear()
+        registers.update(caller)
+        # By definition, the CFA is the value of the stack pointer in the
+        # caller frame.
+        registers[arch.sp] = cfa
+        return registers[ra]
+
+
+class _ModuleSet:
+    """Modules mapped in the address space of the crashed process.
+
+    The ELF files are opened on demand. Shared libraries are looked up under
+    the prefix, then in the search paths. Files whose build-id does not match
+    the one of the mapped file are ignored.
+    """
+    def __init__(self, core, mappings, programfile, paths, prefix,
+                 symbols=None):
+        self._core = core
+        self._mappings = mappings
+        self._programfile = programfile
+        self._paths = paths
+        self._prefix = prefix
+        self._symbols = symbols
+        self._modules = {}
+        self._build_ids = {}
+        self._starts = {}
+        for mapping in mappings:
+            if mapping.offset == 0 and mapping.path not in self._starts:
+                self._starts[mapping.path] = mapping.start
+
+    def _locate(self, path):
+        build_id = self._core.read_build_id(self._starts[path])
+        self._build_ids[path] = build_id
+        name = os.path.basename(path)
+        candidates = []
+        if build_id or name == os.path.basename(self._programfile):
+            candidates.append(self._programfile)
+        if self._prefix:
+            candidates.append(self._prefix + path)
+        candidates += [os.path.join(p, name) for p in self._paths]
+        if not self._prefix:
+            candidates.append(path)
+        for candidate in candidates:
+            if not os.path.isfile(candidate):
+                continue
+            if build_id and read_build_id(candidate) != build_id:
+                continue
+            return candidate
+        return None
+
+    def find(self, address):
+        """Finds the module holding an address.
+
+        @return: the module and the path of the mapped file, or (None, None)
+        @rtype: (:class:`_Module`, str)
+        """
+        mapping = self._mappings.find(address)
+        if mapping is None or mapping.path not in self._starts:
+            return None, None
+        path = mapping.path
+        if path not in self._modules:
+            filename = self._locate(path)
+            if filename is None:
+                msg = _("can not find '{}'")
+                raise UnwindError(msg.format(path))
+            debug(_("Using '{}' for '{}'").format(filename, path))
+            with _parsing():
+                self._modules[path] = _Module(filename,
+                                              self._starts[path],
+                                              self._build_ids[path],
+                                              self._symbols)
+        return self._modules[path], path
+
+    def close(self):
+        for module in self._modules.values():
+            module.close()
+
+# vim: ts=4 sw=4 sts=4 et ai
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.downloads
+   ````````````````````
+
+   Cache of the files downloaded from crash archive repositories
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import shutil
+import hashlib
+import threading
+import time
+from .log import debug, info
+from .utils import iter_evictions
+from gettext import gettext as _
+
+# Entries holding only a partial download not touched for this number of
+# seconds have been left by interrupted transfers.
+_PARTIAL_TIMEOUT = 24 * 60 * 60
+
+# Suffixes of the files of a partial download.
+_PARTIAL_SUFFIXES = ('.part', '.part.json')
+
+
+class DownloadCache:
+    """Cache of the files downloaded from repositories.
+
+    Each entry is a directory named after a digest of the URL of the
+    repository, the name of the file, its size and its modification time on
+    the server. It holds the downloaded file under its own name, so a file
+    which changed on the server gets a new entry. The fetcher downloads the
+    file directly in the entry, which is complete once the file exists.
+
+    When the size of the entries exceeds the quota, the least recently used
+    ones are removed. Entries with a download in progress are kept.
+
+    @param root: path to the cache
+    @type root: str
+
+    @param quota: maximum size of the cache in bytes
+    @type quota: int
+    """
+    def __init__(self, root, quota):
+        self._root = root
+        self._quota = quota
+        # Several files may be downloaded at once by the same process.
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        return self._root
+
+    def get_path(self, url, filename, size, date):
+        """Returns the path to the entry of a file, creating its directory.
+
+        @param url: URL of the repository
+        @type url: str
+
+        @param filename: name of the file in the repository
+        @type filename: str
+
+        @param size: size of the file on the server, or -1 if unknown
+        @type size: int
+
+        @param date: modification time of the file on the server
+        @type date: str
+
+        @return: the path to the file in the cache
+        @rtype: str
+        """
+        items = [url, filename, str(size), date]
+        key = hashlib.sha1('\n'.join(items).encode('utf-8', 'surrogateescape'))
+        entry = os.path.join(self._root, key.hexdigest())
+        os.makedirs(entry, exist_ok=True)
+        return os.path.join(entry, filename)
+
+    def lookup(self, path):
+        """Looks for a downloaded file, marking its entry as recently used.
+
+        @param path: the path returned by :meth:`get_path`
+        @type path: str
+
+        @return: True if the file has already been downloaded
+        @rtype: bool
+        """
+        if not os.path.isfile(path):
+            return False
+        try:
+            os.utime(os.path.dirname(path))
+        except OSError:
+            return False
+        info(_("Using cached download '{}'").format(path))
+        return True
+
+    def commit(self, path):
+        """Records a downloaded file, removing the least recently used
+        entries if the cache is full.
+
+        @param path: the path returned by :meth:`get_path`
+        @type path: str
+        """
+        os.utime(os.path.dirname(path))
+        with self._lock:
+            self._evict(os.path.dirname(path))
+
+    def _evict(self, current):
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self._root):
+            entry = os.path.join(self._root, name)
+            try:
+                mtime = os.stat(entry).st_mtime
+                names = os.listdir(entry)
+                files = [os.lstat(os.path.join(entry, n)) for n in names]
+            except OSError:
+                continue
+            size = sum(st.st_blocks * 512 for st in files)
+            total += size
+            partial = all(n.endswith(_PARTIAL_SUFFIXES) for n in names)
+            last = max([mtime] + [st.st_mtime for st in files])
+            if partial and last > now - _PARTIAL_TIMEOUT:
+                # Another transfer may be in progress.
+                continue
+            if entry != current:
+                entries.append((mtime, entry, size))
+        for mtime, entry, size in iter_evictions(entries, total,
+                                                 self._quota):
+            debug(_("Removing cached download '{}'").format(entry))
+            shutil.rmtree(entry, ignore_errors=True)
+
+# vim: ts=4 sw=4 sts=4 et ai
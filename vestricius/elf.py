@@ -17,7 +17,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-
 """
    vestricius.elf
    ``````````````
@@ -28,131 +27,937 @@
    :license: GPLv3+
 """
 
-from elftools.elf.elffile import ELFFile
-from elftools.elf.segments import NoteSegment
-from elftools.common.utils import roundup, struct_parse
-from elftools.elf.structs import Enum, Struct
-from elftools.elf.structs import ULInt64, ULInt32, ULInt16, UBInt8
-from elftools.construct import CString, Pass, StaticField
-from collections import namedtuple, defaultdict
-from .common import InvalidFileError
+import hashlib
+import lzma
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from .common import InvalidFileError, get_compression, open_decompressed
 from .log import debug
 from gettext import gettext as _
 
 
-_GNU_NOTE_TYPES = dict(NT_PRSTATUS=1,
-                       NT_FPRREGSET=2,
-                       NT_PRPSINFO=3,
-                       NT_TASKSTRUCT=4,
-                       NT_PLATFORM=5,
-                       NT_AUXV=6,
-                       _default_=Pass)
+NT_PRSTATUS = 1
+NT_FPREGSET = 2
+NT_PRPSINFO = 3
+NT_TASKSTRUCT = 4
+NT_PLATFORM = 5
+NT_AUXV = 6
+NT_SIGINFO = 0x53494749
+NT_FILE = 0x46494c45
+NT_GNU_BUILD_ID = 3
+
+AT_ENTRY = 9
+
+PT_LOAD = 1
+PT_NOTE = 4
+
+PF_X = 1
+
+_ELFMAG = b'\x7fELF'
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ET_CORE = 4
+
+# Maximum number of bytes decompressed from a compressed core dump file. The
+# fingerprint of a crash whose stack lies further can only be computed once
+# the whole file is decompressed.
+_STREAM_LIMIT = 64 * 1024 * 1024
+
+# Minimum number of bytes decompressed at once from a compressed core dump
+# file.
+_STREAM_CHUNK = 1024 * 1024
+
+# Maximum number of bytes decompressed per read from a compressed core dump
+# file, so that little is lost when the file turns out to be truncated.
+_STREAM_STEP = 8 * 1024
+
+# Number of return addresses and size of the stack used to compute crash
+# fingerprints.
+_FINGERPRINT_DEPTH = 8
+_FINGERPRINT_STACK_SIZE = 16 * 1024
+
+_MACHINE_ARCHS = {
+    3: 'x86',
+    8: 'MIPS',
+    20: 'PowerPC',
+    21: 'PowerPC64',
+    40: 'ARM',
+    62: 'x64',
+    183: 'AArch64',
+}
 
 
 ProcessInfo = namedtuple('ProcessInfo', ['name', 'args'])
-CoreDumpInfo = namedtuple('CoreDumpInfo', ['process_info'])
-
-_PRPSINFO_X86_64 = Struct('elf_psinfo',
-                          UBInt8('pr_state'),
-                          UBInt8('pr_sname'),
-                          UBInt8('pr_zomb'),
-                          UBInt8('pr_nice'),
-                          ULInt64('pr_flag'),
-                          ULInt32('gap'),
-                          ULInt32('pr_uid'),
-                          ULInt32('pr_gid'),
-                          ULInt32('pr_pid'),
-                          ULInt32('pr_ppid'),
-                          ULInt32('pr_pgrp'),
-                          ULInt32('pr_sid'),
-                          StaticField('pr_fname', 16),
-                          StaticField('pr_psargs', 80))
-
-_PRPSINFO_X86 = Struct('elf_psinfo',
-                       UBInt8('pr_state'),
-                       UBInt8('pr_sname'),
-                       UBInt8('pr_zomb'),
-                       UBInt8('pr_nice'),
-                       ULInt32('pr_flag'),
-                       ULInt16('pr_uid'),
-                       ULInt16('pr_gid'),
-                       ULInt32('pr_pid'),
-                       ULInt32('pr_ppid'),
-                       ULInt32('pr_pgrp'),
-                       ULInt32('pr_sid'),
-                       StaticField('pr_fname', 16),
-                       StaticField('pr_psargs', 80))
-
-_PRPSINFO_GEN = Struct('elf_psinfo',
-                       UBInt8('pr_state'),
-                       UBInt8('pr_sname'),
-                       UBInt8('pr_zomb'),
-                       UBInt8('pr_nice'),
-                       ULInt32('pr_flag'),
-                       ULInt32('pr_uid'),
-                       ULInt32('pr_gid'),
-                       ULInt32('pr_pid'),
-                       ULInt32('pr_ppid'),
-                       ULInt32('pr_pgrp'),
-                       ULInt32('pr_sid'),
-                       StaticField('pr_fname', 16),
-                       StaticField('pr_psargs', 80))
-
-_PRPSINFO = defaultdict(lambda: _PRPSINFO_GEN,
-                        [('x86', _PRPSINFO_X86),
-                         ('x64', _PRPSINFO_X86_64)])
-
-def iter_notes(segment):
-    offset = segment['p_offset']
-    end = offset + segment['p_filesz']
-    segment.stream.seek(offset)
-    while offset < end:
-        nhdr = Struct('Elf_Nhdr',
-                      ULInt32('n_namesz'),
-                      ULInt32('n_descsz'),
-                      Enum(ULInt32('n_type'), **_GNU_NOTE_TYPES))
-        note = struct_parse(nhdr, segment.stream, offset)
-        note['n_offset'] = offset
-        offset += nhdr.sizeof()
-        segment.stream.seek(offset)
-        size = roundup(note['n_namesz'], 2)
-        data = CString('').parse(segment.stream.read(size))
-        note['n_name'] = data.decode('latin-1')
-        offset += size
-        note['n_desc'] = segment.stream.read(note['n_descsz'])
-        offset += roundup(note['n_descsz'], 2)
-        note['n_size'] = offset - note['n_offset']
-        yield note
-
-
-def parse_note(note, arch):
-    prpsinfo = _PRPSINFO[arch]
-    psinfo = prpsinfo.parse(note['n_desc'])
-    fname = CString('').parse(psinfo['pr_fname']).decode('latin-1')
-    psargs = CString('').parse(psinfo['pr_psargs']).decode('latin-1')
-    return ProcessInfo(fname, psargs)
+CoreDumpInfo = namedtuple('CoreDumpInfo', ['process_info', 'mappings',
+                                           'executable', 'build_ids',
+                                           'fingerprint', 'threads'])
+FileMapping = namedtuple('FileMapping', ['start', 'end', 'offset', 'path'])
+Segment = namedtuple('Segment', ['type', 'flags', 'offset', 'vaddr',
+                                 'filesz', 'memsz'])
+Note = namedtuple('Note', ['name', 'type', 'desc', 'offset'])
+ThreadStatus = namedtuple('ThreadStatus', ['pid', 'signal', 'registers'])
+Thread = namedtuple('Thread', ['tid', 'signal', 'pc', 'sp', 'fp', 'lr'])
+SignalInfo = namedtuple('SignalInfo', ['signal', 'code', 'errno', 'address'])
+_ElfHeader = namedtuple('_ElfHeader', ['elfclass', 'little_endian', 'type',
+                                       'machine', 'entry', 'phoff',
+                                       'phentsize', 'phnum'])
+
+
+def _compile(fmt):
+    return {True: struct.Struct('<' + fmt), False: struct.Struct('>' + fmt)}
+
+# Keyed by ELF class, then by endianness (True for little endian).
+_EHDR = {
+    _ELFCLASS32: _compile('16xHHIIIIIHHHHHH'),
+    _ELFCLASS64: _compile('16xHHIQQQIHHHHHH'),
+}
+
+_PHDR = {
+    _ELFCLASS32: _compile('IIIIIIII'),
+    _ELFCLASS64: _compile('IIQQQQQQ'),
+}
+
+_NHDR = _compile('III')
+
+# Keyed by size in bits of the ELF class, then by endianness.
+_NT_FILE_HDR = {
+    32: _compile('II'),
+    64: _compile('QQ'),
+}
+
+_WORD_TYPECODES = {
+    32: 'I',
+    64: 'Q',
+}
+
+# Layout of the notes describing a process, for a family of architectures.
+# - uid16: True if uid_t and gid_t are 16-bit wide in elf_prpsinfo.
+# - ngreg: number of general purpose registers in elf_prstatus, by size in
+#   bits of the ELF class.
+# - registers: indexes of the program counter, stack pointer, frame pointer
+#   and link register in elf_prstatus, by size in bits of the ELF class.
+# - siginfo: indexes of si_signo, si_code and si_errno in siginfo_t.
+_Machine = namedtuple('_Machine', ['uid16', 'ngreg', 'registers', 'siginfo'])
+
+KeyRegisters = namedtuple('KeyRegisters', ['pc', 'sp', 'fp', 'lr'])
+
+_MACHINES = {
+    3: _Machine(uid16=True,
+                ngreg={32: 17},
+                registers={32: KeyRegisters(12, 15, 5, None)},
+                siginfo=(0, 2, 1)),
+    8: _Machine(uid16=False,
+                ngreg={32: 45, 64: 45},
+                registers={32: KeyRegisters(40, 35, 36, 37),
+                           64: KeyRegisters(34, 29, 30, 31)},
+                siginfo=(0, 1, 2)),
+    20: _Machine(uid16=False,
+                 ngreg={32: 48},
+                 registers={32: KeyRegisters(32, 1, 31, 36)},
+                 siginfo=(0, 2, 1)),
+    21: _Machine(uid16=False,
+                 ngreg={64: 48},
+                 registers={64: KeyRegisters(32, 1, 31, 36)},
+                 siginfo=(0, 2, 1)),
+    40: _Machine(uid16=True,
+                 ngreg={32: 18},
+                 registers={32: KeyRegisters(15, 13, 11, 14)},
+                 siginfo=(0, 2, 1)),
+    62: _Machine(uid16=False,
+                 ngreg={64: 27},
+                 registers={64: KeyRegisters(16, 19, 4, None)},
+                 siginfo=(0, 2, 1)),
+    183: _Machine(uid16=False,
+                  ngreg={64: 34},
+                  registers={64: KeyRegisters(32, 31, 29, 30)},
+                  siginfo=(0, 2, 1)),
+}
+
+# elf_prpsinfo: pr_state, pr_sname, pr_zomb, pr_nice, pr_flag, pr_uid, pr_gid,
+# pr_pid, pr_ppid, pr_pgrp, pr_sid, pr_fname and pr_psargs.
+_PRPSINFO_FORMATS = {
+    (32, True): '4BIHHIIII16s80s',
+    (32, False): '4BIIIIIII16s80s',
+    (64, False): '4B4xQIIIIII16s80s',
+}
+
+# elf_prstatus: pr_info (si_signo, si_code, si_errno), pr_cursig, pr_sigpend,
+# pr_sighold, pr_pid, pr_ppid, pr_pgrp, pr_sid, the four timeval fields and
+# pr_reg, whose registers start at index _PRSTATUS_REG.
+_PRSTATUS_FORMATS = {
+    32: '3ih2xII4I8I{}I',
+    64: '3ih2xQQ4I8Q{}Q',
+}
+_PRSTATUS_REG = 18
+
+# siginfo_t: the first three integers and si_addr, for faults.
+_SIGINFO_FORMATS = {
+    32: '3iI',
+    64: '3i4xQ',
+}
+
+# Decoders for the notes of a given architecture.
+_Decoders = namedtuple('_Decoders', ['prpsinfo', 'prstatus', 'siginfo',
+                                     'machine', 'registers'])
+
+
+def _build_decoders():
+    decoders = {}
+    for e_machine, machine in _MACHINES.items():
+        for bits, ngreg in machine.ngreg.items():
+            for little_endian in (True, False):
+                prefix = '<' if little_endian else '>'
+                uid16 = machine.uid16 and bits == 32
+                fmts = (_PRPSINFO_FORMATS[(bits, uid16)],
+                        _PRSTATUS_FORMATS[bits].format(ngreg),
+                        _SIGINFO_FORMATS[bits])
+                structs = [struct.Struct(prefix + f) for f in fmts]
+                key = (e_machine, bits, little_endian)
+                decoders[key] = _Decoders(*structs,
+                                          machine=machine,
+                                          registers=machine.registers[bits])
+    return decoders
+
+# Keyed by e_machine, size in bits of the ELF class and endianness.
+_DECODERS = _build_decoders()
+
+# Unknown architectures: only elf_prpsinfo can be decoded.
+_GENERIC_DECODERS = {
+    (bits, little_endian): _Decoders(
+        struct.Struct(('<' if little_endian else '>') +
+                      _PRPSINFO_FORMATS[(bits, False)]),
+        None, None, None, None)
+    for bits in (32, 64) for little_endian in (True, False)
+}
+
+
+def _get_decoders(core):
+    key = (core.machine, core.elfclass, core.little_endian)
+    try:
+        return _DECODERS[key]
+    except KeyError:
+        return _GENERIC_DECODERS[key[1:]]
+
+
+def _roundup(value, alignment=4):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+def _cstring(data):
+    return bytes(data).split(b'\0', 1)[0].decode('latin-1')
+
+
+def _unpack_ehdr(view):
+    if len(view) < 16 or view[:4] != _ELFMAG:
+        raise InvalidFileError
+    elfclass = view[4]
+    little_endian = view[5] == _ELFDATA2LSB
+    if elfclass not in _EHDR:
+        raise InvalidFileError
+    ehdr = _EHDR[elfclass][little_endian]
+    (e_type, e_machine, _version, e_entry, e_phoff, _shoff, _flags,
+     _ehsize, e_phentsize, e_phnum, _shentsize, _shnum,
+     _shstrndx) = ehdr.unpack_from(view)
+    return _ElfHeader(elfclass, little_endian, e_type, e_machine, e_entry,
+                      e_phoff, e_phentsize, e_phnum)
+
+
+def _unpack_phdrs(view, header, offset=None):
+    phdr = _PHDR[header.elfclass][header.little_endian]
+    if offset is None:
+        offset = header.phoff
+    segments = []
+    for i in range(header.phnum):
+        fields = phdr.unpack_from(view, offset + i * header.phentsize)
+        if header.elfclass == _ELFCLASS32:
+            (p_type, p_offset, p_vaddr, _paddr, p_filesz, p_memsz,
+             p_flags, _align) = fields
+        else:
+            (p_type, p_flags, p_offset, p_vaddr, _paddr, p_filesz,
+             p_memsz, _align) = fields
+        segments.append(Segment(p_type, p_flags, p_offset,
+                                p_vaddr, p_filesz, p_memsz))
+    return segments
+
+
+def _iter_notes(view, offset, size, little_endian):
+    nhdr = _NHDR[little_endian]
+    end = min(offset + size, len(view))
+    while offset + nhdr.size <= end:
+        namesz, descsz, n_type = nhdr.unpack_from(view, offset)
+        start = offset + nhdr.size
+        # The last notes of a truncated core dump may be incomplete.
+        if start + _roundup(namesz) + descsz > end:
+            break
+        name = _cstring(view[start:start + namesz])
+        start += _roundup(namesz)
+        desc = view[start:start + descsz]
+        yield Note(name, n_type, desc, offset)
+        offset = start + _roundup(descsz)
+
+
+def _read_build_id(read, loaded=False):
+    """Reads the GNU build-id of an ELF image.
+
+    @param read: function returning `size` bytes at `offset` in the image,
+    or None if they are not available
+    @type read: function
+
+    @param loaded: True if the image is loaded in memory, False if it is
+    stored in a file
+    @type loaded: bool
+
+    @return: the build-id as an hexadecimal string, or None
+    @rtype: str
+    """
+    data = read(0, _EHDR[_ELFCLASS64][True].size)
+    if data is None:
+        return None
+    try:
+        header = _unpack_ehdr(data)
+        data = read(header.phoff, header.phnum * header.phentsize)
+        if data is None:
+            return None
+        segments = _unpack_phdrs(data, header, 0)
+    except (InvalidFileError, struct.error):
+        return None
+    loads = [s for s in segments if s.type == PT_LOAD]
+    if loaded and not loads:
+        return None
+    for segment in segments:
+        if segment.type != PT_NOTE:
+            continue
+        if loaded:
+            offset = segment.vaddr - loads[0].vaddr + loads[0].offset
+        else:
+            offset = segment.offset
+        data = read(offset, segment.filesz)
+        if data is None:
+            continue
+        for note in _iter_notes(data, 0, len(data), header.little_endian):
+            if note.name == 'GNU' and note.type == NT_GNU_BUILD_ID:
+                return bytes(note.desc).hex()
+    return None
+
+
+def read_build_id(filename):
+    """Reads the GNU build-id of an ELF file.
+
+    @param filename: path to the ELF file
+    @type filename: str
+
+    @return: the build-id as an hexadecimal string, or None if the file is
+    not an ELF file or has no build-id
+    @rtype: str
+    """
+    with open(filename, 'rb') as f:
+        def read(offset, size):
+            f.seek(offset)
+            data = f.read(size)
+            return data if len(data) == size else None
+        return _read_build_id(read)
+
+
+class CoreFile:
+    """Memory-mapped core dump file.
+
+    Only the pages actually accessed are read from disk, so walking the notes
+    of a core dump costs a few page faults, whatever the size of the file.
+    Note descriptors are handed back as slices of the mapping, so they are
+    only valid until the file is closed.
+
+    If the file is compressed, only the beginning of the core dump, up to the
+    last note, is decompressed in memory. The memory dump is then decompressed
+    on demand, up to a limit, so most of it is unavailable.
+
+    @param filename: path to the core dump file
+    @type filename: str
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._map = None
+        self._view = None
+        self._stream = None
+        self._buffer = None
+        try:
+            if get_compression(filename):
+                self._stream = open_decompressed(filename, external=False)
+                self._buffer = bytearray()
+                self._view = memoryview(self._buffer)
+                self._parse_header()
+                debug(_("Read {} bytes from core dump stream")
+                      .format(len(self._view)))
+            else:
+                self._map = mmap.mmap(self._file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+                self._parse_header()
+        except (InvalidFileError, ValueError, EOFError, OSError,
+                struct.error):
+            self.close()
+            raise InvalidFileError(_("'{}' is not a valid core dump file")
+                                   .format(filename))
+
+    def _parse_header(self):
+        # The ELF header, the program headers and the PT_NOTE segments are
+        # located at the beginning of a core dump, before the memory dump.
+        self._require(_EHDR[_ELFCLASS64][True].size)
+        self._header = _unpack_ehdr(self._view)
+        if self._header.type != _ET_CORE:
+            raise InvalidFileError
+        self._require(self._header.phoff +
+                      self._header.phnum * self._header.phentsize)
+        self._segments = _unpack_phdrs(self._view, self._header)
+        for segment in self._segments:
+            if segment.type == PT_NOTE:
+                self._require(segment.offset + segment.filesz)
+        self._loads = sorted((s for s in self._segments if s.type == PT_LOAD),
+                             key=lambda s: s.vaddr)
+        self._load_addresses = [s.vaddr for s in self._loads]
+
+    def _require(self, size):
+        """Makes sure the first bytes of the core dump are available.
+
+        @param size: number of bytes required
+        @type size: int
+
+        @return: True if the bytes are available
+        @rtype: bool
+        """
+        if size <= len(self._view):
+            return True
+        if self._stream is None or size > _STREAM_LIMIT:
+            return False
+        length = len(self._view)
+        if size > len(self._buffer):
+            # The buffer doubles in size, so each byte is copied a bounded
+            # number of times. Previous slices keep referencing the former
+            # buffer, which is never resized.
+            capacity = max(size, 2 * len(self._buffer), _STREAM_CHUNK)
+            buffer = bytearray(min(capacity, _STREAM_LIMIT))
+            buffer[:length] = self._view
+            self._buffer = buffer
+        # Read ahead up to the end of the buffer.
+        view = memoryview(self._buffer)
+        try:
+            while length < len(self._buffer):
+                end = min(length + _STREAM_STEP, len(self._buffer))
+                n = self._stream.readinto(view[length:end])
+                if not n:
+                    break
+                length += n
+        except (EOFError, OSError, zlib.error, lzma.LZMAError) as e:
+            # A truncated or corrupted core dump is handled like a truncated
+            # plain one: what has been decompressed so far remains available.
+            debug(_("Stopped reading core dump stream: {}").format(e))
+            self._stream.close()
+            self._stream = None
+        view.release()
+        self._view = memoryview(self._buffer)[:length]
+        return size <= length
+
+    @property
+    def arch(self):
+        """Name of the machine architecture"""
+        return _MACHINE_ARCHS.get(self._header.machine, '<unknown>')
+
+    @property
+    def machine(self):
+        """Value of the e_machine field of the ELF header"""
+        return self._header.machine
+
+    @property
+    def elfclass(self):
+        """Size in bits of the ELF class (32 or 64)"""
+        return 32 if self._header.elfclass == _ELFCLASS32 else 64
+
+    @property
+    def little_endian(self):
+        """True if the core dump is little endian"""
+        return self._header.little_endian
+
+    @property
+    def segments(self):
+        """List of program headers, as :class:`Segment`"""
+        return self._segments
+
+    def iter_notes(self):
+        """Iterates over the notes of all the PT_NOTE segments.
+
+        @return: an iterator on the notes
+        @rtype: iterator on :class:`Note`
+        """
+        for segment in self._segments:
+            if segment.type == PT_NOTE:
+                for note in _iter_notes(self._view,
+                                        segment.offset,
+                                        segment.filesz,
+                                        self.little_endian):
+                    yield note
+
+    def find_segment(self, address):
+        """Finds the PT_LOAD segment holding an address.
+
+        The segment may hold the address even if its memory has not been
+        dumped.
+
+        @param address: the address to look for
+        @type address: int
+
+        @return: the matching segment, or None
+        @rtype: :class:`Segment`
+        """
+        index = bisect_right(self._load_addresses, address) - 1
+        if index < 0:
+            return None
+        segment = self._loads[index]
+        if address >= segment.vaddr + segment.memsz:
+            return None
+        return segment
+
+    def read_memory(self, address, size):
+        """Reads the memory of the process, as dumped in the core dump file.
+
+        @param address: address of the memory to read
+        @type address: int
+
+        @param size: number of bytes to read
+        @type size: int
+
+        @return: the bytes read, or None if they have not been dumped
+        @rtype: memoryview
+        """
+        segment = self.find_segment(address)
+        if segment is None or address + size > segment.vaddr + segment.filesz:
+            return None
+        offset = segment.offset + address - segment.vaddr
+        if not self._require(offset + size):
+            return None
+        return self._view[offset:offset + size]
+
+    def read_build_id(self, address):
+        """Reads the GNU build-id of an ELF image loaded in memory.
+
+        The kernel dumps the first page of file-backed mappings which start
+        with an ELF header, where the build-id note usually is.
+
+        @param address: address where the image is loaded
+        @type address: int
+
+        @return: the build-id as an hexadecimal string, or None
+        @rtype: str
+        """
+        return _read_build_id(lambda o, s: self.read_memory(address + o, s),
+                              loaded=True)
+
+    def close(self):
+        """Closes the core dump file."""
+        if self._view is not None:
+            self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A note descriptor is still referenced somewhere, so let the
+                # garbage collector unmap the file once it is released.
+                pass
+        if self._stream is not None:
+            self._stream.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class FileMappings:
+    """Table of the file-backed memory mappings of a process.
+
+    The addresses are stored in arrays and each path is stored only once,
+    so the table stays small even for processes mapping many files.
+
+    @param starts: start addresses of the mappings
+    @type starts: array
+
+    @param ends: end addresses of the mappings
+    @type ends: array
+
+    @param offsets: offsets in the mapped files
+    @type offsets: array
+
+    @param indexes: index in `paths` of the mapped files
+    @type indexes: array
+
+    @param paths: paths of the mapped files
+    @type paths: list of str
+    """
+    def __init__(self, starts=None, ends=None, offsets=None, indexes=None,
+                 paths=None):
+        self._starts = starts or array('Q')
+        self._ends = ends or array('Q')
+        self._offsets = offsets or array('Q')
+        self._indexes = indexes or array('L')
+        self._paths = paths or []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        return FileMapping(self._starts[index],
+                           self._ends[index],
+                           self._offsets[index],
+                           self._paths[self._indexes[index]])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def paths(self):
+        """Paths of the mapped files, in order of first mapping"""
+        return self._paths
+
+    def find(self, address):
+        """Finds the mapping holding an address.
+
+        @param address: the address to look for
+        @type address: int
+
+        @return: the matching mapping, or None
+        @rtype: :class:`FileMapping`
+        """
+        index = bisect_right(self._starts, address) - 1
+        if index >= 0 and address < self._ends[index]:
+            return self[index]
+        return None
+
+
+class ThreadTable:
+    """Table of the threads of a process.
+
+    Only the key registers of each thread are kept, in arrays, so the table
+    stays small even for processes running thousands of threads.
+
+    @param registers: indexes of the key registers in
+    :attr:`ThreadStatus.registers`
+    @type registers: :class:`KeyRegisters`
+    """
+    def __init__(self, registers=None):
+        self._registers = registers
+        self._tids = array('l')
+        self._signals = array('h')
+        self._pcs = array('Q')
+        self._sps = array('Q')
+        self._fps = array('Q')
+        self._lrs = array('Q')
+
+    def append(self, status):
+        """Adds a thread to the table.
+
+        @param status: the status of the thread
+        @type status: :class:`ThreadStatus`
+        """
+        registers = status.registers
+        indexes = self._registers
+        self._tids.append(status.pid)
+        self._signals.append(status.signal)
+        self._pcs.append(registers[indexes.pc])
+        self._sps.append(registers[indexes.sp])
+        self._fps.append(registers[indexes.fp])
+        if indexes.lr is None:
+            self._lrs.append(0)
+        else:
+            self._lrs.append(registers[indexes.lr])
+
+    def __len__(self):
+        return len(self._tids)
+
+    def __getitem__(self, index):
+        lr = None if self._registers.lr is None else self._lrs[index]
+        return Thread(self._tids[index],
+                      self._signals[index],
+                      self._pcs[index],
+                      self._sps[index],
+                      self._fps[index],
+                      lr)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def parse_file_note(note, core):
+    """Parses a NT_FILE note.
+
+    @param note: the note to parse
+    @type note: :class:`Note`
+
+    @param core: the core dump file the note belongs to
+    @type core: :class:`CoreFile`
+
+    @return: the file-backed memory mappings of the process
+    @rtype: :class:`FileMappings`
+    """
+    header = _NT_FILE_HDR[core.elfclass][core.little_endian]
+    if len(note.desc) < header.size:
+        return FileMappings()
+    count, page_size = header.unpack_from(note.desc)
+    entries = array(_WORD_TYPECODES[core.elfclass])
+    # The count of a corrupted note may exceed what the descriptor holds.
+    count = min(count,
+                (len(note.desc) - header.size) // (entries.itemsize * 3))
+    offset = header.size + entries.itemsize * 3 * count
+    entries.frombytes(note.desc[header.size:offset])
+    if core.little_endian != (sys.byteorder == 'little'):
+        entries.byteswap()
+    # Each name is terminated by a NUL byte, so the last item is either
+    # empty or an incomplete name.
+    names = bytes(note.desc[offset:]).split(b'\0')[:-1]
+    count = min(count, len(names))
+    starts = entries[0:3 * count:3]
+    ends = entries[1:3 * count:3]
+    offsets = array('Q', (o * page_size for o in entries[2:3 * count:3]))
+    indexes = array('L')
+    paths = []
+    known = {}
+    for name in names[:count]:
+        path = name.decode('utf-8', errors='replace')
+        if path not in known:
+            known[path] = len(paths)
+            paths.append(path)
+        indexes.append(known[path])
+    return FileMappings(starts, ends, offsets, indexes, paths)
+
+
+def parse_auxv_note(note, core):
+    """Parses a NT_AUXV note.
+
+    @param note: the note to parse
+    @type note: :class:`Note`
+
+    @param core: the core dump file the note belongs to
+    @type core: :class:`CoreFile`
+
+    @return: the auxiliary vector of the process
+    @rtype: dict
+    """
+    entries = array(_WORD_TYPECODES[core.elfclass])
+    size = len(note.desc) - len(note.desc) % (entries.itemsize * 2)
+    entries.frombytes(note.desc[:size])
+    if core.little_endian != (sys.byteorder == 'little'):
+        entries.byteswap()
+    return dict(zip(entries[0::2], entries[1::2]))
+
+
+def parse_prstatus_note(note, core):
+    """Parses a NT_PRSTATUS note.
+
+    @param note: the note to parse
+    @type note: :class:`Note`
+
+    @param core: the core dump file the note belongs to
+    @type core: :class:`CoreFile`
+
+    @return: the status of the thread, or None if the architecture is not
+    supported
+    @rtype: :class:`ThreadStatus`
+    """
+    prstatus = _get_decoders(core).prstatus
+    if prstatus is None:
+        return None
+    fields = prstatus.unpack_from(note.desc)
+    return ThreadStatus(pid=fields[6],
+                        signal=fields[3],
+                        registers=fields[_PRSTATUS_REG:])
+
+
+def parse_siginfo_note(note, core):
+    """Parses a NT_SIGINFO note.
+
+    @param note: the note to parse
+    @type note: :class:`Note`
+
+    @param core: the core dump file the note belongs to
+    @type core: :class:`CoreFile`
+
+    @return: information about the signal, or None if the architecture is
+    not supported
+    @rtype: :class:`SignalInfo`
+    """
+    decoders = _get_decoders(core)
+    if decoders.siginfo is None:
+        return None
+    fields = decoders.siginfo.unpack_from(note.desc)
+    signo, code, errno = (fields[i] for i in decoders.machine.siginfo)
+    return SignalInfo(signal=signo, code=code, errno=errno, address=fields[3])
+
+
+def get_key_registers(core):
+    """Returns the indexes of the key registers of a core dump.
+
+    @param core: the core dump file
+    @type core: :class:`CoreFile`
+
+    @return: indexes of the registers in :attr:`ThreadStatus.registers`, or
+    None if the architecture is not supported
+    @rtype: :class:`KeyRegisters`
+    """
+    return _get_decoders(core).registers
+
+
+def compute_fingerprint(core, status, mappings, name,
+                        depth=_FINGERPRINT_DEPTH):
+    """Computes the fingerprint of a crash.
+
+    The fingerprint is the SHA-1 digest of the name of the executable, the
+    signal, the faulting program counter and the first return addresses found
+    on the stack of the crashed thread. The stack is scanned for words
+    pointing into executable file-backed mappings, which is not as accurate
+    as unwinding it but does not need any debug information. Addresses are
+    made relative to the files they belong to, so the fingerprint does not
+    depend on where the files were loaded.
+
+    @param core: the core dump file
+    @type core: :class:`CoreFile`
+
+    @param status: status of the crashed thread
+    @type status: :class:`ThreadStatus`
+
+    @param mappings: file-backed memory mappings of the process
+    @type mappings: :class:`FileMappings`
+
+    @param name: name of the executable
+    @type name: str
+
+    @param depth: maximum number of return addresses to use
+    @type depth: int
+
+    @return: the fingerprint as an hexadecimal string, or None if the stack
+    is not available, like when it lies beyond the first 64 MiB of a
+    compressed core dump file
+    @rtype: str
+    """
+    registers = get_key_registers(core)
+    if registers is None or status is None:
+        return None
+    sp = status.registers[registers.sp]
+    segment = core.find_segment(sp)
+    if segment is None:
+        return None
+    words = array(_WORD_TYPECODES[core.elfclass])
+    end = min(sp + _FINGERPRINT_STACK_SIZE, segment.vaddr + segment.filesz)
+    size = max(end - sp, 0)
+    data = core.read_memory(sp, size - size % words.itemsize)
+    if data is None:
+        return None
+    words.frombytes(data)
+    if core.little_endian != (sys.byteorder == 'little'):
+        words.byteswap()
+
+    def locate(address):
+        segment = core.find_segment(address)
+        if segment is None or not segment.flags & PF_X:
+            return None
+        mapping = mappings.find(address)
+        if mapping is None:
+            return None
+        offset = address - mapping.start + mapping.offset
+        return '{}+0x{:x}'.format(os.path.basename(mapping.path), offset)
+
+    pc = status.registers[registers.pc]
+    items = [name, str(status.signal), locate(pc) or '??']
+    for word in words:
+        location = locate(word)
+        if location:
+            items.append(location)
+            if len(items) == depth + 3:
+                break
+    debug(_("Crash signature: {}").format(' '.join(items)))
+    return hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+
+def parse_note(note, core):
+    """Parses a NT_PRPSINFO note.
+
+    @param note: the note to parse
+    @type note: :class:`Note`
+
+    @param core: the core dump file the note belongs to
+    @type core: :class:`CoreFile`
+
+    @return: information about the process
+    @rtype: :class:`ProcessInfo`
+    """
+    fields = _get_decoders(core).prpsinfo.unpack_from(note.desc)
+    return ProcessInfo(_cstring(fields[-2]), _cstring(fields[-1]))
 
 
 def parse_core_dump_file(filename):
     """Parses a core dump file.
 
+    The core dump file may be compressed, in which case only its beginning is
+    decompressed.
+
     @param filename: path to the core dump file
     @type filename: str
 
     @return: information from core dump
     @rtype: :class:`CoreDumpInfo`
     """
-    with open(filename, 'rb') as f:
-        elffile = ELFFile(f)
-        arch = elffile.get_machine_arch()
-        debug(_("Machine architecture is '{}'").format(arch))
-        for segment in elffile.iter_segments():
-            if isinstance(segment, NoteSegment):
-                for note in iter_notes(segment):
-                    if (note['n_name'] == 'CORE' and
-                        note['n_type'] == 'NT_PRPSINFO'):
-                        pi = parse_note(note, arch)
-                        return CoreDumpInfo(process_info=pi)
-    raise InvalidFileError
+    pi = None
+    mappings = None
+    status = None
+    auxv = {}
+    with CoreFile(filename) as core:
+        debug(_("Machine architecture is '{}'").format(core.arch))
+        threads = ThreadTable(get_key_registers(core))
+        for note in core.iter_notes():
+            if note.name != 'CORE':
+                continue
+            if note.type == NT_PRPSINFO:
+                pi = parse_note(note, core)
+            elif note.type == NT_AUXV:
+                auxv = parse_auxv_note(note, core)
+            elif note.type == NT_FILE:
+                mappings = parse_file_note(note, core)
+            elif note.type == NT_PRSTATUS:
+                thread = parse_prstatus_note(note, core)
+                if thread is None:
+                    continue
+                threads.append(thread)
+                # The crashed thread comes first.
+                status = status or thread
+        if not pi:
+            raise InvalidFileError
+        if mappings is None:
+            debug(_("No file-backed mappings found in core dump"))
+            mappings = FileMappings()
+        build_ids = {}
+        for mapping in mappings:
+            if mapping.offset == 0 and mapping.path not in build_ids:
+                build_ids[mapping.path] = core.read_build_id(mapping.start)
+        mapping = mappings.find(auxv.get(AT_ENTRY, 0))
+        executable = mapping.path if mapping else None
+        if executable:
+            name = os.path.basename(executable)
+        else:
+            name = pi.name
+        fingerprint = compute_fingerprint(core, status, mappings, name)
+        debug(_("Found {} threads").format(len(threads)))
+    return CoreDumpInfo(process_info=pi,
+                        mappings=mappings,
+                        executable=executable,
+                        build_ids=build_ids,
+                        fingerprint=fingerprint,
+                        threads=threads)
 
 # vim: ts=4 sw=4 sts=4 et ai
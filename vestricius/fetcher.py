@@ -30,6 +30,35 @@
 
 
 import abc
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .log import info, warning
+from .utils import format_size
+from gettext import gettext as _
+
+# Number of files retrieved at the same time by default.
+_JOBS = 4
+
+
+class _TransferCounter:
+    """Counts the bytes transferred for a file, from the progress
+    notifications of :meth:`Fetcher.retrieve`."""
+    def __init__(self):
+        self._first = None
+        self._last = 0
+
+    def __call__(self, n_blocks, block_size, size):
+        count = n_blocks * block_size
+        if size >= 0:
+            count = min(count, size)
+        # The first notification gives the size resumed from, if any.
+        if self._first is None:
+            self._first = count
+        self._last = count
+
+    @property
+    def transferred(self):
+        return self._last - (self._first or 0)
 
 
 class Fetcher:
@@ -84,5 +113,49 @@ class Fetcher:
         """
         pass
 
+    def retrieve_many(self, filenames, dest=None, jobs=None):
+        """Retrieves several files from the repository at the same time.
+
+        A file which can not be retrieved does not stop the others.
+
+        @param filenames: names of the files
+        @type filenames: list of str
+
+        @param dest: path to the output directory
+        @type dest: str
+
+        @param jobs: maximum number of files retrieved at the same time, or
+        None for the default one
+        @type jobs: int
+
+        @return: the paths to the retrieved files, and the names of the
+        files which could not be retrieved with the error raised
+        @rtype: (list of str, list of (str, Exception))
+        """
+        start = time.monotonic()
+        paths = []
+        failures = []
+        counters = [_TransferCounter() for fn in filenames]
+        with ThreadPoolExecutor(max_workers=jobs or _JOBS) as executor:
+            futures = [(fn, executor.submit(self.retrieve, fn, dest, c))
+                       for fn, c in zip(filenames, counters)]
+            for fn, future in futures:
+                try:
+                    paths.append(future.result())
+                except Exception as e:
+                    warning(_("Can not retrieve '{}' ({})").format(fn, e))
+                    failures.append((fn, e))
+        elapsed = max(time.monotonic() - start, 1e-3)
+        # Files found in a download cache or already partly downloaded do
+        # not count in the throughput.
+        size = sum(c.transferred for c in counters)
+        msg = _("Retrieved {} files ({} transferred) in {:.1f} seconds "
+                "({}/s)")
+        info(msg.format(len(paths),
+                        format_size(size),
+                        elapsed,
+                        format_size(int(size / elapsed))))
+        return paths, failures
+
 
 # vim: ts=4 sw=4 sts=4 et ai
@@ -32,10 +32,13 @@ from .ftp import FTPFetcher
 from gettext import gettext as _
 
 
-def create_fetcher(repo_url):
+def create_fetcher(repo_url, retries=None, retry_delay=None, cache=None):
     if not repo_url:
         raise RuntimeError(_("invalid repository URL"))
-    return FTPFetcher(repo_url)
+    return FTPFetcher(repo_url,
+                      retries=retries,
+                      retry_delay=retry_delay,
+                      cache=cache)
 
 
 # vim: ts=4 sw=4 sts=4 et ai
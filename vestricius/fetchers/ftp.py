@@ -30,19 +30,234 @@
 
 import os
 import re
-from ftplib import FTP
-from urllib.request import urlretrieve
+import json
+import shutil
+import time
+import atexit
+import posixpath
+import threading
+import contextlib
+from ftplib import FTP, error_perm, error_temp, all_errors
 from urllib.parse import urlparse, urlunparse
+from collections import namedtuple
 from datetime import datetime
-from ..log import debug
+from ..log import debug, warning
 from ..fetcher import Fetcher
 from ..common import FileNotFoundError
 from gettext import gettext as _
 
+# Size of the blocks passed to the progress callback, as urlretrieve does.
+_BLOCK_SIZE = 8192
+
+# Connections idle for longer than this number of seconds are checked with
+# NOOP before being used again.
+_CHECK_DELAY = 10
+
+# Maximum number of idle connections kept open for each host and user.
+_MAX_IDLE = 4
+
+_TIMEOUT = 60
+
+# Number of attempts to resume an interrupted transfer, and number of
+# seconds to wait before the first one, doubled after each failure.
+_RETRIES = 5
+_RETRY_DELAY = 2
+
+# Suffix of the file being downloaded, and of the checkpoint describing the
+# remote file it is a part of.
+_PART_SUFFIX = '.part'
+_CHECKPOINT_SUFFIX = '.part.json'
+
+# Suffix of the link to a cached file being created.
+_LINK_SUFFIX = '.link'
+
+# Maximum number of MDTM commands sent before reading their responses.
+_PIPELINE_SIZE = 64
+
+_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+# Time given by a MDTM response, possibly followed by a fraction of second
+# or by comments.
+_MDTM_TIME = re.compile(r'(\d{14})(\.\d+)?(\s|$)')
+
+# File of the repository, with its size if known and the date of its last
+# modification.
+_Entry = namedtuple('_Entry', ['name', 'size', 'date'])
+
+
+class _PooledFTP(FTP):
+    """FTP control connection which remembers its working directory."""
+    def __init__(self, host, port, username, password):
+        FTP.__init__(self, timeout=_TIMEOUT)
+        self.connect(host, port)
+        self.login(username or '', password or '')
+        self.home = self.pwd()
+        self.directory = self.home
+        self.last_used = time.monotonic()
+        self.use_mlsd = True
+
+    def chdir(self, path):
+        """Changes the working directory, if needed.
+
+        @param path: path to the directory, relative to the login directory
+        @type path: str
+        """
+        directory = posixpath.normpath(posixpath.join(self.home, path))
+        if directory != self.directory:
+            self.cwd(directory)
+            self.directory = directory
+
+
+class FTPConnectionPool:
+    """Pool of authenticated FTP control connections, by host and user.
+
+    The connections are kept open between operations, so each one does not
+    cost a TCP connection, a login and a change of directory. A connection
+    idle for a while is checked with NOOP before being used again, and
+    replaced if the server closed it.
+
+    The pool can be used by several threads, each connection being used by
+    only one of them at a time.
+
+    @param max_idle: maximum number of idle connections kept open for each
+    host and user
+    @type max_idle: int
+    """
+    def __init__(self, max_idle=_MAX_IDLE):
+        self._max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    @contextlib.contextmanager
+    def connection(self, host, port=21, username=None, password=None):
+        """Gets a connection to a server, for the duration of the context.
+
+        If an error other than a refused command occurs in the context, the
+        connection is closed instead of going back to the pool.
+
+        @param host: host name of the server
+        @type host: str
+
+        @param port: port of the server
+        @type port: int
+
+        @param username: user name to log in with, or None for anonymous
+        @type username: str
+
+        @param password: password to log in with
+        @type password: str
+
+        @return: the connection
+        @rtype: :class:`ftplib.FTP`
+        """
+        key = (host, port, username)
+        ftp = self._acquire(key)
+        if ftp is None:
+            debug(_("Connecting to {}").format(host))
+            ftp = _PooledFTP(host, port, username, password)
+        try:
+            yield ftp
+        except error_perm:
+            # The server refused a command, the connection is still usable.
+            self._release(key, ftp)
+            raise
+        except:
+            ftp.close()
+            raise
+        self._release(key, ftp)
+
+    def _acquire(self, key):
+        while True:
+            with self._lock:
+                connections = self._idle.get(key)
+                if not connections:
+                    return None
+                ftp = connections.pop()
+            if time.monotonic() - ftp.last_used < _CHECK_DELAY:
+                return ftp
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except all_errors as e:
+                debug(_("Dropping stale connection to {} ({})")
+                      .format(key[0], e))
+                ftp.close()
+
+    def _release(self, key, ftp):
+        ftp.last_used = time.monotonic()
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self._max_idle:
+                connections.append(ftp)
+                return
+        ftp.close()
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self._lock:
+            connections = [c for l in self._idle.values() for c in l]
+            self._idle.clear()
+        for ftp in connections:
+            try:
+                ftp.quit()
+            except all_errors:
+                ftp.close()
+
+
+def _parse_time(value):
+    # Times are given as YYYYMMDDHHMMSS, possibly followed by a fraction of
+    # second.
+    if not value:
+        return datetime.fromtimestamp(0)
+    return datetime.strptime(value[:14], _TIME_FORMAT)
+
+
+def _parse_mdtm(response):
+    # Returns the time given by the response to a MDTM command, or None if
+    # it can not be parsed.
+    fields = response.split(None, 1)
+    if len(fields) != 2 or fields[0] != '213':
+        return None
+    match = _MDTM_TIME.match(fields[1])
+    if not match:
+        return None
+    try:
+        return _parse_time(match.group(1))
+    except ValueError:
+        return None
+
+
+def _link(path, dest):
+    # Hard links cost neither time nor space, but the output directory may
+    # be on another file system.
+    os.makedirs(dest, exist_ok=True)
+    target = os.path.join(dest, os.path.basename(path))
+    if os.path.exists(target) and os.path.samefile(path, target):
+        # Renaming a link over another link to the same file does nothing,
+        # which would leave the temporary link behind.
+        return target
+    tmp = target + _LINK_SUFFIX
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    try:
+        os.link(path, tmp)
+    except OSError:
+        shutil.copyfile(path, tmp)
+    os.replace(tmp, target)
+    return target
+
+
+# Shared by all the fetchers and watchers of the process.
+_pool = FTPConnectionPool()
+atexit.register(_pool.close)
+
 
 class FTPFetcher(Fetcher):
     """Fetches crash archive
 
+    Connections to the server are taken from a pool shared by all the
+    fetchers, and kept open for the next operations.
+
     @param url: url of the crash archive repository
     @type url: str
 
@@ -51,8 +266,20 @@ class FTPFetcher(Fetcher):
 
     @param pasword: optional password
     @type password: str
+
+    @param retries: number of attempts to resume an interrupted download,
+    or None for the default one
+    @type retries: int
+
+    @param retry_delay: number of seconds to wait before the first attempt,
+    doubled after each one, or None for the default one
+    @type retry_delay: int
+
+    @param cache: cache to keep the downloaded files in, or None
+    @type cache: :class:`vestricius.downloads.DownloadCache`
     """
-    def __init__(self, url, username=None, password=None):
+    def __init__(self, url, username=None, password=None,
+                 retries=None, retry_delay=None, cache=None):
         parsed_url = urlparse(url)
         self._url = urlunparse((parsed_url.scheme,
                                 parsed_url.hostname,
@@ -60,66 +287,260 @@ class FTPFetcher(Fetcher):
                                 parsed_url.params,
                                 parsed_url.query,
                                 parsed_url.fragment))
+        self._host = parsed_url.hostname
+        self._port = parsed_url.port or 21
+        self._path = parsed_url.path.lstrip('/')
         self._username = parsed_url.username or username
         self._password = parsed_url.password or password
+        if retries is None:
+            retries = _RETRIES
+        if retry_delay is None:
+            retry_delay = _RETRY_DELAY
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._cache = cache
 
     @property
     def url(self):
         return self._url
 
-    def _get_url_full(self):
-        parsed_url = urlparse(self._url)
-        if self._username:
-            text = self._username
-            if self._password:
-                text += ':' + self._password
-            text += '@'
-        else:
-            text = ''
-        url = urlunparse((parsed_url.scheme,
-                          text + parsed_url.hostname,
-                          parsed_url.path,
-                          parsed_url.params,
-                          parsed_url.query,
-                          parsed_url.
-                          fragment))
-        return url
+    @contextlib.contextmanager
+    def _connect(self):
+        with _pool.connection(self._host,
+                              self._port,
+                              self._username,
+                              self._password) as ftp:
+            ftp.chdir(self._path)
+            yield ftp
 
     def lookup(self, pattern=None, count=1):
         debug(_("Looking for crash archive at {}").format(self.url))
+        with self._connect() as ftp:
+            entries = self._list(ftp, pattern, count)
+        return [(e.name, e.date.strftime("%Y-%m-%d--%H:%M:%S"))
+                for e in entries]
+
+    def _list(self, ftp, pattern=None, count=None):
+        # Lists the files matching the pattern, the latest first.
+        expr = re.compile(pattern) if pattern else None
+        if ftp.use_mlsd:
+            try:
+                entries = self._list_with_mlsd(ftp, expr)
+                return entries[:count]
+            except error_perm as e:
+                # Only fall back if the command is not implemented.
+                if not str(e).startswith(('500', '502')):
+                    raise
+                debug(_("Listing without MLSD ({})").format(e))
+                ftp.use_mlsd = False
         files = []
-        results = []
-        host, path = self._url.strip('ftp://').split('/', 1)
-        with FTP(host) as ftp:
-            ftp.login(self._username, self._password)
-            ftp.cwd(path)
-            ftp.retrlines('LIST -t .', lambda l: files.append(l.split()[-1]))
-            if pattern:
-                expr = re.compile(pattern)
-                files = [f for f in files if expr.search(f)]
-            files = files[:count]
-            for fn in files:
-                line = ftp.sendcmd("MDTM {}".format(fn))
-                code, timestamp = line.split()
-                if code == '213':
-                    date = datetime.strptime(timestamp, "%Y%m%d%H%M%S")
-                else:
-                    date = datetime.fromtimestamp(0)
-                results.append((fn, date.strftime("%Y-%m-%d--%H:%M:%S")))
-        return results
+        ftp.retrlines('LIST -t .', lambda l: files.append(l.split()[-1]))
+        if expr:
+            files = [f for f in files if expr.search(f)]
+        files = files[:count]
+        dates = self._get_dates(ftp, files)
+        entries = []
+        for f, d in zip(files, dates):
+            if d is None:
+                warning(_("Ignoring '{}', invalid modification time")
+                        .format(f))
+                continue
+            entries.append(_Entry(f, None, d))
+        return entries
+
+    def _list_with_mlsd(self, ftp, expr):
+        # A single command gives the type, size and date of all the files.
+        entries = []
+        for name, facts in ftp.mlsd():
+            if facts.get('type') != 'file':
+                continue
+            if expr and not expr.search(name):
+                continue
+            size = facts.get('size')
+            try:
+                date = _parse_time(facts.get('modify'))
+            except ValueError:
+                warning(_("Ignoring '{}', invalid modification time")
+                        .format(name))
+                continue
+            entries.append(_Entry(name,
+                                  int(size) if size else None,
+                                  date))
+        entries.sort(key=lambda e: e.date, reverse=True)
+        return entries
+
+    def _get_dates(self, ftp, files):
+        # Files whose time is refused get the epoch, like the listings
+        # without time, and those whose time can not be parsed get None.
+        dates = []
+        for i in range(0, len(files), _PIPELINE_SIZE):
+            batch = files[i:i + _PIPELINE_SIZE]
+            # The commands are sent at once, so the responses come back
+            # without waiting a round trip for each file.
+            lines = ''.join("MDTM {}\r\n".format(fn) for fn in batch)
+            ftp.sock.sendall(lines.encode(ftp.encoding))
+            for fn in batch:
+                try:
+                    response = ftp.getresp()
+                except (error_perm, error_temp):
+                    dates.append(_parse_time(None))
+                    continue
+                date = _parse_mdtm(response)
+                if date is None:
+                    debug(_("Unexpected response to MDTM {}: {}")
+                          .format(fn, response))
+                dates.append(date)
+        return dates
 
     def fetch(self, pattern=None, dest=None, callback=None):
-        fn = self.lookup(pattern)
-        return self.retrieve(fn, dest, callback)
+        results = self.lookup(pattern)
+        if not results:
+            raise FileNotFoundError(_("no matching file found"))
+        return self.retrieve(results[0][0], dest, callback)
 
     def retrieve(self, filename, dest=None, callback=None):
-        dest = dest or os.getcwd()
-        path = os.path.join(dest, filename)
-        url = self._get_url_full() + filename
-        if not os.path.exists(dest):
-            os.makedirs(dest)
-        (output, headers) = urlretrieve(url, path, callback)
-        return output
+        """Retrieves a file from the repository.
+
+        The file is downloaded to a '.part' file next to the destination,
+        along with a checkpoint identifying the remote file. If the transfer
+        is interrupted, it is resumed from where it stopped, possibly by a
+        later call, as long as the remote file did not change.
+
+        If the fetcher has a download cache, the file is downloaded in the
+        cache, unless it is already there and did not change on the server.
+        It is then linked to the output directory, if any.
+
+        @param filename: name of the file
+        @type filename: str
+
+        @param dest: path to the output directory, the current one by
+        default, or the cache if any
+        @type dest: str
+
+        @param callback: function to call to notify transfer progress, with
+        the number of blocks transferred, the size of a block and the size
+        of the file, like the reporthook of urlretrieve
+        @type callback: function
+
+        @return: the path to the downloaded file
+        @rtype: str
+        """
+        if self._cache is None:
+            dest = dest or os.getcwd()
+            # Several files may be retrieved to the same directory at once.
+            os.makedirs(dest, exist_ok=True)
+            path = os.path.join(dest, filename)
+            self._download(filename, path, callback)
+            return path
+        with self._connect() as ftp:
+            remote = self._stat(ftp, filename)
+        path = self._cache.get_path(self._url,
+                                    filename,
+                                    remote['size'],
+                                    remote['date'])
+        if not self._cache.lookup(path):
+            self._download(filename, path, callback)
+            self._cache.commit(path)
+        if dest:
+            path = _link(path, dest)
+        return path
+
+    def _download(self, filename, path, callback):
+        attempt = 0
+        while True:
+            try:
+                self._retrieve_part(filename, path, callback)
+                break
+            except error_perm:
+                raise
+            except all_errors as e:
+                if attempt >= self._retries:
+                    raise
+                delay = self._retry_delay * 2 ** attempt
+                attempt += 1
+                msg = _("Transfer of '{}' interrupted ({}), "
+                        "retrying in {} seconds")
+                warning(msg.format(filename, e, delay))
+                time.sleep(delay)
+        os.replace(path + _PART_SUFFIX, path)
+        os.unlink(path + _CHECKPOINT_SUFFIX)
+
+    def _stat(self, ftp, filename):
+        # Identifies the remote file by its URL, size and date.
+        ftp.voidcmd('TYPE I')
+        try:
+            size = ftp.size(filename)
+        except error_perm as e:
+            if str(e).startswith('550'):
+                raise
+            size = None
+        if size is None:
+            size = -1
+        date = self._get_dates(ftp, [filename])[0] or _parse_time(None)
+        return {
+            'url': self._url + filename,
+            'size': size,
+            'date': date.strftime(_TIME_FORMAT),
+        }
+
+    def _retrieve_part(self, filename, path, callback):
+        part = path + _PART_SUFFIX
+        with self._connect() as ftp:
+            remote = self._stat(ftp, filename)
+            size = remote['size']
+            offset = self._get_offset(path, remote)
+            if offset:
+                debug(_("Resuming transfer of '{}' at {} bytes")
+                      .format(filename, offset))
+            n_blocks = offset // _BLOCK_SIZE
+            if callback:
+                callback(n_blocks, _BLOCK_SIZE, size)
+            if offset == size:
+                # An empty file is complete without any transfer.
+                open(part, 'ab').close()
+                return
+            try:
+                conn = ftp.transfercmd('RETR {}'.format(filename),
+                                       offset or None)
+            except error_perm as e:
+                # The file may still be retrieved if only REST is refused.
+                if not offset or str(e).startswith('550'):
+                    raise
+                debug(_("Can not resume transfer ({})").format(e))
+                offset = 0
+                conn = ftp.transfercmd('RETR {}'.format(filename))
+            with conn, conn.makefile('rb') as src, \
+                    open(part, 'r+b' if offset else 'wb') as dst:
+                dst.seek(offset)
+                dst.truncate()
+                while True:
+                    block = src.read(_BLOCK_SIZE)
+                    if not block:
+                        break
+                    dst.write(block)
+                    n_blocks += 1
+                    if callback:
+                        callback(n_blocks, _BLOCK_SIZE, size)
+                received = dst.tell()
+            ftp.voidresp()
+        if size >= 0 and received != size:
+            raise EOFError(_("got {} bytes out of {}").format(received, size))
 
+    def _get_offset(self, path, remote):
+        # Returns the size of the part already downloaded, if it belongs to
+        # the same remote file. Otherwise, a new checkpoint is written.
+        part = path + _PART_SUFFIX
+        checkpoint = path + _CHECKPOINT_SUFFIX
+        try:
+            with open(checkpoint) as f:
+                if json.load(f) == remote:
+                    offset = os.path.getsize(part)
+                    if remote['size'] < 0 or offset <= remote['size']:
+                        return offset
+        except (OSError, ValueError):
+            pass
+        with open(checkpoint, 'w') as f:
+            json.dump(remote, f)
+        return 0
 
 # vim: ts=4 sw=4 sts=4 et ai
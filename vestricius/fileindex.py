@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.fileindex
+   ````````````````````
+
+   Persistent index of the names of the files found in search paths
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import re
+import sqlite3
+from collections import deque
+from .log import debug, info
+from gettext import gettext as _
+
+# Version of the database schema, incremented on each incompatible change.
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER,
+                                 serial INTEGER);
+CREATE TABLE IF NOT EXISTS files (dir TEXT, name TEXT);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+PRAGMA user_version = {};
+""".format(_SCHEMA_VERSION)
+
+# Directories below a root have paths between '<root>/' and '<root>0', as '0'
+# follows '/' in ASCII. The parameters are given by _tree().
+_SUBDIRS = "(path = ? OR (path >= ? || '/' AND path < ? || '0'))"
+_FILES = "(dir = ? OR (dir >= ? || '/' AND dir < ? || '0'))"
+
+
+def _tree(path):
+    # Parameters of _SUBDIRS and _FILES for the tree under a directory. The
+    # trailing separator of the root directory must not be doubled.
+    prefix = path.rstrip(os.sep)
+    return path, prefix, prefix
+
+
+class FileIndex:
+    """Index of the names of the files found in directory trees.
+
+    The index is stored in a SQLite database. The modification time of each
+    directory is recorded, so only the directories whose content changed are
+    scanned again when the index is refreshed. A tree is refreshed the first
+    time it is searched by the process.
+
+    Each scan of a directory is numbered, so that users of the index can
+    tell which directories changed since they last read it.
+
+    @param filename: path to the database
+    @type filename: str
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        self._db = None
+        self._validated = set()
+        self._serial = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self._filename)
+            version, = self._db.execute("PRAGMA user_version").fetchone()
+            if version != _SCHEMA_VERSION:
+                # The index can be rebuilt, so an outdated one is dropped.
+                self._db.executescript("DROP TABLE IF EXISTS roots;"
+                                       "DROP TABLE IF EXISTS dirs;"
+                                       "DROP TABLE IF EXISTS files;")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    @property
+    def serial(self):
+        """Number of the latest scan of a directory"""
+        db = self._connect()
+        serial, = db.execute("SELECT MAX(serial) FROM dirs").fetchone()
+        return serial or 0
+
+    def close(self):
+        """Closes the database."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def update(self, paths):
+        """Makes the index of some directory trees up to date.
+
+        Trees already refreshed by the process are skipped.
+
+        @param paths: list of paths to the top directories of the trees
+        @type paths: list of str
+        """
+        db = self._connect()
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in self._validated or not os.path.isdir(path):
+                continue
+            self._serial = self.serial + 1
+            with db:
+                if db.execute("SELECT 1 FROM roots WHERE path = ?",
+                              (path,)).fetchone():
+                    self._refresh(db, path)
+                else:
+                    info(_("Indexing files in '{}'").format(path))
+                    db.execute("INSERT INTO roots VALUES (?)", (path,))
+                    self._scan(db, path)
+            self._validated.add(path)
+
+    def _scan_folder(self, db, folder):
+        """Indexes the files of a directory.
+
+        @return: the subdirectories, or None if the directory can not be read
+        @rtype: list of str
+        """
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            entries = list(os.scandir(folder))
+        except OSError:
+            return None
+        files = []
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    # Like os.walk(), do not follow symbolic links.
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                    continue
+            except OSError:
+                pass
+            files.append((folder, entry.name))
+        db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                   (folder, mtime, self._serial))
+        db.execute("DELETE FROM files WHERE dir = ?", (folder,))
+        db.executemany("INSERT INTO files VALUES (?, ?)", files)
+        return subdirs
+
+    def _scan(self, db, path):
+        pending = deque([path])
+        while pending:
+            subdirs = self._scan_folder(db, pending.popleft())
+            if subdirs:
+                pending.extend(subdirs)
+
+    def _refresh(self, db, path):
+        known = dict(db.execute("SELECT path, mtime FROM dirs WHERE " +
+                                _SUBDIRS, _tree(path)))
+        changed = 0
+        for folder in sorted(known):
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime == known[folder]:
+                continue
+            changed += 1
+            if mtime is None:
+                db.execute("DELETE FROM dirs WHERE " + _SUBDIRS,
+                           _tree(folder))
+                db.execute("DELETE FROM files WHERE " + _FILES,
+                           _tree(folder))
+                continue
+            # Only the new subdirectories are scanned, the others are
+            # checked on their own.
+            for subdir in self._scan_folder(db, folder) or []:
+                if subdir not in known:
+                    self._scan(db, subdir)
+        debug(_("Refreshed {} out of {} directories in '{}'")
+              .format(changed, len(known), path))
+
+    def iter_files(self, paths, serial=0):
+        """Iterates over the files of the directories scanned after a given
+        scan.
+
+        @param paths: list of paths to the top directories of the trees
+        @type paths: list of str
+
+        @param serial: number of the scan, as given by :attr:`serial`, or 0
+        for all the files
+        @type serial: int
+
+        @return: an iterator on the full paths of the files
+        @rtype: iterator on str
+        """
+        self.update(paths)
+        db = self._connect()
+        for path in paths:
+            path = os.path.abspath(path)
+            rows = db.execute("SELECT dir, name FROM files WHERE dir IN "
+                              "(SELECT path FROM dirs WHERE serial > ? AND " +
+                              _SUBDIRS + ")", (serial,) + _tree(path))
+            for folder, name in rows.fetchall():
+                yield os.path.join(folder, name)
+
+    def find(self, pattern, paths):
+        """Finds the first file whose name matches a pattern.
+
+        The files of each path are checked in the order of their paths. Use
+        :meth:`find_name` to look for a file by name, which does not check
+        them all.
+
+        @param pattern: pattern for the name of the file to look for
+        @type pattern: str
+
+        @param paths: list of paths to search into
+        @type paths: list of str
+
+        @return: the full path of the file, or None
+        @rtype: str
+        """
+        self.update(paths)
+        p = re.compile(pattern)
+        db = self._connect()
+        for path in paths:
+            path = os.path.abspath(path)
+            rows = db.execute("SELECT dir, name FROM files WHERE " + _FILES +
+                              " ORDER BY dir, name", _tree(path))
+            for folder, name in rows:
+                if p.match(name):
+                    return os.path.join(folder, name)
+        return None
+
+    def find_name(self, name, paths):
+        """Finds the first file with some name.
+
+        The name is looked up in the index, instead of matching the names
+        of all the files. Files are ordered as :meth:`find` does.
+
+        @param name: name of the file to look for
+        @type name: str
+
+        @param paths: list of paths to search into
+        @type paths: list of str
+
+        @return: the full path of the file, or None
+        @rtype: str
+        """
+        folder = self.find_names([name], paths).get(name)
+        if folder is None:
+            return None
+        return os.path.join(folder, name)
+
+    def find_names(self, names, paths):
+        """Finds the directories holding files with some names.
+
+        @param names: names of the files to look for
+        @type names: iterable of str
+
+        @param paths: list of paths to search into
+        @type paths: list of str
+
+        @return: the directory holding the first file found, by name
+        @rtype: dict
+        """
+        self.update(paths)
+        db = self._connect()
+        wanted = set(names)
+        found = {}
+        for path in paths:
+            if not wanted:
+                break
+            path = os.path.abspath(path)
+            for name in sorted(wanted):
+                row = db.execute("SELECT dir FROM files WHERE name = ? AND " +
+                                 _FILES + " ORDER BY dir LIMIT 1",
+                                 (name,) + _tree(path)).fetchone()
+                if row:
+                    found[name] = row[0]
+                    wanted.discard(name)
+        return found
+
+# vim: ts=4 sw=4 sts=4 et ai
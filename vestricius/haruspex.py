@@ -61,6 +61,33 @@ class Haruspex:
         """
         pass
 
+    @abc.abstractmethod
+    def fetch(self, pattern=None, count=1, filenames=None, dest=None,
+              jobs=None):
+        """Fetches the latest available crash archives, or the given ones
+
+        @param pattern: pattern of the crash archive name
+        @type pattern: str
+
+        @param count: number of crash archives to fetch
+        @type count: int
+
+        @param filenames: names of the crash archives to fetch, instead of
+        the latest ones
+        @type filenames: list of str
+
+        @param dest: path to the output directory
+        @type dest: str
+
+        @param jobs: maximum number of crash archives fetched at the same time
+        @type jobs: int
+
+        @return: the paths to the fetched crash archives, and the names of
+        the crash archives which could not be fetched with the error raised
+        @rtype: (list of str, list of (str, Exception))
+        """
+        pass
+
     @abc.abstractmethod
     def peek(self, pattern, count):
         """Returns information about the latest available crash archive
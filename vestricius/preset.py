@@ -31,6 +31,7 @@
 
 import os
 from configparser import ConfigParser
+from .utils import parse_size
 
 
 class Preset:
@@ -76,6 +77,20 @@ class Preset:
         """
         return self._parser.get(section, option, fallback=fallback)
 
+    def get_options(self, section):
+        """Gets the names of the options of the named section.
+
+        @param section: name of the section
+        @type section: str
+
+        @return: the names of the options, or an empty list if the section
+        does not exist
+        @rtype: list of str
+        """
+        if not self._parser.has_section(section):
+            return []
+        return self._parser.options(section)
+
     def get_list(self, section, option):
         """A convenience method which coerces the option in the specified
         section to a list of strings.
@@ -92,6 +107,63 @@ class Preset:
         value = self._parser.get(section, option)
         return [s.strip() for s in value.split(',')]
 
+    def get_boolean(self, section, option, fallback=False):
+        """A convenience method which coerces the option in the specified
+        section to a boolean.
+
+        @param section: name of the section
+        @type section: str
+
+        @param option: name of the option
+        @type option: str
+
+        @param fallback: value to return if the option is not found
+        @type fallback: bool
+
+        @return: the value of the option
+        @rtype: bool
+        """
+        return self._parser.getboolean(section, option, fallback=fallback)
+
+    def get_int(self, section, option, fallback=None):
+        """A convenience method which coerces the option in the specified
+        section to an integer.
+
+        @param section: name of the section
+        @type section: str
+
+        @param option: name of the option
+        @type option: str
+
+        @param fallback: value to return if the option is not found
+        @type fallback: int
+
+        @return: the value of the option
+        @rtype: int
+        """
+        return self._parser.getint(section, option, fallback=fallback)
+
+    def get_size(self, section, option, fallback=None):
+        """A convenience method which coerces the option in the specified
+        section to a number of bytes.
+
+        @param section: name of the section
+        @type section: str
+
+        @param option: name of the option
+        @type option: str
+
+        @param fallback: value to return if the option is not found
+        @type fallback: int
+
+        @return: the value of the option
+        @rtype: int
+        """
+        value = self._parser.get(section, option, fallback=None)
+        if value is None:
+            return fallback
+        return parse_size(value)
+
     def get_path(self, section, option, fallback=None):
         """A convenience method which coerces the option in the specified
         section to file system path.
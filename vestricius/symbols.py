@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+   vestricius.symbols
+   ``````````````````
+
+   Sorted index of the function symbols of ELF files
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import mmap
+import struct
+from array import array
+from bisect import bisect_right
+from .log import debug
+from .utils import atomic_write
+from gettext import gettext as _
+
+# Header of an index file: magic, version, number of symbols and size of the
+# names. The arrays and the names follow, in native byte order.
+_MAGIC = b'VSYM'
+_VERSION = 1
+_HEADER = struct.Struct('=4sIQQ')
+
+
+class SymbolIndex:
+    """Index of the function symbols of an ELF file.
+
+    The start addresses, sizes and offsets of the names of the symbols are
+    stored in parallel arrays, sorted by address, and the names are stored
+    in a single block of NUL-terminated strings.
+
+    @param starts: start addresses of the symbols
+    @type starts: array
+
+    @param sizes: sizes of the symbols
+    @type sizes: array
+
+    @param offsets: offsets of the names of the symbols in `names`
+    @type offsets: array
+
+    @param names: names of the symbols
+    @type names: bytes
+    """
+    def __init__(self, starts, sizes, offsets, names):
+        self._starts = starts
+        self._sizes = sizes
+        self._offsets = offsets
+        self._names = names
+        self._base = 0
+        self._map = None
+
+    def __len__(self):
+        return len(self._starts)
+
+    def lookup(self, address):
+        """Finds the name of the function holding an address.
+
+        @param address: the address, relative to the ELF file
+        @type address: int
+
+        @return: the name of the function, or None
+        @rtype: str
+        """
+        index = bisect_right(self._starts, address) - 1
+        if index < 0:
+            return None
+        size = self._sizes[index]
+        if size and address >= self._starts[index] + size:
+            return None
+        offset = self._base + self._offsets[index]
+        end = self._names.find(b'\0', offset)
+        return self._names[offset:end].decode('utf-8', errors='replace')
+
+    def save(self, filename):
+        """Saves the index to a file.
+
+        @param filename: path to the file
+        @type filename: str
+        """
+        # Concurrent instances must never load a partially written file.
+        with atomic_write(filename, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(self),
+                                 len(self._names)))
+            for values in (self._starts, self._sizes, self._offsets):
+                f.write(bytes(memoryview(values).cast('B')))
+            f.write(self._names[self._base:])
+
+    def close(self):
+        """Releases the file the index has been loaded from, if any."""
+        if self._map is None:
+            return
+        for values in (self._starts, self._sizes, self._offsets):
+            values.release()
+        self._map.close()
+        self._map = None
+
+
+def build_symbol_index(elf):
+    """Builds the index of the function symbols of an ELF file.
+
+    The symbols of the .symtab section are used, or those of the .dynsym
+    section if the file is stripped.
+
+    @param elf: the ELF file
+    @type elf: :class:`elftools.elf.elffile.ELFFile`
+
+    @return: the index
+    @rtype: :class:`SymbolIndex`
+    """
+    symbols = []
+    for name in ('.symtab', '.dynsym'):
+        section = elf.get_section_by_name(name)
+        if section is None:
+            continue
+        for symbol in section.iter_symbols():
+            if (symbol['st_info']['type'] == 'STT_FUNC' and
+                    symbol['st_value']):
+                symbols.append((symbol['st_value'],
+                                symbol['st_size'],
+                                symbol.name))
+        if symbols:
+            break
+    symbols.sort()
+    starts = array('Q')
+    sizes = array('Q')
+    offsets = array('Q')
+    names = bytearray()
+    for start, size, name in symbols:
+        starts.append(start)
+        sizes.append(size)
+        offsets.append(len(names))
+        names += name.encode('utf-8') + b'\0'
+    return SymbolIndex(starts, sizes, offsets, bytes(names))
+
+
+def load_symbol_index(filename):
+    """Loads an index of function symbols from a file.
+
+    The file is memory-mapped, so only the pages used by the lookups are
+    read.
+
+    @param filename: path to the file
+    @type filename: str
+
+    @return: the index, or None if the file is not a valid index
+    @rtype: :class:`SymbolIndex`
+    """
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+    if len(data) < _HEADER.size:
+        data.close()
+        return None
+    magic, version, count, size = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+    end = offset + count * 8 * 3 + size
+    if magic != _MAGIC or version != _VERSION or len(data) != end:
+        data.close()
+        return None
+    view = memoryview(data)
+    values = []
+    for i in range(3):
+        values.append(view[offset:offset + count * 8].cast('Q'))
+        offset += count * 8
+    view.release()
+    # The names are looked up in the mapping itself.
+    index = SymbolIndex(*values, names=data)
+    index._base = offset
+    index._map = data
+    return index
+
+
+class SymbolCache:
+    """Cache of the indexes of function symbols, by GNU build-id.
+
+    The index of the ELF file whose build-id is 'abcdef...' is stored in the
+    'ab/cdef...' file.
+
+    @param root: path to the cache
+    @type root: str
+    """
+    def __init__(self, root):
+        self._root = root
+
+    @property
+    def root(self):
+        return self._root
+
+    def get(self, elf, build_id=None):
+        """Gets the index of the function symbols of an ELF file.
+
+        The index is loaded from the cache, or built and stored in the cache.
+        It is not cached if the ELF file has no build-id.
+
+        @param elf: the ELF file
+        @type elf: :class:`elftools.elf.elffile.ELFFile`
+
+        @param build_id: the build-id of the ELF file, as an hexadecimal
+        string
+        @type build_id: str
+
+        @return: the index
+        @rtype: :class:`SymbolIndex`
+        """
+        if not build_id:
+            return build_symbol_index(elf)
+        filename = os.path.join(self._root, build_id[:2], build_id[2:])
+        if os.path.exists(filename):
+            index = load_symbol_index(filename)
+            if index is not None:
+                return index
+            debug(_("Ignoring invalid symbol index '{}'").format(filename))
+        index = build_symbol_index(elf)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        index.save(filename)
+        debug(_("Indexed {} symbols of build-id {}")
+              .format(len(index), build_id))
+        return index
+
+# vim: ts=4 sw=4 sts=4 et ai
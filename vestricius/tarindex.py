@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of vestricius
+#
+# Copyright (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+   vestricius.tarindex
+   ```````````````````
+
+   Seekable indexes of gzipped tarballs
+
+   :copyright: (C) 2015 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+   :license: GPLv3+
+"""
+
+import os
+import json
+import stat
+import hashlib
+import tarfile
+from .log import debug, info
+from .utils import atomic_write, iter_evictions
+from gettext import gettext as _
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+# Distance between two decompression checkpoints, in bytes of decompressed
+# data. Each checkpoint holds the last 32 KiB of data before it, so a 4 GiB
+# tarball needs an 8 MiB index, and reading a member decompresses 8 MiB at
+# most before reaching it.
+_SPACING = 16 * 1024 * 1024
+
+# Smaller tarballs are decompressed quickly enough from the start.
+_MIN_SIZE = 16 * 1024 * 1024
+
+# Maximum size of the store by default.
+_QUOTA = 256 * 1024 * 1024
+
+# Suffix of the file holding the checkpoints of an index.
+_CHECKPOINTS_SUFFIX = '.gzidx'
+
+_VERSION = 2
+
+
+def _get_member(info):
+    mode = stat.S_IMODE(info.mode)
+    if info.issym():
+        return (info.name, 0, info.offset_data, mode, info.linkname, None)
+    if info.islnk():
+        return (info.name, 0, info.offset_data, mode, None, info.linkname)
+    return (info.name, info.size, info.offset_data, mode, None, None)
+
+
+class IndexedTarball:
+    """Gzipped tarball read through its decompression checkpoints.
+
+    @param filename: path to the tarball
+    @type filename: str
+
+    @param members: name, size, offset in the decompressed data, permission
+    bits, target of the symbolic link and name of the member linked to of
+    the regular files and links of the tarball
+    @type members: list of tuple
+
+    @param fileobj: the decompressed data, with the checkpoints loaded
+    @type fileobj: :class:`indexed_gzip.IndexedGzipFile`
+    """
+    def __init__(self, filename, members, fileobj):
+        self._filename = filename
+        self._members = members
+        self._fileobj = fileobj
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def members(self):
+        return self._members
+
+    def read_at(self, offset, size):
+        """Reads decompressed data, starting from the nearest checkpoint.
+
+        @param offset: offset of the data in the decompressed tarball
+        @type offset: int
+
+        @param size: number of bytes to read
+        @type size: int
+
+        @return: the data
+        @rtype: bytes
+        """
+        self._fileobj.seek(offset)
+        return self._fileobj.read(size)
+
+    def close(self):
+        self._fileobj.close()
+
+
+class TarIndexStore:
+    """Stores the indexes of gzipped tarballs, which allow a member to be
+    read without decompressing the tarball from the start.
+
+    The index of a tarball is built the first time it is read, which
+    requires decompressing it entirely. It is made of the list of its
+    members, along with their offsets in the decompressed data, and of
+    checkpoints from which decompression can restart, as done by the zran
+    example of zlib.
+
+    The index is stored in the 'ab/cdef...' file, with the checkpoints in
+    the 'ab/cdef....gzidx' file, where 'abcdef...' is computed from the path,
+    the size and the modification time of the tarball.
+
+    When an index is added, the indexes of the tarballs which were removed or
+    modified are removed, then the least recently used ones if the size of
+    the store exceeds the quota.
+
+    Indexing requires the indexed_gzip package.
+
+    @param root: path to the store
+    @type root: str
+
+    @param min_size: minimum size of the tarballs to index
+    @type min_size: int
+
+    @param quota: maximum size of the store in bytes
+    @type quota: int
+    """
+    def __init__(self, root, min_size=_MIN_SIZE, quota=_QUOTA):
+        self._root = root
+        self._min_size = min_size
+        self._quota = quota
+
+    @property
+    def root(self):
+        return self._root
+
+    def _get_path(self, filename):
+        st = os.stat(filename)
+        ident = '{}:{}:{}'.format(os.path.realpath(filename),
+                                  st.st_size,
+                                  st.st_mtime_ns)
+        key = hashlib.sha1(ident.encode('utf-8', 'surrogateescape'))
+        key = key.hexdigest()
+        return os.path.join(self._root, key[:2], key[2:])
+
+    def open(self, filename):
+        """Opens a gzipped tarball through its index.
+
+        The index is loaded from the store, or built and stored.
+
+        @param filename: path to the tarball
+        @type filename: str
+
+        @return: the indexed tarball, or None if the tarball can not be
+        indexed
+        @rtype: :class:`IndexedTarball`
+        """
+        if indexed_gzip is None:
+            debug(_("Not indexing '{}': indexed_gzip not available")
+                  .format(filename))
+            return None
+        if os.path.getsize(filename) < self._min_size:
+            return None
+        path = self._get_path(filename)
+        tarball = self._load(filename, path)
+        if tarball is None:
+            tarball = self._build(filename, path)
+        return tarball
+
+    def _load(self, filename, path):
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            if entry['version'] != _VERSION:
+                return None
+            members = [tuple(m) for m in entry['members']]
+            index_file = path + _CHECKPOINTS_SUFFIX
+            fileobj = indexed_gzip.IndexedGzipFile(filename,
+                                                   spacing=_SPACING,
+                                                   index_file=index_file)
+            # The index is marked as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            debug(_("Ignoring index of '{}' ({})").format(filename, e))
+            return None
+        debug(_("Using index '{}'").format(path))
+        return IndexedTarball(filename, members, fileobj)
+
+    def _build(self, filename, path):
+        info(_("Indexing '{}'").format(filename))
+        fileobj = indexed_gzip.IndexedGzipFile(filename, spacing=_SPACING)
+        try:
+            # Reading the tarball as a stream creates the checkpoints along
+            # the way.
+            with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+                members = [_get_member(m) for m in tar
+                           if m.isfile() or m.issym() or m.islnk()]
+            fileobj.build_full_index()
+        except (OSError, EOFError, tarfile.TarError) as e:
+            debug(_("Can not index '{}' ({})").format(filename, e))
+            fileobj.close()
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The checkpoints are written first, so concurrent instances never
+        # find an entry without them.
+        with atomic_write(path + _CHECKPOINTS_SUFFIX, 'wb') as f:
+            fileobj.export_index(fileobj=f)
+        with atomic_write(path) as f:
+            json.dump({'version': _VERSION,
+                       'filename': os.path.realpath(filename),
+                       'members': members}, f)
+        self._evict(path)
+        return IndexedTarball(filename, members, fileobj)
+
+    def _is_stale(self, path):
+        # The index of a tarball which was removed or modified can not be
+        # used anymore.
+        try:
+            with open(path) as f:
+                filename = json.load(f)['filename']
+            return self._get_path(filename) != path
+        except (OSError, ValueError, KeyError, TypeError):
+            return True
+
+    def _evict(self, current):
+        entries = []
+        total = 0
+        for name in os.listdir(self._root):
+            folder = os.path.join(self._root, name)
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(folder, name)
+                if name.endswith(_CHECKPOINTS_SUFFIX):
+                    continue
+                if name.startswith('tmp'):
+                    # Left by an interrupted process, or being written.
+                    continue
+                files = [path, path + _CHECKPOINTS_SUFFIX]
+                if path != current and self._is_stale(path):
+                    debug(_("Removing stale index '{}'").format(path))
+                    self._remove(files)
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                    size = sum(os.stat(f).st_blocks * 512 for f in files)
+                except OSError:
+                    continue
+                if path != current:
+                    entries.append((mtime, files, size))
+                total += size
+        for mtime, files, size in iter_evictions(entries, total,
+                                                 self._quota):
+            debug(_("Removing index '{}'").format(files[0]))
+            self._remove(files)
+
+    def _remove(self, files):
+        for path in files:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+# vim: ts=4 sw=4 sts=4 et ai
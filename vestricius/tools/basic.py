@@ -29,41 +29,212 @@
 """
 
 import os
-from vestricius.log import info
+import re
+from vestricius.log import debug, info, warning
 from vestricius.elf import parse_core_dump_file
-from vestricius.common import find_file
-from vestricius.debugger import ProgramCrashInfo
+from vestricius.common import find_file, FileNotFoundError
+from vestricius.debugger import ProgramCrashInfo, UnwindError
 from gettext import gettext as _
 
 
 class CoreDumpAnalyzer:
-    """Analyzes a core dump file"""
-    def __init__(self, debugger):
+    """Analyzes a core dump file
+
+    @param debugger: debugger to use to generate the backtrace
+    @type debugger: :class:`Debugger`
+
+    @param build_ids: store used to find executables by build-id
+    @type build_ids: :class:`BuildIdStore`
+
+    @param unwinder: fast debugger to try first, falling back to `debugger`
+    if it can not unwind the stack
+    @type unwinder: :class:`Debugger`
+
+    @param backtraces: store of the backtraces of crashes already analyzed
+    @type backtraces: :class:`BacktraceStore`
+
+    @param files: index of the files of the search paths
+    @type files: :class:`FileIndex`
+    """
+    def __init__(self, debugger, build_ids=None, unwinder=None,
+                 backtraces=None, files=None):
         self._debugger = debugger
+        self._build_ids = build_ids
+        self._unwinder = unwinder
+        self._backtraces = backtraces
+        self._files = files
         self.search_paths = debugger.solib_paths
 
     @property
     def debugger(self):
         return self._debugger
 
-    def analyze(self, filename):
+    def find_executable(self, core_info):
+        """Finds the executable which generated a core dump file.
+
+        If the build-id of the executable is known, it is looked up in the
+        build-id store. Otherwise, the search paths are scanned for a file
+        with the name of the executable.
+
+        @param core_info: information from the core dump file
+        @type core_info: :class:`CoreDumpInfo`
+
+        @return: path to the unstripped binary executable file
+        @rtype: str
+        """
+        executable = core_info.process_info.name
+        info(_("Core dump file generated by '{}'").format(executable))
+        build_id = core_info.build_ids.get(core_info.executable)
+        if build_id and self._build_ids:
+            debug(_("Executable build-id is {}").format(build_id))
+            path = self._build_ids.lookup(build_id, self.search_paths)
+            if path:
+                info(_("Using {} as reference").format(path))
+                return path
+            msg = _("Can not find executable with build-id {}")
+            warning(msg.format(build_id))
+        if core_info.executable:
+            # The process name is truncated to 15 characters.
+            executable = os.path.basename(core_info.executable)
+        if self._files:
+            path = self._files.find_name(executable, self.search_paths)
+            if path is None:
+                msg = _("can not find '{}'")
+                raise FileNotFoundError(msg.format(executable))
+        else:
+            pattern = '^' + re.escape(executable) + '$'
+            path = find_file(pattern, self.search_paths)
+        info(_("Using {} as reference").format(path))
+        return path
+
+    def find_libraries(self, core_info):
+        """Finds the shared libraries mapped by the crashed program.
+
+        The search paths are looked up in the file index, or walked once,
+        looking for all the libraries at the same time. Libraries available
+        under the prefix of the debugger are not searched for, as the
+        debugger will find them by itself.
+
+        @param core_info: information from the core dump file
+        @type core_info: :class:`CoreDumpInfo`
+
+        @return: directories holding the libraries, or None if the core dump
+        file does not list the mapped files
+        @rtype: list of str
+        """
+        if not len(core_info.mappings):
+            return None
+        prefix = self._debugger.solib_prefix
+        wanted = set()
+        for path in core_info.mappings.paths:
+            name = os.path.basename(path)
+            if '.so' not in name:
+                continue
+            if prefix and os.path.exists(prefix + path):
+                continue
+            wanted.add(name)
+        folders = []
+        if self._files:
+            found = self._files.find_names(wanted, self.search_paths)
+            wanted.difference_update(found)
+            for folder in found.values():
+                if folder not in folders:
+                    folders.append(folder)
+        else:
+            for path in self.search_paths:
+                if not wanted:
+                    break
+                for root, dirs, files in os.walk(path):
+                    found = wanted.intersection(files)
+                    if found:
+                        wanted -= found
+                        folders.append(root)
+                        if not wanted:
+                            break
+        for name in sorted(wanted):
+            warning(_("Can not find shared library '{}'").format(name))
+        debug(_("Shared libraries found in {}").format(', '.join(folders)))
+        return folders
+
+    def lookup(self, filename, core_info):
+        """Looks for a crash with the same fingerprint already analyzed.
+
+        @param filename: path to the core dump file
+        @type filename: str
+
+        @param core_info: information from the core dump file
+        @type core_info: :class:`CoreDumpInfo`
+
+        @return: information about the crash, or None if it has not been
+        analyzed yet
+        @rtype: :class:`ProgramCrashInfo`
+        """
+        fingerprint = core_info.fingerprint
+        if not fingerprint or not self._backtraces:
+            return None
+        known = self._backtraces.lookup(fingerprint)
+        if not known:
+            return None
+        info(_("Crash {} already analyzed").format(fingerprint))
+        path, lines = known
+        return ProgramCrashInfo(executable=core_info.process_info.name,
+                                core_dump=os.path.basename(filename),
+                                backtrace=lines,
+                                debugger=path,
+                                fingerprint=fingerprint,
+                                threads=core_info.threads)
+
+    def analyze(self, filename, core_info=None, programfile=None):
         """Perform the analysis.
 
+        If a crash with the same fingerprint has already been analyzed, its
+        backtrace is reused and no debugger is run.
+
         @param filename: path to the core dump file
         @type filename: str
 
+        @param core_info: information from the core dump file, if already
+        parsed
+        @type core_info: :class:`CoreDumpInfo`
+
+        @param programfile: path to the executable, if already found
+        @type programfile: str
+
         @return: information about the crash
         @rtype; :class:`ProgramCrashInfo`
         """
-        core_info = parse_core_dump_file(filename)
-        executable = core_info.process_info.name
-        info(_("Core dump file generated by '{}'").format(executable))
-        pattern = '^' + executable + '$'
-        path = find_file(pattern, self.search_paths)
-        info(_("Using {} as reference").format(path))
-        lines = self._debugger.generate_backtrace(filename, path)
-        return ProgramCrashInfo(executable=executable,
+        if core_info is None or core_info.fingerprint is None:
+            # The stack may be missing from the beginning of a compressed core
+            # dump file the information was parsed from.
+            core_info = parse_core_dump_file(filename)
+        known = self.lookup(filename, core_info)
+        if known:
+            return known
+        fingerprint = core_info.fingerprint
+        programfile = programfile or self.find_executable(core_info)
+        folders = self.find_libraries(core_info)
+        if folders is None:
+            folders = self.search_paths
+        debugger = None
+        if self._unwinder:
+            try:
+                lines = self._unwinder.generate_backtrace(filename,
+                                                          programfile,
+                                                          folders)
+                debugger = self._unwinder
+            except UnwindError as e:
+                msg = _("Can not unwind stack ({}), falling back to {}")
+                info(msg.format(e, self._debugger.path))
+        if not debugger:
+            debugger = self._debugger
+            lines = debugger.generate_backtrace(filename, programfile, folders)
+        if fingerprint and self._backtraces:
+            self._backtraces.add(fingerprint, debugger.path, lines)
+        return ProgramCrashInfo(executable=core_info.process_info.name,
                                 core_dump=os.path.basename(filename),
-                                backtrace=lines)
+                                backtrace=lines,
+                                debugger=debugger.path,
+                                fingerprint=fingerprint,
+                                threads=core_info.threads)
 
 # vim: ts=4 sw=4 sts=4 et ai
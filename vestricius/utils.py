@@ -29,6 +29,8 @@
 """
 
 import os
+import contextlib
+import tempfile
 from gettext import bindtextdomain, textdomain
 
 
@@ -49,6 +51,119 @@ def get_data_dir():
     return os.path.normpath(data_dir)
 
 
+def get_cache_dir(*parts):
+    """Returns a cache directory, creating it if needed.
+
+    The root cache directory is set by the 'VESTRICIUS_CACHE_DIR' environment
+    variable, or defaults to 'vestricius' in the XDG cache directory.
+
+    @param parts: components of the path of the directory, relative to the
+    root cache directory
+
+    @return: the path to the cache directory
+    @rtype: str
+    """
+    root_dir = os.environ.get('VESTRICIUS_CACHE_DIR')
+    if not root_dir:
+        cache_home = os.environ.get('XDG_CACHE_HOME',
+                                    os.path.expanduser('~/.cache'))
+        root_dir = os.path.join(cache_home, 'vestricius')
+    path = os.path.join(root_dir, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+_SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text):
+    """Converts a size, such as '512M' or '10G', to a number of bytes.
+
+    @param text: the size, with an optional binary unit suffix
+    @type text: str
+
+    @return: the number of bytes
+    @rtype: int
+
+    @raise ValueError: if the size is invalid
+    """
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in _SIZE_UNITS:
+        return int(float(text[:-1]) * _SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    """Converts a number of bytes to a size, such as '1.5M'.
+
+    @param size: the number of bytes
+    @type size: int
+
+    @return: the size, with a binary unit suffix if needed
+    @rtype: str
+    """
+    for unit in 'TGMK':
+        if size >= _SIZE_UNITS[unit]:
+            return '{:.1f}{}'.format(size / _SIZE_UNITS[unit], unit)
+    return str(size)
+
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='w'):
+    """Opens a file to be written atomically, for the duration of the context.
+
+    The content is written to a temporary file in the same directory, which
+    replaces the file when the context exits, so concurrent processes never
+    read a partially written file. If an error occurs in the context, the
+    temporary file is removed and the file is left unchanged.
+
+    @param filename: path to the file
+    @type filename: str
+
+    @param mode: mode to open the temporary file with, 'w' or 'wb'
+    @type mode: str
+
+    @return: the temporary file
+    @rtype: file object
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, filename)
+    except:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def iter_evictions(entries, total, quota):
+    """Selects the least recently used entries to remove from a cache.
+
+    @param entries: list of (mtime, key, size) tuples of the entries which
+    can be removed
+    @type entries: list of tuple
+
+    @param total: total size of the cache, including the entries which can
+    not be removed
+    @type total: int
+
+    @param quota: maximum size of the cache
+    @type quota: int
+
+    @return: the entries to remove, oldest first, until the total size fits
+    in the quota
+    @rtype: iterator of tuple
+    """
+    for entry in sorted(entries, key=lambda e: e[0]):
+        if total <= quota:
+            break
+        total -= entry[2]
+        yield entry
+
+
 def setup_i18n():
     """Set up internationalization."""
     root_dir = os.path.dirname(os.path.abspath(__file__))